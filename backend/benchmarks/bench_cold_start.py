@@ -0,0 +1,79 @@
+"""
+Cold-start cost of the backend: wall time and peak memory of fresh Python
+processes that set up Django, which is what every management command,
+Celery worker and server process pays before doing any work.
+
+    python benchmarks/bench_cold_start.py --runs 10
+    python benchmarks/bench_cold_start.py --imports 15   # slowest imports too
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    'manage.py check': [sys.executable, 'manage.py', 'check'],
+    'manage.py help': [sys.executable, 'manage.py', 'help'],
+    # What a server process loads before its first request
+    'urls loaded': [sys.executable, '-c',
+                    'import django; django.setup(); from django.urls import resolve; resolve("/api/search/")'],
+}
+
+
+def measure(command):
+    """
+    (seconds, peak RSS in MB) of one run.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                               env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'config.settings'})
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    if status:
+        raise RuntimeError(f'{" ".join(command)} failed: {process.stderr.read().decode()}')
+    process.stderr.close()
+    # ru_maxrss is in KB on Linux
+    return elapsed, usage.ru_maxrss / 1024
+
+
+def slowest_imports(count):
+    """
+    The `count` top-level imports with the largest cumulative time, from
+    python -X importtime.
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', 'manage.py', 'check'], cwd=BACKEND_DIR,
+                            capture_output=True, text=True).stderr
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative) / 1000, name.rstrip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--imports', type=int, default=0, help='Also list this many of the slowest imports')
+    args = parser.parse_args()
+
+    for name, command in COMMANDS.items():
+        measure(command)  # warm the page cache and .pyc files
+        samples = [measure(command) for _ in range(args.runs)]
+        times = sorted(seconds for seconds, _ in samples)
+        print(f'{name:<18} median {statistics.median(times) * 1000:7.1f} ms  '
+              f'min {times[0] * 1000:7.1f} ms  peak RSS {max(rss for _, rss in samples):6.1f} MB')
+
+    if args.imports:
+        print(f'\nslowest imports (cumulative ms):')
+        for ms, name in slowest_imports(args.imports):
+            print(f'{ms:9.1f}  {name}')
+
+
+if __name__ == '__main__':
+    main()
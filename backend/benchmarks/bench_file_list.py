@@ -0,0 +1,119 @@
+"""
+File list and ingest lookup latency on a large File table.
+
+Measures /api/files/ with keyset (cursor) pagination on the first page and
+deep into the table, the equivalent OFFSET query for comparison, and the
+per-file lookup ingest does by path (unique index) against an unindexed
+column.
+
+    python benchmarks/bench_file_list.py --rows 1000000
+"""
+import argparse
+import random
+import statistics
+
+from common import Timer, bench_environment
+
+CHUNK = 10000
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {
+        'p50': statistics.median(samples) * 1000,
+        'p95': samples[int(len(samples) * 0.95) - 1] * 1000,
+    }
+
+
+def report(name, samples):
+    p = percentiles(samples)
+    print(f'{name:<38} p50 {p["p50"]:>8.2f} ms   p95 {p["p95"]:>8.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--samples', type=int, default=50)
+    parser.add_argument('--page-size', type=int, default=50)
+    args = parser.parse_args()
+
+    with bench_environment():
+        from django.db.models.signals import post_save
+        from django.test import Client
+        from core.models import File
+        from core.signals import update_index
+
+        # Time the database work only, not the indexing the save would queue
+        post_save.disconnect(update_index, sender=File)
+
+        types = ['pdf', 'txt', 'md', 'py', 'html']
+        with Timer() as t:
+            for start in range(0, args.rows, CHUNK):
+                File.objects.bulk_create([
+                    File(
+                        path=f'/data/notes/{i // 1000:04d}/file_{i:07d}.{types[i % 5]}',
+                        name=f'file_{i:07d}.{types[i % 5]}',
+                        file_type=types[i % 5],
+                        size=(i * 7919) % 5_000_000,
+                    )
+                    for i in range(start, min(start + CHUNK, args.rows))
+                ])
+        print(f'Inserted {args.rows} rows in {t.elapsed:.1f}s\n')
+
+        client = Client()
+        rng = random.Random(0)
+
+        samples = []
+        for _ in range(args.samples):
+            with Timer() as t:
+                response = client.get(f'/api/files/?page_size={args.page_size}')
+            samples.append(t.elapsed)
+        report('list first page (cursor)', samples)
+
+        # Walk deep into the table with cursors, timing each hop
+        url = f'/api/files/?page_size={args.page_size}&created_before=2100-01-01'
+        hops = []
+        for _ in range(args.samples):
+            with Timer() as t:
+                response = client.get(url)
+            hops.append(t.elapsed)
+            url = response.json()['next']
+        report('list next page (cursor)', hops)
+
+        samples = []
+        for _ in range(args.samples):
+            with Timer() as t:
+                client.get(f'/api/files/?file_type=pdf&min_size=1000000&page_size={args.page_size}')
+            samples.append(t.elapsed)
+        report('list filtered by type and size', samples)
+
+        samples = []
+        for _ in range(args.samples):
+            offset = rng.randrange(args.rows // 2, args.rows - args.page_size)
+            with Timer() as t:
+                list(File.objects.order_by('-created_at', '-id')[offset:offset + args.page_size])
+            samples.append(t.elapsed)
+        report('deep page by OFFSET (for comparison)', samples)
+
+        samples = []
+        for _ in range(args.samples):
+            i = rng.randrange(args.rows)
+            with Timer() as t:
+                File.objects.update_or_create(
+                    path=f'/data/notes/{i // 1000:04d}/file_{i:07d}.{types[i % 5]}',
+                    defaults={'size': i},
+                )
+            samples.append(t.elapsed)
+        report('ingest update_or_create by path', samples)
+
+        samples = []
+        for _ in range(min(args.samples, 10)):
+            i = rng.randrange(args.rows)
+            with Timer() as t:
+                File.objects.filter(name=f'file_{i:07d}.{types[i % 5]}').first()
+            samples.append(t.elapsed)
+        report('lookup by unindexed name (baseline)', samples)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Compare indexing throughput of the per-save path (core.search.index_file, one
+commit per document) against the bulk indexer (core.search.BulkIndexer).
+
+    python benchmarks/bench_indexing.py --docs 2000 --batch-size 500
+"""
+import argparse
+import os
+
+from common import Timer, bench_environment, fresh_index, write_text_corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=2000)
+    parser.add_argument('--words', type=int, default=200, help='Words per document')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--procs', type=int, default=1)
+    args = parser.parse_args()
+
+    with bench_environment() as tmp:
+        from core.models import File
+        from core.search import bulk_index, index_file
+
+        paths = write_text_corpus(os.path.join(tmp, 'corpus'), args.docs, args.words)
+        # bulk_create skips post_save, so nothing is indexed yet
+        files = File.objects.bulk_create([
+            File(path=p, name=os.path.basename(p), file_type='txt', size=os.path.getsize(p))
+            for p in paths
+        ])
+        files = list(File.objects.order_by('id'))
+
+        results = {}
+
+        ix = fresh_index(tmp, 'per_save')
+        with Timer() as t:
+            for file_obj in files:
+                index_file(file_obj)
+        results['per-save'] = (t.elapsed, len(ix._segments()))
+
+        ix = fresh_index(tmp, 'bulk')
+        with Timer() as t:
+            bulk_index(files, batch_size=args.batch_size, procs=args.procs)
+        results['bulk'] = (t.elapsed, len(ix._segments()))
+
+        print(f'{args.docs} documents, {args.words} words each')
+        print(f'{"path":<10} {"seconds":>9} {"docs/s":>9} {"segments":>9}')
+        for name, (elapsed, segments) in results.items():
+            print(f'{name:<10} {elapsed:>9.2f} {args.docs / elapsed:>9.0f} {segments:>9}')
+        print(f'speedup: {results["per-save"][0] / results["bulk"][0]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+How indexing and query throughput scale with the number of index shards.
+
+For each shard count the corpus is written with core.rebuild.rebuild_index
+(one writer process per shard), then `--clients` threads run random queries
+through core.search.search_files, which fans each query out over the shards.
+
+    python benchmarks/bench_shards.py --docs 5000 --shards 1 2 4 --clients 4
+"""
+import argparse
+import os
+import random
+import statistics
+import threading
+
+from common import WORDS, Timer, bench_environment, fresh_index, write_text_corpus
+
+
+def run_queries(search_files, queries, clients):
+    latencies = []
+    lock = threading.Lock()
+
+    def client(batch):
+        timings = []
+        for query in batch:
+            with Timer() as t:
+                search_files(query, page_size=20)
+            timings.append(t.elapsed)
+        with lock:
+            latencies.extend(timings)
+
+    threads = [threading.Thread(target=client, args=(queries[i::clients],)) for i in range(clients)]
+    with Timer() as total:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return total.elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=5000)
+    parser.add_argument('--words', type=int, default=200, help='Words per document')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--queries', type=int, default=400)
+    parser.add_argument('--clients', type=int, default=4, help='Concurrent query threads')
+    args = parser.parse_args()
+
+    with bench_environment() as tmp:
+        from core.models import File
+        from core.rebuild import rebuild_index
+        from core.search import index_manager, search_files
+
+        paths = write_text_corpus(os.path.join(tmp, 'corpus'), args.docs, args.words)
+        File.objects.bulk_create([
+            File(path=p, name=os.path.basename(p), file_type='txt', size=os.path.getsize(p))
+            for p in paths
+        ])
+        rng = random.Random(1)
+        queries = [' OR '.join(rng.sample(WORDS, 2)) for _ in range(args.queries)]
+
+        rows = []
+        for shards in args.shards:
+            fresh_index(tmp, f'index_{shards}')
+            with Timer() as t:
+                rebuild_index(reextract=True, shards=shards)
+            assert index_manager.shard_count() == shards
+
+            search_files(queries[0])  # open searchers
+            elapsed, latencies = run_queries(search_files, queries, args.clients)
+            latencies.sort()
+            rows.append((
+                shards,
+                args.docs / t.elapsed,
+                len(queries) / elapsed,
+                statistics.median(latencies) * 1000,
+                latencies[int(len(latencies) * 0.95) - 1] * 1000,
+            ))
+
+        print(f'{args.docs} documents, {args.words} words each, {args.clients} query clients')
+        print(f'{"shards":>6} {"index docs/s":>13} {"queries/s":>10} {"p50 ms":>8} {"p95 ms":>8}')
+        for shards, index_rate, qps, p50, p95 in rows:
+            print(f'{shards:>6} {index_rate:>13.0f} {qps:>10.1f} {p50:>8.1f} {p95:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
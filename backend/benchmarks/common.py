@@ -0,0 +1,158 @@
+"""
+Shared setup for the benchmark scripts.
+
+Benchmarks run against a throwaway test database and a temporary index
+directory, so they never touch db.sqlite3 or search_index/.
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+WORDS = (
+    'alpha beta gamma delta epsilon zeta theta kappa lambda sigma omega '
+    'index search query segment writer reader commit merge shard cache '
+    'python django whoosh celery redis sqlite notes paper draft report '
+    'meeting budget design review release roadmap summary appendix'
+).split()
+
+
+@contextmanager
+def bench_environment():
+    """
+    Set up Django with a test database and point the search index at a
+    temporary directory. Yields the temporary directory.
+    """
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+    from core import search
+
+    setup_test_environment()
+    old_db = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    tmp = tempfile.mkdtemp(prefix='pkse-bench-')
+    tmp_settings = override_settings(SEARCH_INDEX_DIR=os.path.join(tmp, 'index'),
+                                     EXTRACTION_CACHE_DIR=os.path.join(tmp, 'extraction_cache'),
+                                     TEXT_STORE_DIR=os.path.join(tmp, 'text_store'))
+    tmp_settings.enable()
+    try:
+        yield tmp
+    finally:
+        tmp_settings.disable()
+        search.reset_index()
+        connection.creation.destroy_test_db(old_db, verbosity=0)
+        teardown_test_environment()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def fresh_index(tmp, name='index'):
+    """Point the search module at a new, empty index directory."""
+    from django.conf import settings
+    from core import search
+    settings.SEARCH_INDEX_DIR = os.path.join(tmp, name)
+    shutil.rmtree(settings.SEARCH_INDEX_DIR, ignore_errors=True)
+    search.reset_index()
+    return search.get_index()
+
+
+def random_text(rng, words=200):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def write_text_corpus(directory, count, words=200, seed=0):
+    """Write `count` small text files and return their paths."""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f'note_{i:06d}.txt')
+        with open(path, 'w') as f:
+            f.write(random_text(rng, words))
+        paths.append(path)
+    return paths
+
+
+def write_pdf(path, pages):
+    """
+    Write a minimal PDF with one Helvetica text page per entry of `pages`,
+    each a list of lines. Enough for pypdf to extract, no PDF library needed.
+    """
+    kids = ' '.join(f'{4 + 2 * i} 0 R' for i in range(len(pages)))
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        f'<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>'.encode(),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    for i, lines in enumerate(pages):
+        stream = ('BT /F1 10 Tf 12 TL 50 780 Td ' + ' '.join(f"({line}) '" for line in lines) + ' ET').encode()
+        objects.append((
+            '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>'
+        ).encode())
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n'.encode() + stream + b'\nendstream')
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f'{number} 0 obj\n'.encode() + body + b'\nendobj\n'
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    for offset in offsets:
+        out += f'{offset:010d} 00000 n \n'.encode()
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+    with open(path, 'wb') as f:
+        f.write(out)
+
+
+def write_mixed_corpus(directory, count, words=200, pdf_share=0.1, md_share=0.3, seed=0):
+    """
+    Write `count` documents of about `words` words each: PDFs (a few pages of
+    12-word lines), markdown notes with headings and plain text, in the given
+    proportions. Returns the paths.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < pdf_share:
+            path = os.path.join(directory, f'paper_{i:06d}.pdf')
+            lines = [random_text(rng, 12) for _ in range(max(1, words // 12))]
+            write_pdf(path, [lines[j:j + 50] for j in range(0, len(lines), 50)])
+        elif kind < pdf_share + md_share:
+            path = os.path.join(directory, f'note_{i:06d}.md')
+            sections = [f'## {rng.choice(WORDS).title()}\n\n{random_text(rng, 40)}\n' for _ in range(max(1, words // 40))]
+            with open(path, 'w') as f:
+                f.write(f'# {random_text(rng, 3).title()}\n\n' + '\n'.join(sections))
+        else:
+            path = os.path.join(directory, f'text_{i:06d}.txt')
+            with open(path, 'w') as f:
+                f.write(random_text(rng, words))
+        paths.append(path)
+    return paths
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    return samples[min(len(samples) - 1, max(0, int(len(samples) * fraction + 0.5) - 1))]
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        return False
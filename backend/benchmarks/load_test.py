@@ -0,0 +1,170 @@
+"""
+Load test the search API deployed under WSGI and under ASGI.
+
+By default both deployments are started against the configured database and
+index (so ingest something first): WSGI with gunicorn if it is installed,
+else the threaded runserver, and ASGI with uvicorn. Each one gets
+--concurrency open keep-alive connections sending search requests back to
+back for --duration seconds. Reports requests/s, errors and latency
+percentiles per deployment.
+
+    python benchmarks/load_test.py --concurrency 500 --duration 20
+    python benchmarks/load_test.py --target asgi=http://127.0.0.1:8000 --path '/api/files/'
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from urllib.parse import quote, urlsplit
+
+from common import BACKEND_DIR, WORDS
+
+
+def server_commands(wsgi_port, asgi_port, workers):
+    if importlib.util.find_spec('gunicorn'):
+        wsgi = [sys.executable, '-m', 'gunicorn', 'config.wsgi:application', '-b', f'127.0.0.1:{wsgi_port}',
+                '-w', str(workers), '--threads', '8', '--log-level', 'warning']
+    else:
+        wsgi = [sys.executable, 'manage.py', 'runserver', '--noreload', f'127.0.0.1:{wsgi_port}']
+    asgi = [sys.executable, '-m', 'uvicorn', 'config.asgi:application', '--port', str(asgi_port),
+            '--workers', str(workers), '--log-level', 'warning', '--no-access-log']
+    return {'wsgi': (wsgi, f'http://127.0.0.1:{wsgi_port}'), 'asgi': (asgi, f'http://127.0.0.1:{asgi_port}')}
+
+
+def wait_until_up(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base_url + '/api/index/stats/', timeout=2).read()
+            return
+        except OSError:
+            time.sleep(0.3)
+    raise RuntimeError(f'{base_url} did not come up')
+
+
+async def read_response(reader):
+    """
+    Read one HTTP/1.1 response. Returns (status, keep_alive).
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        await reader.read()
+        return status, False
+    return status, headers.get('connection', '').lower() != 'close'
+
+
+async def client(host, port, paths, deadline, latencies, errors):
+    reader = writer = None
+    while time.monotonic() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            path = random.choice(paths)
+            start = time.perf_counter()
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode())
+            status, keep_alive = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors[status] = errors.get(status, 0) + 1
+            if not keep_alive:
+                writer.close()
+                writer = None
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError) as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            if writer is not None:
+                writer.close()
+                writer = None
+            await asyncio.sleep(0.05)
+    if writer is not None:
+        writer.close()
+
+
+async def run_load(base_url, paths, concurrency, duration):
+    url = urlsplit(base_url)
+    latencies, errors = [], {}
+    deadline = time.monotonic() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(url.hostname, url.port or 80, paths, deadline, latencies, errors) for _ in range(concurrency)
+    ))
+    return time.perf_counter() - start, latencies, errors
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000 if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', action='append', default=[],
+                        help='name=url of an already running deployment (repeatable); skips starting servers')
+    parser.add_argument('--concurrency', type=int, default=200, help='Open connections per deployment')
+    parser.add_argument('--duration', type=float, default=15, help='Seconds per deployment')
+    parser.add_argument('--workers', type=int, default=1, help='Server worker processes')
+    parser.add_argument('--path', action='append', default=[], help='Request path(s), default random searches')
+    parser.add_argument('--wsgi-port', type=int, default=8101)
+    parser.add_argument('--asgi-port', type=int, default=8102)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    paths = args.path or [
+        '/api/search/?q=' + quote(' OR '.join(rng.sample(WORDS, 2))) + '&facets=0' for _ in range(50)
+    ]
+
+    if args.target:
+        targets = {name: (None, url) for name, _, url in (t.partition('=') for t in args.target)}
+    else:
+        targets = server_commands(args.wsgi_port, args.asgi_port, args.workers)
+
+    rows = []
+    for name, (command, base_url) in targets.items():
+        process = None
+        if command:
+            process = subprocess.Popen(command, cwd=BACKEND_DIR, env={**os.environ, 'PKSE_ASGI': str(int(name == 'asgi'))})
+        try:
+            wait_until_up(base_url)
+            elapsed, latencies, errors = asyncio.run(run_load(base_url, paths, args.concurrency, args.duration))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+        latencies.sort()
+        rows.append((name, len(latencies) / elapsed, sum(errors.values()), errors,
+                     statistics.median(latencies) * 1000 if latencies else float('nan'),
+                     percentile(latencies, 0.95), percentile(latencies, 0.99)))
+
+    print(f'{args.concurrency} connections, {args.duration:.0f}s per deployment')
+    print(f'{"deployment":<11} {"req/s":>8} {"errors":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for name, rps, error_count, errors, p50, p95, p99 in rows:
+        print(f'{name:<11} {rps:>8.1f} {error_count:>7} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f}')
+        if errors:
+            print(f'{"":<11} errors: {errors}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+Benchmark suite for ingest, extraction, indexing and search.
+
+Generates a synthetic corpus of text, markdown and PDF files, then measures:
+
+  ingest        ingest_directory() over the whole corpus (scan, upsert, index)
+  extract       extract_text_from_file() per file, by file type
+  index_file    the per-save indexing path, one commit per document
+  bulk_reindex  bulk_index() of every file into a fresh index
+  search        GET /api/search/ latency, with the query cache cleared
+
+Results are written as JSON. With --baseline they are compared against an
+earlier results file and the run fails (exit status 1) if any metric is more
+than --threshold worse. Compare runs of the same scale on the same machine.
+
+    python benchmarks/suite.py --scale small --output results.json
+    python benchmarks/suite.py --scale small --save-baseline benchmarks/baseline.json
+    python benchmarks/suite.py --scale small --baseline benchmarks/baseline.json --threshold 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+from common import WORDS, Timer, bench_environment, fresh_index, percentile, write_mixed_corpus
+
+# docs, words per doc, per-save docs, search queries
+SCALES = {
+    'small': (300, 200, 100, 200),
+    'medium': (3000, 300, 300, 500),
+    'large': (30000, 300, 500, 1000),
+}
+
+
+def latency_metrics(prefix, samples):
+    samples = sorted(samples)
+    return {
+        f'{prefix}.p50_ms': (statistics.median(samples) * 1000, 'lower'),
+        f'{prefix}.p95_ms': (percentile(samples, 0.95) * 1000, 'lower'),
+        f'{prefix}.p99_ms': (percentile(samples, 0.99) * 1000, 'lower'),
+    }
+
+
+def bench_ingest(tmp, corpus_dir, docs):
+    from core.ingest import ingest_directory
+
+    fresh_index(tmp, 'ingest')
+    with Timer() as t:
+        count, errors = ingest_directory(corpus_dir)
+    if errors or count != docs:
+        raise RuntimeError(f'ingest failed: {count} of {docs} files, errors: {errors[:3]}')
+    return {'ingest.docs_per_s': (docs / t.elapsed, 'higher'), 'ingest.seconds': (t.elapsed, 'lower')}
+
+
+def bench_extract(paths):
+    from core.utils import extract_text_from_file
+
+    by_type = {}
+    for path in paths:
+        with Timer() as t:
+            extract_text_from_file(path)
+        by_type.setdefault(os.path.splitext(path)[1].lstrip('.'), []).append(t.elapsed)
+    metrics = {}
+    for file_type, samples in sorted(by_type.items()):
+        metrics.update(latency_metrics(f'extract.{file_type}', samples))
+    return metrics
+
+
+def bench_index_file(tmp, files):
+    from core.search import index_file
+
+    fresh_index(tmp, 'per_save')
+    samples = []
+    for file_obj in files:
+        with Timer() as t:
+            index_file(file_obj)
+        samples.append(t.elapsed)
+    return latency_metrics('index_file', samples)
+
+
+def bench_bulk_reindex(tmp, files):
+    from core.search import bulk_index
+
+    fresh_index(tmp, 'bulk')
+    with Timer() as t:
+        bulk_index(files)
+    return {'bulk_reindex.docs_per_s': (len(files) / t.elapsed, 'higher')}
+
+
+def bench_search(queries):
+    from django.conf import settings
+    from django.core.cache import caches
+    from django.test import Client
+
+    client = Client()
+    cache = caches[settings.SEARCH_CACHE_ALIAS]
+    client.get('/api/search/', {'q': queries[0]})  # open searchers
+    samples = []
+    for query in queries:
+        cache.clear()
+        with Timer() as t:
+            response = client.get('/api/search/', {'q': query})
+        if response.status_code != 200:
+            raise RuntimeError(f'search for {query!r} returned {response.status_code}')
+        samples.append(t.elapsed)
+    return latency_metrics('search', samples)
+
+
+def run(args):
+    docs, words, per_save, query_count = SCALES[args.scale]
+    docs = args.docs or docs
+    metrics = {}
+
+    with bench_environment() as tmp:
+        from core.models import File
+
+        corpus_dir = os.path.join(tmp, 'corpus')
+        paths = write_mixed_corpus(corpus_dir, docs, words, pdf_share=args.pdf_share, seed=args.seed)
+
+        metrics.update(bench_ingest(tmp, corpus_dir, docs))
+        metrics.update(bench_extract(paths))
+        files = list(File.objects.order_by('id'))
+        metrics.update(bench_index_file(tmp, files[:per_save]))
+        metrics.update(bench_bulk_reindex(tmp, files))
+
+        rng = random.Random(args.seed)
+        queries = [rng.choice([
+            rng.choice(WORDS),
+            ' '.join(rng.sample(WORDS, 2)),
+            ' OR '.join(rng.sample(WORDS, 2)),
+            f'"{" ".join(rng.sample(WORDS, 2))}"',
+        ]) for _ in range(query_count)]
+        metrics.update(bench_search(queries))
+
+    return {
+        'meta': {
+            'scale': args.scale,
+            'docs': docs,
+            'words': words,
+            'pdf_share': args.pdf_share,
+            'seed': args.seed,
+            'python': platform.python_version(),
+            'machine': platform.node(),
+            'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'metrics': {name: {'value': round(value, 4), 'better': better} for name, (value, better) in metrics.items()},
+    }
+
+
+def compare(results, baseline, threshold, min_ms=0.0):
+    """
+    Metrics more than `threshold` (a fraction) worse than the baseline, as
+    (name, baseline value, new value, relative change) rows. Latencies that
+    moved by less than `min_ms` are noise and never count.
+    """
+    regressions = []
+    for name, base in baseline['metrics'].items():
+        new = results['metrics'].get(name)
+        if new is None or not base['value']:
+            continue
+        if name.endswith('_ms') and abs(new['value'] - base['value']) < min_ms:
+            continue
+        change = (new['value'] - base['value']) / base['value']
+        worse = change if base['better'] == 'lower' else -change
+        if worse > threshold:
+            regressions.append((name, base['value'], new['value'], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--docs', type=int, help='Override the number of documents for the scale')
+    parser.add_argument('--pdf-share', type=float, default=0.1, help='Fraction of the corpus that is PDF')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results JSON here (default: stdout)')
+    parser.add_argument('--baseline', help='Results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown per metric (0.2 = 20%%)')
+    parser.add_argument('--min-ms', type=float, default=0.5,
+                        help='Ignore latency changes smaller than this many milliseconds')
+    parser.add_argument('--save-baseline', help='Also write the results to this baseline file')
+    args = parser.parse_args()
+
+    results = run(args)
+    output = json.dumps(results, indent=2)
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w') as f:
+            f.write(output + '\n')
+    if not args.output:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('scale') != results['meta']['scale'] or baseline['meta'].get('docs') != results['meta']['docs']:
+            print('warning: baseline was run at a different scale', file=sys.stderr)
+        regressions = compare(results, baseline, args.threshold, args.min_ms)
+        for name, old, new, change in regressions:
+            print(f'REGRESSION {name}: {old:.2f} -> {new:.2f} ({change:+.0%})', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f'no regressions beyond {args.threshold:.0%} against {args.baseline}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Route search, file list and job status to the native async views
+os.environ.setdefault('PKSE_ASGI', '1')
 
 application = get_asgi_application()
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+from corsheaders.defaults import default_headers
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -30,6 +32,9 @@ ALLOWED_HOSTS = []
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
 ]
+# Chunked uploads send and read the upload offset in a header
+CORS_ALLOW_HEADERS = (*default_headers, "upload-offset", "x-pkse-profile")
+CORS_EXPOSE_HEADERS = ["Upload-Offset", "Server-Timing"]
 
 
 # Application definition
@@ -47,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.metrics_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -133,7 +139,163 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Celery Configuration
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
+# Run tasks inline instead of sending them to the broker (tests, scripts)
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('PKSE_TASKS_EAGER') == '1'
+# Without a reachable broker, run tasks on an in-process background thread
+TASKS_LOCAL_FALLBACK = True
+
+# Serve the async search, file list and job views (set by config/asgi.py)
+ASYNC_API = os.environ.get('PKSE_ASGI') == '1'
+# Threads for blocking Whoosh/ORM work in async views. This bounds how many
+# searches run at once, not how many connections can wait. 0 uses asgiref's
+# single thread-sensitive executor instead
+ASYNC_BLOCKING_WORKERS = 32
 
 # Media files (Uploads)
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / 'media'
\ No newline at end of file
+MEDIA_ROOT = BASE_DIR / 'media'
+# Uploads are written here while they arrive, then moved into MEDIA_ROOT.
+# Keep it on the same filesystem so the move is a rename
+UPLOAD_TEMP_DIR = MEDIA_ROOT / '.uploads'
+# Bytes read from the request per write
+UPLOAD_READ_SIZE = 1024 * 1024
+
+# Search indexing
+# Where the index (all its generations and shards) lives
+SEARCH_INDEX_DIR = BASE_DIR / 'search_index'
+# Bulk indexing commits after this many documents or seconds, whichever comes first
+SEARCH_INDEX_BATCH_SIZE = 1000
+SEARCH_INDEX_COMMIT_INTERVAL = 30
+# Processes used by the bulk writer (>1 uses Whoosh's multiprocessing writer)
+SEARCH_INDEX_PROCS = 1
+# Memory (MB) each writer process may use before flushing to disk
+SEARCH_INDEX_LIMITMB = 128
+# Seconds a writer waits for a shard's write lock (held by another worker,
+# optimize_index or the end of a rebuild) before giving up with LockError
+SEARCH_INDEX_LOCK_TIMEOUT = 60
+# Store the full extracted text in the index. When False, content is only
+# indexed and snippets come from a compressed text store (see rebuild_index)
+SEARCH_STORE_CONTENT = True
+# Where that text store keeps its files
+TEXT_STORE_DIR = BASE_DIR / 'text_store'
+# Index each file as overlapping passages of about SEARCH_PASSAGE_CHARS
+# characters (with their PDF page), grouped back to the file at query time.
+# Applies to new indexes; switch an existing one with rebuild_index --passages
+SEARCH_PASSAGES = False
+SEARCH_PASSAGE_CHARS = 2000
+SEARCH_PASSAGE_OVERLAP = 200
+# /api/suggest/ completes the last word once it has SUGGEST_MIN_PREFIX
+# characters. Terms only found in content need SUGGEST_MIN_DOC_FREQ documents,
+# and at most SUGGEST_SCAN_LIMIT candidates are ranked per prefix. A document
+# with the term in its title counts SUGGEST_TITLE_WEIGHT times
+SUGGEST_MIN_PREFIX = 2
+SUGGEST_MIN_DOC_FREQ = 2
+SUGGEST_TITLE_WEIGHT = 3
+SUGGEST_SCAN_LIMIT = 5000
+# Without stored content, deleted documents are taken off the suggestion
+# counts using the text store's (possibly newer) text. Segments counted that
+# way are recounted exactly from their postings this often, in seconds
+SUGGEST_RECOUNT_INTERVAL = 3600
+# Shards for a new index (documents go to shard File.id % SEARCH_SHARDS).
+# An existing index keeps its layout until `manage.py reshard`
+SEARCH_SHARDS = 1
+# Threads that run a query on the shards of a sharded index in parallel
+SEARCH_FANOUT_THREADS = 8
+# Index generations to keep after a rebuild besides the live one, for
+# `rebuild_index --rollback`
+SEARCH_KEEP_GENERATIONS = 1
+
+# Index maintenance
+# How segments are merged on commit: 'small' (Whoosh's default), 'tiered'
+# (merge once SEARCH_MERGE_FACTOR segments of similar size pile up) or 'none'
+# (leave it all to optimize_index)
+SEARCH_MERGE_POLICY = 'tiered'
+SEARCH_MERGE_FACTOR = 10
+# optimize_index only merges when the index has more segments than this or a
+# larger share of deleted documents, unless forced
+SEARCH_OPTIMIZE_MAX_SEGMENTS = 10
+SEARCH_OPTIMIZE_MAX_DELETED = 0.2
+# Seconds between scheduled optimize runs (celery beat)
+SEARCH_OPTIMIZE_INTERVAL = 6 * 60 * 60
+CELERY_BEAT_SCHEDULE = {
+    'optimize-index': {
+        'task': 'core.tasks.optimize_index_task',
+        'schedule': SEARCH_OPTIMIZE_INTERVAL,
+    },
+}
+
+# Search result cache: LRU (MAX_ENTRIES) with a TTL. Any backend works, e.g.
+# FileBasedCache to share it between worker processes.
+SEARCH_CACHE_ALIAS = 'search'
+SEARCH_CACHE_TIMEOUT = 300
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    SEARCH_CACHE_ALIAS: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pkse-search',
+        'TIMEOUT': SEARCH_CACHE_TIMEOUT,
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    },
+}
+
+# Directory ingest upserts File rows in chunks of this size, one transaction each
+INGEST_CHUNK_SIZE = 500
+
+# watch_files: directories to watch when none are given on the command line
+WATCH_ROOTS = []
+# Apply a batch of changes once nothing has changed for WATCH_DEBOUNCE seconds,
+# or WATCH_MAX_DELAY seconds after its first change at the latest
+WATCH_DEBOUNCE = 1.0
+WATCH_MAX_DELAY = 10.0
+# Seconds between rescans when inotify isn't available
+WATCH_POLL_INTERVAL = 30
+
+# Text extraction
+# Worker processes for bulk extraction (1 extracts inline). Each is forked
+# from the indexing process, so the default stays small on many-core machines
+EXTRACTION_WORKERS = min(os.cpu_count() or 1, 4)
+# Seconds a single file may take before its worker is killed
+EXTRACTION_TIMEOUT = 60
+# Upper bound on the text kept per file and per PDF page (0 disables)
+EXTRACTION_MAX_BYTES = 16 * 1024 * 1024
+EXTRACTION_PAGE_CHARS = 100_000
+# Extracted text is cached on disk by content hash and extractor version, so
+# rebuilds don't extract unchanged PDFs again. Least recently used entries go
+# first once the cache passes EXTRACTION_CACHE_MAX_BYTES (0 disables it)
+EXTRACTION_CACHE_DIR = BASE_DIR / 'extraction_cache'
+EXTRACTION_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Near-duplicate detection (core.dedupe). Files whose estimated Jaccard
+# similarity to an indexed file reaches DEDUPE_THRESHOLD aren't indexed (0
+# disables). Texts under DEDUPE_MIN_WORDS words are never treated as copies.
+# After changing the threshold run `manage.py dedupe --recluster`
+DEDUPE_THRESHOLD = 0.9
+DEDUPE_MIN_WORDS = 50
+
+# Instrumentation
+# Requests with an X-PKSE-Profile: 1 header get a Server-Timing stage breakdown
+REQUEST_PROFILING = os.environ.get('PKSE_REQUEST_PROFILING', '1' if DEBUG else '0') == '1'
+# Requests slower than this are logged with their view and status
+SLOW_REQUEST_SECONDS = 1.0
+# PKSE_LOG_FORMAT=json logs one JSON object per line, for log shippers;
+# PKSE_LOG_LEVEL=INFO adds ingest and maintenance summaries
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'text': {'()': 'core.logs.StructuredFormatter'},
+        'json': {'()': 'core.logs.StructuredFormatter', 'json_output': True},
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json' if os.environ.get('PKSE_LOG_FORMAT') == 'json' else 'text',
+        },
+    },
+    'loggers': {
+        'core': {'handlers': ['console'], 'level': os.environ.get('PKSE_LOG_LEVEL', 'WARNING'), 'propagate': False},
+    },
+}
@@ -0,0 +1,81 @@
+"""
+Native async versions of the read-heavy endpoints, served when the app runs
+under ASGI (see config/asgi.py). Request handling stays on the event loop and
+only the Whoosh and ORM work goes through core.executor.run_blocking.
+"""
+import asyncio
+import time
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.request import Request
+from .models import File, Job
+from .pagination import FileCursorPagination
+from .serializers import FileSerializer, JobSerializer
+from .executor import run_blocking
+from .views import filter_files, search_options, search_results
+
+# Longest a job status request may wait for the job to finish
+MAX_JOB_WAIT = 30
+JOB_POLL_INTERVAL = 0.5
+
+
+def _error(exc):
+    # Same body as DRF's default exception handler
+    detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return JsonResponse(detail, status=exc.status_code, safe=False)
+
+
+@require_GET
+async def search(request):
+    try:
+        query_string, options = search_options(request.GET)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    start = time.perf_counter()
+    results_data = await run_blocking(search_results, query_string, **options)
+    results_data = {**results_data, "query_time_ms": round((time.perf_counter() - start) * 1000, 2)}
+    return JsonResponse(results_data)
+
+
+def _file_page(request):
+    request = Request(request)
+    paginator = FileCursorPagination()
+    queryset = filter_files(File.objects.all(), request.query_params)
+    page = paginator.paginate_queryset(queryset, request)
+    return paginator.get_paginated_response(FileSerializer(page, many=True).data).data
+
+
+@require_GET
+async def file_list(request):
+    try:
+        return JsonResponse(await run_blocking(_file_page, request))
+    except APIException as e:
+        return _error(e)
+
+
+def _job_data(pk):
+    job = Job.objects.filter(pk=pk).first()
+    return JobSerializer(job).data if job is not None else None
+
+
+@require_GET
+async def job_detail(request, pk):
+    """
+    Job status. With ?wait=<seconds> (up to MAX_JOB_WAIT) the response is held
+    until the job finishes or the time is up, without holding a thread.
+    """
+    try:
+        wait = min(MAX_JOB_WAIT, max(0.0, float(request.GET.get('wait', 0))))
+    except ValueError:
+        return _error(ValidationError({'wait': 'Must be a number'}))
+
+    deadline = time.monotonic() + wait
+    while True:
+        data = await run_blocking(_job_data, pk)
+        if data is None:
+            return JsonResponse({'detail': 'No Job matches the given query.'}, status=404)
+        if data['status'] in (Job.STATUS_SUCCESS, Job.STATUS_FAILURE) or time.monotonic() >= deadline:
+            return JsonResponse(data)
+        await asyncio.sleep(JOB_POLL_INTERVAL)
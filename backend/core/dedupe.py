@@ -0,0 +1,386 @@
+"""
+Near-duplicate detection: MinHash signatures of the extracted text and LSH
+banding to find candidates.
+
+Every file gets a signature when it is indexed. Files whose estimated
+similarity to an already indexed file reaches DEDUPE_THRESHOLD point at it
+through File.duplicate_of and are left out of the index, so search shows one
+canonical document per cluster (with its duplicates attached to the hit).
+Only canonical files have band rows, so lookups only ever find canonicals.
+
+Signatures are computed with NumPy when it is installed and in pure Python
+(same values, much slower on long documents) otherwise.
+"""
+import hashlib
+import random
+import re
+import struct
+import zlib
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from . import metrics
+from .models import File, MinHashBand
+
+_numpy = None
+
+NUM_PERM = 128
+# Words per shingle
+SHINGLE_WORDS = 5
+# Shingles hashed per block, bounds the NUM_PERM x block array
+HASH_BLOCK = 8192
+# Keep id__in lists under SQLite's bound-parameter limit
+ID_CHUNK_SIZE = 500
+# A band lookup binds two parameters
+BAND_CHUNK_SIZE = ID_CHUNK_SIZE // 2
+
+_WORD = re.compile(r'\w+')
+_PRIME = (1 << 61) - 1
+_MASK32 = (1 << 32) - 1
+_MASK64 = (1 << 64) - 1
+# Fixed seed: signatures are stored and compared across processes and runs
+_rng = random.Random(20240501)
+_A = [_rng.randrange(1, _PRIME) for _ in range(NUM_PERM)]
+_B = [_rng.randrange(0, _PRIME) for _ in range(NUM_PERM)]
+_SHINGLE_MULTIPLIERS = [pow(0x01000193, i, 1 << 32) for i in range(SHINGLE_WORDS)]
+
+duplicates_found = metrics.counter('pkse_duplicates_total', 'Files found to be near-duplicates of an indexed file.')
+
+
+def enabled():
+    return settings.DEDUPE_THRESHOLD > 0
+
+def _chunks(items, size=ID_CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _np():
+    """
+    NumPy, or None if it isn't installed. Imported on first use rather than
+    at startup, which it would slow down by about 100 ms.
+    """
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:  # Optional, signatures fall back to pure Python
+            numpy = False
+        _numpy = numpy
+    return _numpy or None
+
+
+def _token_hashes(text):
+    cache = {}
+    hashes = []
+    for token in _WORD.findall(text.lower()):
+        h = cache.get(token)
+        if h is None:
+            h = cache[token] = zlib.crc32(token.encode('utf-8'))
+        hashes.append(h)
+    return hashes
+
+def shingle_hashes(text):
+    """
+    32-bit hashes of the text's overlapping SHINGLE_WORDS-word shingles, or
+    None if it has fewer than DEDUPE_MIN_WORDS words.
+    """
+    tokens = _token_hashes(text)
+    if len(tokens) < max(settings.DEDUPE_MIN_WORDS, SHINGLE_WORDS):
+        return None
+    count = len(tokens) - SHINGLE_WORDS + 1
+    np = _np()
+    if np is not None:
+        tokens = np.array(tokens, dtype=np.uint64)
+        hashes = np.zeros(count, dtype=np.uint64)
+        for i, multiplier in enumerate(_SHINGLE_MULTIPLIERS):
+            hashes = (hashes + tokens[i:i + count] * np.uint64(multiplier)) & np.uint64(_MASK32)
+        return np.unique(hashes)
+    hashes = set()
+    for start in range(count):
+        h = 0
+        for i, multiplier in enumerate(_SHINGLE_MULTIPLIERS):
+            h = (h + tokens[start + i] * multiplier) & _MASK32
+        hashes.add(h)
+    return sorted(hashes)
+
+def signature(text):
+    """
+    The MinHash signature of a text as bytes (NUM_PERM little-endian
+    uint32), or None for texts too short to compare.
+    """
+    with metrics.timed('minhash'):
+        hashes = shingle_hashes(text)
+        if hashes is None:
+            return None
+        np = _np()
+        if np is not None:
+            a = np.array(_A, dtype=np.uint64)[:, None]
+            b = np.array(_B, dtype=np.uint64)[:, None]
+            mins = np.full(NUM_PERM, _MASK32, dtype=np.uint64)
+            # uint64 arithmetic wraps, the pure Python version masks to match
+            with np.errstate(over='ignore'):
+                for i in range(0, len(hashes), HASH_BLOCK):
+                    block = hashes[None, i:i + HASH_BLOCK]
+                    values = ((a * block + b) % np.uint64(_PRIME)) & np.uint64(_MASK32)
+                    mins = np.minimum(mins, values.min(axis=1))
+            return mins.astype('<u4').tobytes()
+        mins = [
+            min((((a * h + b) & _MASK64) % _PRIME) & _MASK32 for h in hashes)
+            for a, b in zip(_A, _B)
+        ]
+        return struct.pack(f'<{NUM_PERM}I', *mins)
+
+def similarity(first, second):
+    """
+    Estimated Jaccard similarity of two texts from their signatures.
+    """
+    np = _np()
+    if np is not None:
+        return np.count_nonzero(np.frombuffer(first, '<u4') == np.frombuffer(second, '<u4')) / NUM_PERM
+    return sum(x == y for x, y in zip(struct.unpack(f'<{NUM_PERM}I', first),
+                                      struct.unpack(f'<{NUM_PERM}I', second))) / NUM_PERM
+
+def band_layout(threshold=None):
+    """
+    (bands, rows per band) for NUM_PERM: the layout whose LSH threshold
+    (1/bands)^(1/rows) is the highest one not above `threshold`, so pairs at
+    the threshold are very likely to become candidates.
+    """
+    threshold = threshold or settings.DEDUPE_THRESHOLD
+    layouts = [(NUM_PERM // rows, rows) for rows in range(1, NUM_PERM + 1) if NUM_PERM % rows == 0]
+    below = [(b, r) for b, r in layouts if (1 / b) ** (1 / r) <= threshold]
+    return max(below, key=lambda layout: (1 / layout[0]) ** (1 / layout[1])) if below else layouts[0]
+
+def bands(sig, layout=None):
+    """
+    [(band, bucket)] for a signature, the bucket a signed 64-bit hash of
+    the band's rows.
+    """
+    count, rows = layout or band_layout()
+    width = rows * 4
+    return [
+        (i, int.from_bytes(hashlib.blake2b(sig[i * width:(i + 1) * width], digest_size=8).digest(), 'big', signed=True))
+        for i in range(count)
+    ]
+
+
+class Deduplicator:
+    """
+    Decides, file by file, whether a file being indexed is a near-duplicate
+    of an indexed canonical file, and records the outcome with flush().
+
+    Files checked by the same Deduplicator are matched against each other
+    too, before anything is flushed. Used by BulkIndexer and index_file().
+
+    Stored band rows and signatures that were looked up are kept until the
+    next flush(), so files of one batch landing in the same buckets don't
+    query them again.
+    """
+
+    def __init__(self):
+        self.threshold = settings.DEDUPE_THRESHOLD
+        self.layout = band_layout(self.threshold)
+        # file id -> (signature, canonical id or None, content hash)
+        self.pending = {}
+        self._buckets = {}
+        self._hashes = {}
+        # (band, bucket) -> stored file ids, file id -> stored signature
+        self._stored_buckets = {}
+        self._stored_signatures = {}
+
+    def exact(self, file_obj):
+        """
+        The canonical file for an exact copy of an already checked file,
+        known from the content hash alone so the copy needn't be extracted.
+        Records the file and returns the canonical id, else None.
+        """
+        from .extraction_cache import trusted_hash
+
+        content_hash = trusted_hash(file_obj)
+        if not content_hash:
+            return None
+        canonical = self._hashes.get(content_hash)
+        if canonical is None:
+            rows = (File.objects.filter(content_hash=content_hash, duplicate_of__isnull=True, minhash__isnull=False)
+                    .exclude(id=file_obj.id).order_by('id').values_list('id', 'minhash'))
+            # Files checked here are matched through self._hashes, with their new content
+            canonical = next(((row[0], bytes(row[1])) for row in rows if row[0] not in self.pending), None)
+            if canonical is None:
+                return None
+        if canonical[0] == file_obj.id:
+            return None
+        self._record(file_obj, canonical[1], canonical[0], content_hash)
+        return canonical[0]
+
+    def check(self, file_obj, text):
+        """
+        Record a file's signature and return the id of the canonical file it
+        duplicates, or None if it is canonical itself (or too short to tell).
+        """
+        sig = signature(text)
+        content_hash = file_obj.content_hash or None
+        if sig is None:
+            self._record(file_obj, None, None, content_hash)
+            return None
+        canonical = self._match(file_obj.id, sig)
+        self._record(file_obj, sig, canonical, content_hash)
+        return canonical
+
+    def _record(self, file_obj, sig, canonical, content_hash):
+        self.pending[file_obj.id] = (sig, canonical, content_hash)
+        if canonical is not None:
+            duplicates_found.inc()
+        elif sig is not None:
+            for key in bands(sig, self.layout):
+                self._buckets.setdefault(key, []).append(file_obj.id)
+            if content_hash:
+                self._hashes.setdefault(content_hash, (file_obj.id, sig))
+
+    def prefetch(self, sigs):
+        """
+        Look up the stored band rows and signatures matching many signatures
+        in a few queries, before they are checked one by one.
+        """
+        keys = {key for sig in sigs for key in bands(sig, self.layout)}
+        self._load_signatures(self._stored_ids(keys))
+
+    def _stored_ids(self, keys):
+        # Ids of canonical files with a stored band row in any of `keys`
+        missing = [key for key in keys if key not in self._stored_buckets]
+        for key in missing:
+            self._stored_buckets[key] = []
+        for chunk in _chunks(missing, BAND_CHUNK_SIZE):
+            query = Q()
+            for band, bucket in chunk:
+                query |= Q(band=band, bucket=bucket)
+            for file_id, band, bucket in MinHashBand.objects.filter(query).values_list('file_id', 'band', 'bucket'):
+                self._stored_buckets[(band, bucket)].append(file_id)
+        return {file_id for key in keys for file_id in self._stored_buckets[key]}
+
+    def _load_signatures(self, file_ids):
+        missing = [file_id for file_id in file_ids if file_id not in self._stored_signatures]
+        for file_id in missing:
+            self._stored_signatures[file_id] = None
+        for chunk in _chunks(missing):
+            for file_id, sig in File.objects.filter(id__in=chunk).values_list('id', 'minhash'):
+                self._stored_signatures[file_id] = bytes(sig) if sig is not None else None
+        return {file_id: self._stored_signatures[file_id] for file_id in file_ids}
+
+    def _match(self, file_id, sig):
+        keys = bands(sig, self.layout)
+        candidates = {}
+        for key in keys:
+            for other in self._buckets.get(key, ()):
+                if other != file_id:
+                    candidates[other] = self.pending[other][0]
+        # Stored rows of files checked here are out of date, they go at flush()
+        stored = [other for other in self._stored_ids(keys) if other != file_id and other not in self.pending]
+        for other, other_sig in self._load_signatures(stored).items():
+            if other_sig is not None:
+                candidates[other] = other_sig
+
+        best, best_score = None, self.threshold
+        for other, other_sig in candidates.items():
+            score = similarity(sig, other_sig)
+            if score >= best_score:
+                best, best_score = other, score
+        return best
+
+    def flush(self):
+        """
+        Store the recorded signatures, duplicate links and band rows. Returns
+        the ids of files that were duplicates of a file checked here which no
+        longer matches them (it changed, or is a duplicate now itself); they
+        are unlinked and need indexing again.
+        """
+        if not self.pending:
+            return []
+        pending, self.pending = self.pending, {}
+        self._buckets, self._hashes = {}, {}
+        self._stored_buckets, self._stored_signatures = {}, {}
+        ids = list(pending)
+        with transaction.atomic():
+            before = {}
+            for chunk in _chunks(ids):
+                before.update(File.objects.filter(id__in=chunk).values_list('id', 'minhash'))
+            changed = [
+                file_id for file_id, (sig, canonical, _) in pending.items()
+                if canonical is not None or (before.get(file_id) and bytes(before[file_id]) != sig)
+            ]
+            released = []
+            for chunk in _chunks(changed):
+                rows = File.objects.filter(duplicate_of_id__in=chunk).values_list('id', flat=True)
+                released.extend(file_id for file_id in rows if file_id not in pending)
+            for chunk in _chunks(released):
+                File.objects.filter(id__in=chunk).update(duplicate_of=None)
+
+            File.objects.bulk_update(
+                [File(id=file_id, minhash=sig, duplicate_of_id=canonical)
+                 for file_id, (sig, canonical, _) in pending.items()],
+                ['minhash', 'duplicate_of'],
+                batch_size=ID_CHUNK_SIZE,
+            )
+            for chunk in _chunks(ids):
+                MinHashBand.objects.filter(file_id__in=chunk).delete()
+            MinHashBand.objects.bulk_create([
+                MinHashBand(file_id=file_id, band=band, bucket=bucket)
+                for file_id, (sig, canonical, _) in pending.items() if sig is not None and canonical is None
+                for band, bucket in bands(sig, self.layout)
+            ])
+        return released
+
+
+def with_duplicates(results):
+    """
+    Search results with each hit's near-duplicates attached as
+    `duplicates`: [{'id', 'path'}]. Looked up per request rather than
+    cached with the results, as duplicates don't change the index.
+    """
+    hits = results.get('results') or []
+    if not hits or not enabled():
+        return results
+    by_canonical = {}
+    rows = File.objects.filter(duplicate_of_id__in=[int(hit['id']) for hit in hits]).order_by('id')
+    for file_id, canonical, path in rows.values_list('id', 'duplicate_of_id', 'path'):
+        by_canonical.setdefault(str(canonical), []).append({'id': str(file_id), 'path': path})
+    return {
+        **results,
+        'results': [{**hit, 'duplicates': by_canonical.get(hit['id'], [])} for hit in hits],
+    }
+
+def clusters():
+    """
+    {canonical File: [duplicate Files]} for every file with duplicates.
+    """
+    result = {}
+    duplicates = File.objects.filter(duplicate_of__isnull=False).select_related('duplicate_of').order_by('duplicate_of_id', 'id')
+    for duplicate in duplicates.iterator(chunk_size=2000):
+        result.setdefault(duplicate.duplicate_of, []).append(duplicate)
+    return result
+
+def recluster(chunk_size=ID_CHUNK_SIZE):
+    """
+    Cluster all files again from their stored signatures, e.g. after
+    changing DEDUPE_THRESHOLD. Returns (ids that became duplicates, ids
+    that are canonical again), whose documents need removing and adding.
+    """
+    deduplicator = Deduplicator()
+    before = dict(File.objects.values_list('id', 'duplicate_of_id'))
+    ids = list(File.objects.filter(minhash__isnull=False).order_by('id').values_list('id', flat=True))
+    with transaction.atomic():
+        MinHashBand.objects.all().delete()
+        File.objects.update(duplicate_of=None)
+        for i in range(0, len(ids), chunk_size):
+            rows = File.objects.filter(id__in=ids[i:i + chunk_size]).order_by('id')
+            rows = [(file_id, bytes(sig), content_hash)
+                    for file_id, sig, content_hash in rows.values_list('id', 'minhash', 'content_hash')]
+            deduplicator.prefetch(sig for _, sig, _ in rows)
+            for file_id, sig, content_hash in rows:
+                canonical = deduplicator._match(file_id, sig)
+                deduplicator._record(File(id=file_id), sig, canonical, content_hash or None)
+            deduplicator.flush()
+    after = dict(File.objects.values_list('id', 'duplicate_of_id'))
+    now_duplicate = [i for i, canonical in after.items() if canonical and not before.get(i)]
+    now_canonical = [i for i, canonical in after.items() if not canonical and before.get(i)]
+    return now_duplicate, now_canonical
@@ -0,0 +1,47 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.ASYNC_BLOCKING_WORKERS, thread_name_prefix='pkse-blocking')
+    return _executor
+
+
+def _run(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # Same connection handling as at the end of a sync request
+        close_old_connections()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run blocking Whoosh or ORM work from an async view.
+
+    Calls go to a bounded pool of ASYNC_BLOCKING_WORKERS threads, so any
+    number of connections can wait on the event loop while at most that many
+    searches hit the disk and database. With ASYNC_BLOCKING_WORKERS = 0 it
+    falls back to asgiref's thread-sensitive sync_to_async (tests use this,
+    it shares the test's database connection).
+    """
+    if not settings.ASYNC_BLOCKING_WORKERS:
+        return await sync_to_async(func, thread_sensitive=True)(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    # Carry context variables over like sync_to_async does (the request profile uses one)
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_get_executor(), functools.partial(context.run, _run, func, args, kwargs))
@@ -0,0 +1,169 @@
+import multiprocessing
+import time
+from multiprocessing.connection import wait
+from django.conf import settings
+from . import extraction_cache, extractors
+
+def _runs_inline(path):
+    # Text (or nothing to extract) is quicker to read here than to send back
+    # through a worker's pipe; unreadable files go to a worker to report
+    try:
+        extractor = extractors.for_mime(extractors.sniff(path))
+    except OSError:
+        return False
+    return extractor is None or not extractor.expensive
+
+def _worker_main(conn):
+    """
+    Worker process loop: extract each (path, content hash) sent over the pipe,
+    through the extraction cache, and send back (path, text, error). None
+    means shut down.
+    """
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        path, content_hash = task
+        try:
+            conn.send((path, extraction_cache.extract(path, content_hash), None))
+        except Exception as e:
+            conn.send((path, '', str(e)))
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.started = None
+
+    def submit(self, key, path, content_hash=None):
+        self.task = (key, path)
+        self.started = time.monotonic()
+        self.conn.send((path, content_hash))
+
+    def finish(self):
+        task, self.task = self.task, None
+        return task
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class ExtractionPool:
+    """
+    Extracts text in a pool of worker processes.
+
+    Each worker handles one file at a time, so a file that hangs past `timeout`
+    seconds or crashes its worker (e.g. a malformed PDF taking pypdf down) only
+    fails that file: the worker is killed and replaced and the rest of the batch
+    keeps going. Results are yielded as they finish, not in input order.
+    Files with a cheap extractor (see core.extractors) are extracted in the
+    calling process instead, between handing work to the workers. Workers are
+    forked only once a file needs one, so a batch of text files never forks.
+
+        with ExtractionPool(workers=4) as pool:
+            for file_obj, text, error in pool.extract_files(files):
+                ...
+    """
+
+    def __init__(self, workers=None, timeout=None):
+        self.workers = workers or settings.EXTRACTION_WORKERS or multiprocessing.cpu_count()
+        self.timeout = timeout or settings.EXTRACTION_TIMEOUT
+        self._ctx = multiprocessing.get_context('fork')
+        self._pool = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        for worker in self._pool:
+            if worker.task is None:
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+        for worker in self._pool:
+            worker.process.join(timeout=1)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
+            worker.conn.close()
+        self._pool = []
+
+    def _replace(self, worker):
+        worker.kill()
+        self._pool[self._pool.index(worker)] = _Worker(self._ctx)
+
+    def imap(self, items):
+        """
+        Extract an iterable of (key, path) or (key, path, content hash) tuples.
+        Yields (key, text, error) as each file completes; `error` is None on
+        success. The input is consumed lazily, only as workers become free.
+        """
+        items = iter(items)
+        exhausted = False
+
+        while True:
+            # Hand work to idle workers, starting one only when a file needs it
+            while not exhausted:
+                worker = next((w for w in self._pool if w.task is None), None)
+                if worker is None and len(self._pool) >= self.workers:
+                    break
+                try:
+                    key, path, *content_hash = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if _runs_inline(path):
+                    try:
+                        yield key, extraction_cache.extract(path, *content_hash), None
+                    except Exception as e:
+                        yield key, '', str(e)
+                    continue
+                if worker is None:
+                    worker = _Worker(self._ctx)
+                    self._pool.append(worker)
+                worker.submit(key, path, *content_hash)
+
+            busy = [w for w in self._pool if w.task is not None]
+            if not busy:
+                return
+
+            now = time.monotonic()
+            wait_for = max(0, min(w.started + self.timeout for w in busy) - now)
+            ready = wait([w.conn for w in busy], timeout=wait_for)
+
+            for worker in busy:
+                if worker.conn in ready:
+                    try:
+                        _, text, error = worker.conn.recv()
+                    except (EOFError, OSError):
+                        key, path = worker.finish()
+                        self._replace(worker)
+                        yield key, '', f'Extraction worker crashed on {path}'
+                        continue
+                    key, _ = worker.finish()
+                    yield key, text, error
+                elif time.monotonic() - worker.started >= self.timeout:
+                    key, path = worker.finish()
+                    self._replace(worker)
+                    yield key, '', f'Extraction timed out after {self.timeout}s on {path}'
+
+    def extract_files(self, file_objs):
+        """
+        Extract File instances. Yields (file_obj, text, error) as they finish.
+        """
+        return self.imap(
+            (file_obj, file_obj.path, extraction_cache.trusted_hash(file_obj)) for file_obj in file_objs)
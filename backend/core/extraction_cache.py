@@ -0,0 +1,139 @@
+import hashlib
+import os
+import threading
+import zlib
+from django.conf import settings
+from . import extractors
+from .utils import EXTRACTOR_VERSION, directory_size, extract_text_from_file, hash_file
+
+COMPRESS_LEVEL = 6
+# Evict down to this share of EXTRACTION_CACHE_MAX_BYTES, so eviction doesn't run on every put
+EVICT_TO = 0.9
+
+_lock = threading.Lock()
+# Bytes in the cache directory as far as this process knows, per directory
+_sizes = {}
+
+
+def enabled():
+    return settings.EXTRACTION_CACHE_MAX_BYTES > 0
+
+def _version_tag():
+    # The limits change what extraction returns, so they are part of the version
+    raw = f'{EXTRACTOR_VERSION}:{settings.EXTRACTION_MAX_BYTES}:{settings.EXTRACTION_PAGE_CHARS}'
+    return f'v{EXTRACTOR_VERSION}-' + hashlib.blake2b(raw.encode('utf-8'), digest_size=4).hexdigest()
+
+def cache_key(content_hash):
+    return f'{content_hash}-{_version_tag()}'
+
+def _path(key):
+    return os.path.join(settings.EXTRACTION_CACHE_DIR, key[:2], f'{key}.z')
+
+def get(key):
+    """
+    Cached text for a key, or None. A hit bumps the entry's mtime, which
+    is what eviction orders by.
+    """
+    path = _path(key)
+    try:
+        with open(path, 'rb') as f:
+            text = zlib.decompress(f.read()).decode('utf-8')
+        os.utime(path)
+        return text
+    except (FileNotFoundError, zlib.error):
+        return None
+
+def put(key, text):
+    path = _path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = zlib.compress(text.encode('utf-8'), COMPRESS_LEVEL)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    _account(len(data))
+
+def _account(added):
+    cache_dir = str(settings.EXTRACTION_CACHE_DIR)
+    with _lock:
+        if cache_dir not in _sizes:
+            _sizes[cache_dir] = directory_size(cache_dir)
+        else:
+            _sizes[cache_dir] += added
+        if _sizes[cache_dir] > settings.EXTRACTION_CACHE_MAX_BYTES:
+            _sizes[cache_dir] = evict(int(settings.EXTRACTION_CACHE_MAX_BYTES * EVICT_TO))
+
+def evict(max_bytes):
+    """
+    Delete least recently used entries until the cache is at most
+    `max_bytes`. Returns the size left.
+    """
+    entries = []
+    for root, dirs, files in os.walk(settings.EXTRACTION_CACHE_DIR):
+        for name in files:
+            if not name.endswith('.z'):
+                continue
+            try:
+                stats = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stats.st_mtime_ns, stats.st_size, os.path.join(root, name)))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
+
+def trusted_hash(file_obj):
+    """
+    The File's stored content hash if its stat fingerprint still matches the
+    file on disk, else None (the file changed since it was hashed).
+    """
+    if not file_obj.content_hash:
+        return None
+    try:
+        stats = os.stat(file_obj.path)
+    except OSError:
+        return None
+    if (stats.st_mtime_ns, stats.st_size) != (file_obj.mtime_ns, file_obj.size):
+        return None
+    return file_obj.content_hash
+
+def key_for(path, content_hash=None):
+    """
+    Cache key for a file, hashing it unless the hash is given. None if the
+    file can't be read, isn't worth caching or the cache is off.
+    """
+    if not enabled():
+        return None
+    # Only formats whose extraction costs more than hashing the file. Plain
+    # text is read about as fast as it is hashed, caching it would only take space
+    extractor = extractors.for_path(path)
+    if extractor is None or not extractor.expensive:
+        return None
+    if not content_hash:
+        try:
+            content_hash = hash_file(path)
+        except OSError:
+            return None
+    return cache_key(content_hash)
+
+def extract(path, content_hash=None):
+    """
+    extract_text_from_file() through the cache. Hashing is far cheaper than
+    extraction (a PDF in particular), so a cache miss costs little extra and
+    a hit skips the extractor entirely.
+    """
+    key = key_for(path, content_hash)
+    text = get(key) if key else None
+    if text is None:
+        text = extract_text_from_file(path)
+        if key:
+            put(key, text)
+    return text
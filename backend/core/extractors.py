@@ -0,0 +1,148 @@
+"""
+Registry of text extractors, chosen by sniffing the file's content rather
+than trusting its extension.
+
+An extractor names the MIME types it handles, a rough cost and the dotted
+path of its chunk function, which is only imported the first time a file
+needs it (pypdf takes about 100 ms to import).
+Chunk functions take (path, max_bytes, page_chars) and yield (page, text)
+like utils.iter_text_chunks. More can be added with register(), e.g. from
+an AppConfig.ready().
+"""
+import importlib
+import mmap
+import os
+import threading
+
+# Bytes of a file read to sniff its type
+SNIFF_BYTES = 4096
+# Extractors costing more than this are worth caching and running in
+# extraction workers; cheaper ones are about as fast as reading the file
+CHEAP_COST = 1
+
+# (offset, magic, MIME type), checked in order
+MAGIC = [
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'RIFF', 'application/x-riff'),
+    (0, b'PK\x03\x04', 'application/zip'),
+    (0, b'\x1f\x8b', 'application/gzip'),
+    (0, b'BZh', 'application/x-bzip2'),
+    (0, b'\xfd7zXZ\x00', 'application/x-xz'),
+    (0, b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (0, b'\x7fELF', 'application/x-executable'),
+    (0, b'SQLite format 3\x00', 'application/vnd.sqlite3'),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/x-ole-storage'),
+    (4, b'ftyp', 'video/mp4'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'OggS', 'audio/ogg'),
+]
+# Some writers put junk before the PDF header; readers accept it within 1 KB
+PDF_HEADER_WINDOW = 1024
+# Text MIME types by extension, for files that sniff as text
+TEXT_TYPES = {
+    '.md': 'text/markdown',
+    '.html': 'text/html',
+    '.htm': 'text/html',
+    '.css': 'text/css',
+    '.js': 'text/javascript',
+    '.json': 'application/json',
+    '.py': 'text/x-python',
+    '.csv': 'text/csv',
+}
+_TEXT_BYTES = bytes({7, 8, 9, 10, 12, 13, 27} | set(range(0x20, 0x7f)) | set(range(0x80, 0x100)))
+
+
+class Extractor:
+    def __init__(self, name, mime_types, target, cost=CHEAP_COST):
+        self.name = name
+        self.mime_types = tuple(mime_types)
+        self.target = target
+        self.cost = cost
+        self._func = None
+
+    def __repr__(self):
+        return f'<Extractor {self.name}>'
+
+    @property
+    def expensive(self):
+        return self.cost > CHEAP_COST
+
+    def load(self):
+        """
+        The chunk function, imported on first use.
+        """
+        if self._func is None:
+            module, _, attr = self.target.rpartition('.')
+            self._func = getattr(importlib.import_module(module), attr)
+        return self._func
+
+    def chunks(self, path, max_bytes=None, page_chars=None):
+        return self.load()(path, max_bytes, page_chars)
+
+
+_lock = threading.Lock()
+_by_mime = {}
+
+def register(extractor):
+    """
+    Add an extractor, replacing any registered for the same MIME types.
+    """
+    with _lock:
+        for mime_type in extractor.mime_types:
+            _by_mime[mime_type] = extractor
+    return extractor
+
+def for_mime(mime_type):
+    if mime_type is None:
+        return None
+    extractor = _by_mime.get(mime_type)
+    if extractor is None and mime_type.startswith('text/'):
+        extractor = _by_mime.get('text/plain')
+    return extractor
+
+def _head(path):
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return b''
+        # Maps just the first page or so, the rest of the file is never read
+        with mmap.mmap(f.fileno(), min(size, SNIFF_BYTES), access=mmap.ACCESS_READ) as head:
+            return head[:]
+
+def sniff(path):
+    """
+    The MIME type of a file from its first SNIFF_BYTES. Text that isn't
+    otherwise recognised is text/plain (refined by extension), anything else
+    unknown is application/octet-stream. Raises OSError if it can't be read.
+    """
+    head = _head(path)
+    if not head:
+        return 'application/x-empty'
+    for offset, magic, mime_type in MAGIC:
+        if head.startswith(magic, offset):
+            return mime_type
+    if b'%PDF-' in head[:PDF_HEADER_WINDOW]:
+        return 'application/pdf'
+    # Like file(1): NUL bytes, or lots of control characters, mean binary
+    if b'\x00' in head or len(head.translate(None, _TEXT_BYTES)) > len(head) // 10:
+        return 'application/octet-stream'
+    return TEXT_TYPES.get(os.path.splitext(path)[1].lower(), 'text/plain')
+
+def for_path(path):
+    """
+    The extractor for a file, or None if it has no text to extract or can't
+    be read.
+    """
+    try:
+        return for_mime(sniff(path))
+    except OSError:
+        return None
+
+
+register(Extractor('text', ['text/plain', 'application/json'], 'core.utils.text_chunks'))
+# pypdf is one to two orders of magnitude slower per byte than reading text
+register(Extractor('pdf', ['application/pdf'], 'core.utils.pdf_chunks', cost=50))
@@ -1,55 +1,369 @@
+import logging
 import os
+import time
+from collections import Counter
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from core.models import File
+from core.search import bulk_index_ids, reindex_moved
+from core.signals import deferred_indexing
+from core.utils import hash_file
+from core import metrics
 
-def ingest_directory(directory, stdout=None):
+# Keep id__in lists under SQLite's bound-parameter limit
+PURGE_CHUNK_SIZE = 500
+PATHS_CHUNK_SIZE = 100
+
+logger = logging.getLogger(__name__)
+files_ingested = metrics.counter('pkse_files_ingested_total', 'Files scanned and upserted by ingest.')
+
+FINGERPRINT_FIELDS = ['name', 'file_type', 'size', 'mtime_ns', 'inode', 'content_hash']
+
+def scan_directory(directory, errors=None):
+    """
+    Walk a directory tree with os.scandir, yielding (path, name, stat) for
+    every non-hidden file. The stat comes from the DirEntry, so inode and
+    file type cost no extra syscalls. Unreadable directories are recorded in
+    `errors` and skipped.
+    """
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        # Same as os.walk: don't descend into symlinked directories
+                        if entry.is_dir():
+                            if not entry.is_symlink():
+                                stack.append(entry.path)
+                            continue
+                        # Skip hidden files
+                        if entry.name.startswith('.'):
+                            continue
+                        yield entry.path, entry.name, entry.stat()
+                    except OSError as e:
+                        if errors is not None:
+                            errors.append(f'Error processing {entry.name}: {e}')
+        except OSError as e:
+            if errors is not None:
+                errors.append(f'Error scanning {current}: {e}')
+
+def _file_row(path, name, stats, content_hash=''):
+    return File(
+        path=path,
+        name=name,
+        file_type=os.path.splitext(name)[1].lstrip('.').lower(),
+        size=stats.st_size,
+        mtime_ns=stats.st_mtime_ns,
+        inode=stats.st_ino,
+        content_hash=content_hash,
+    )
+
+def _upsert(rows):
+    """
+    Insert or update a chunk of File rows by path in one transaction.
+    Returns their ids. bulk_create doesn't send post_save, so nothing is
+    indexed here.
+    """
+    with transaction.atomic():
+        File.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['path'],
+            update_fields=FINGERPRINT_FIELDS,
+        )
+    if all(row.pk is not None for row in rows):
+        return [row.pk for row in rows]
+    # Backends that can't return ids from an upsert
+    return list(File.objects.filter(path__in=[row.path for row in rows]).values_list('id', flat=True))
+
+def _existing_rows(directory, fields):
+    """
+    path -> (path, *fields) for every File under a directory, in one query.
+    """
+    return {
+        row[0]: row
+        for row in File.objects.filter(path__startswith=os.path.join(directory, '')).values_list('path', *fields)
+    }
+
+def _index_ids(file_ids, progress=None):
+    total = len(file_ids)
+    bulk_index_ids(file_ids, progress=(lambda count: progress(count, total)) if progress else None)
+
+def ingest_directory(directory, stdout=None, progress=None):
     """
     Scans a directory and ingests files into the database.
     Returns a tuple (count, errors).
+
+    Rows are upserted in chunks of INGEST_CHUNK_SIZE, one transaction each,
+    and every ingested file is then indexed in one bulk pass.
+    `progress` is called with the number of files processed so far.
     """
     if not os.path.isdir(directory):
         raise FileNotFoundError(f'Directory not found: {directory}')
 
+    directory = os.path.abspath(directory)
     if stdout:
         stdout.write(f'Scanning directory: {directory}')
 
-    count = 0
+    start = time.perf_counter()
     errors = []
+    existing = _existing_rows(directory, []) if stdout else {}
+    file_ids = []
+    chunk = []
+
+    def flush():
+        try:
+            file_ids.extend(_upsert(chunk))
+        except Exception as e:
+            errors.append(f'Error saving {len(chunk)} files: {e}')
+            if stdout:
+                stdout.write(stdout.style.ERROR(errors[-1]))
+        chunk.clear()
 
-    for root, dirs, files in os.walk(directory):
-        for filename in files:
-            file_path = os.path.join(root, filename)
-            
-            # Skip hidden files
-            if filename.startswith('.'):
-                continue
-
-            try:
-                # Get file stats
-                stats = os.stat(file_path)
-                size = stats.st_size
-                _, ext = os.path.splitext(filename)
-                
-                # Create or update File object
-                # We use path as the unique identifier for simplicity here
-                file_obj, created = File.objects.update_or_create(
-                    path=file_path,
-                    defaults={
-                        'name': filename,
-                        'file_type': ext.lstrip('.').lower(),
-                        'size': size,
-                    }
-                )
-                
-                if stdout:
-                    action = "Created" if created else "Updated"
-                    stdout.write(f'{action}: {filename}')
-                
-                count += 1
-
-            except Exception as e:
-                error_msg = f'Error processing {filename}: {e}'
-                errors.append(error_msg)
-                if stdout:
-                    stdout.write(stdout.style.ERROR(error_msg))
+    count = 0
+    with metrics.timed('ingest_scan'):
+        for path, name, stats in scan_directory(directory, errors):
+            chunk.append(_file_row(path, name, stats))
+            if stdout:
+                action = "Updated" if path in existing else "Created"
+                stdout.write(f'{action}: {name}')
+            count += 1
+            if progress:
+                progress(count)
+            if len(chunk) >= settings.INGEST_CHUNK_SIZE:
+                flush()
+        if chunk:
+            flush()
+    files_ingested.inc(count)
 
+    with metrics.timed('ingest_index'):
+        _index_ids(file_ids, progress)
+    logger.info('Ingested directory', extra={
+        'directory': directory, 'files': count, 'errors': len(errors),
+        'seconds': round(time.perf_counter() - start, 3),
+    })
     return count, errors
+
+def sync_directory(directory, stdout=None, hash_content=False, purge=False, progress=None):
+    """
+    Incremental ingest. Compares each file's stat fingerprint (mtime, size,
+    inode) with what is stored and only writes (and so re-indexes) new or
+    changed files. With `hash_content`, a file whose stat changed but whose
+    content hash did not only gets its fingerprint refreshed.
+
+    A new path whose inode and stat match a row whose path is gone (or, with
+    `hash_content`, whose content hash matches) is treated as a rename: the
+    row keeps its id and the document is rewritten without re-extracting.
+
+    Files that are in the database but no longer on disk are reported as
+    deleted, and removed from the database and the index if `purge` is set.
+
+    Returns a dict with created/updated/unchanged counts, moved (old, new)
+    path pairs, deleted paths and errors.
+    `progress` is called with the number of files processed so far.
+    """
+    if not os.path.isdir(directory):
+        raise FileNotFoundError(f'Directory not found: {directory}')
+
+    directory = os.path.abspath(directory)
+    if stdout:
+        stdout.write(f'Scanning directory: {directory}')
+
+    # One query for every fingerprint under the directory
+    existing = _existing_rows(directory, ['id', 'mtime_ns', 'size', 'inode', 'content_hash'])
+    # An inode shared by several rows (hard links, see uploads.store_file)
+    # doesn't tell which of them a new path was renamed from
+    inodes = Counter(row[4] for row in existing.values() if row[4] is not None)
+    by_inode = {row[4]: row for row in existing.values() if inodes[row[4]] == 1}
+    by_hash = {row[5]: row for row in existing.values() if row[5]} if hash_content else {}
+    report = {'created': 0, 'updated': 0, 'unchanged': 0, 'moved': [], 'deleted': [], 'errors': []}
+    changed = []
+    touched = []
+    moved = []
+    file_ids = []
+
+    def flush():
+        try:
+            if changed:
+                file_ids.extend(_upsert(changed))
+            if touched:
+                # Same content, new fingerprint: no reindex needed
+                with transaction.atomic():
+                    File.objects.bulk_update(touched, ['mtime_ns', 'size', 'inode'])
+            if moved:
+                with transaction.atomic():
+                    File.objects.bulk_update(moved, ['path', 'name', 'file_type', *FINGERPRINT_FIELDS[2:]])
+                reindex_moved(moved)
+        except Exception as e:
+            report['errors'].append(f'Error saving {len(changed) + len(touched) + len(moved)} files: {e}')
+            if stdout:
+                stdout.write(stdout.style.ERROR(report['errors'][-1]))
+        changed.clear()
+        touched.clear()
+        moved.clear()
+
+    processed = 0
+    for path, name, stats in scan_directory(directory, report['errors']):
+        row = existing.pop(path, None)
+        processed += 1
+        if progress:
+            progress(processed)
+
+        if row is not None and row[2:5] == (stats.st_mtime_ns, stats.st_size, stats.st_ino):
+            report['unchanged'] += 1
+            continue
+
+        try:
+            content_hash = hash_file(path) if hash_content else ''
+        except OSError as e:
+            report['errors'].append(f'Error processing {name}: {e}')
+            continue
+
+        file_row = _file_row(path, name, stats, content_hash)
+        source = _renamed_from(stats, content_hash, existing, by_inode, by_hash) if row is None else None
+        if source is not None:
+            del existing[source[0]]
+            file_row.pk = source[1]
+            file_row.content_hash = content_hash or source[5]
+            moved.append(file_row)
+            report['moved'].append((source[0], path))
+            action = 'Moved'
+        elif row is None:
+            changed.append(file_row)
+            report['created'] += 1
+            action = 'Created'
+        elif content_hash and content_hash == row[5]:
+            file_row.pk = row[1]
+            touched.append(file_row)
+            report['unchanged'] += 1
+            continue
+        else:
+            changed.append(file_row)
+            report['updated'] += 1
+            action = 'Updated'
+
+        if stdout:
+            stdout.write(f'{action}: {name}')
+        if len(changed) + len(touched) + len(moved) >= settings.INGEST_CHUNK_SIZE:
+            flush()
+    flush()
+
+    _index_ids(file_ids, progress)
+
+    # Whatever was not seen on disk is gone
+    report['deleted'] = sorted(existing)
+    if stdout:
+        for path in report['deleted']:
+            stdout.write(f'Deleted: {path}')
+
+    if purge and existing:
+        purge_files([row[1] for row in existing.values()])
+
+    return report
+
+def _renamed_from(stats, content_hash, existing, by_inode, by_hash):
+    """
+    The not yet seen row a new file was renamed from, if any. Matching on
+    inode alone could pick up a reused inode, so the stat has to match too
+    and the old path must really be gone.
+    """
+    row = by_inode.get(stats.st_ino)
+    if row is None or row[2:4] != (stats.st_mtime_ns, stats.st_size):
+        row = by_hash.get(content_hash) if content_hash else None
+    if row is None or row[0] not in existing or os.path.lexists(row[0]):
+        return None
+    return row
+
+def ingest_paths(paths, errors=None):
+    """
+    Upsert specific files, e.g. from watcher events, and index them in one
+    batch. Directories are scanned, paths that no longer exist are skipped.
+    Returns the ids written.
+    """
+    rows = []
+    for path in paths:
+        try:
+            if os.path.isdir(path):
+                rows.extend(_file_row(p, name, stats) for p, name, stats in scan_directory(path, errors))
+            elif not os.path.basename(path).startswith('.'):
+                rows.append(_file_row(path, os.path.basename(path), os.stat(path)))
+        except FileNotFoundError:
+            # Gone again before we got to it
+            continue
+
+    file_ids = []
+    for i in range(0, len(rows), settings.INGEST_CHUNK_SIZE):
+        file_ids.extend(_upsert(rows[i:i + settings.INGEST_CHUNK_SIZE]))
+    _index_ids(file_ids)
+    return file_ids
+
+def _under(paths):
+    # Rows at these paths or anywhere below them (for directories)
+    query = Q()
+    for path in paths:
+        query |= Q(path=path) | Q(path__startswith=os.path.join(path, ''))
+    return File.objects.filter(query)
+
+def remove_paths(paths):
+    """
+    Purge deleted files, or everything under deleted directories, from the
+    database and the index. Returns the ids removed.
+    """
+    paths = list(paths)
+    file_ids = []
+    for i in range(0, len(paths), PATHS_CHUNK_SIZE):
+        file_ids.extend(_under(paths[i:i + PATHS_CHUNK_SIZE]).values_list('id', flat=True))
+    purge_files(file_ids)
+    return file_ids
+
+def move_paths(moves):
+    """
+    Apply renames {old path: new path} to File rows, including everything
+    under a moved directory, and rewrite their documents without extracting
+    them again. Rows already at a destination (the move overwrote a file)
+    are purged. Returns the moved ids, and the destinations whose source had
+    no rows, for the caller to ingest.
+    """
+    moved, unmatched = [], []
+    for src, dest in moves.items():
+        rows = list(_under([src]))
+        if not rows:
+            unmatched.append(dest)
+        for row in rows:
+            row.path = dest + row.path[len(src):]
+            row.name = os.path.basename(row.path)
+            row.file_type = os.path.splitext(row.name)[1].lstrip('.').lower()
+            moved.append(row)
+    if not moved:
+        return [], unmatched
+
+    moved_ids = [row.pk for row in moved]
+    # Filtered here rather than in the query, which would bind every moved id
+    # in each chunk
+    moving = set(moved_ids)
+    overwritten = []
+    for i in range(0, len(moved), PURGE_CHUNK_SIZE):
+        chunk = [row.path for row in moved[i:i + PURGE_CHUNK_SIZE]]
+        ids = File.objects.filter(path__in=chunk).values_list('id', flat=True)
+        overwritten.extend(file_id for file_id in ids if file_id not in moving)
+    purge_files(overwritten)
+
+    with transaction.atomic():
+        File.objects.bulk_update(moved, ['path', 'name', 'file_type'], batch_size=PURGE_CHUNK_SIZE)
+    reindex_moved(moved)
+    return moved_ids, unmatched
+
+def purge_files(file_ids):
+    """
+    Delete File rows and their index documents. The post_delete handler
+    collects the ids and they are removed from the index in one commit.
+    """
+    file_ids = list(file_ids)
+    if not file_ids:
+        return
+    with deferred_indexing():
+        for i in range(0, len(file_ids), PURGE_CHUNK_SIZE):
+            File.objects.filter(id__in=file_ids[i:i + PURGE_CHUNK_SIZE]).delete()
@@ -0,0 +1,43 @@
+"""
+Structured logging. Log calls pass their fields as `extra`:
+
+    logger.info('Ingested directory', extra={'directory': path, 'files': count})
+
+StructuredFormatter prints them as one JSON object per line (PKSE_LOG_FORMAT=json)
+or as key=value pairs after the message.
+"""
+import json
+import logging
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+def record_fields(record):
+    return {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS and not k.startswith('_')}
+
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, json_output=False, **kwargs):
+        kwargs.setdefault('fmt', '%(asctime)s %(levelname)s %(name)s %(message)s')
+        super().__init__(**kwargs)
+        self.json_output = json_output
+
+    def format(self, record):
+        fields = record_fields(record)
+        if not self.json_output:
+            line = super().format(record)
+            pairs = ' '.join(f'{k}={json.dumps(v, default=str)}' for k, v in fields.items())
+            return f'{line} {pairs}' if pairs else line
+
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **fields,
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
@@ -0,0 +1,69 @@
+import os
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from . import search
+
+def _last_commit(ix):
+    toc_path = os.path.join(ix.storage.folder, f'_{ix.indexname}_{ix.latest_generation()}.toc')
+    try:
+        return datetime.fromtimestamp(os.path.getmtime(toc_path), dt_timezone.utc)
+    except OSError:
+        return None
+
+def index_stats():
+    """
+    Health numbers for the live index: segments, live and deleted documents,
+    size on disk and when it was last committed. A sharded index is summed
+    over its shards; segment_count is the largest per shard since each shard
+    is searched (and optimized) on its own.
+    """
+    shards = search.index_manager.shards()
+    segments = []
+    shard_segments = []
+    for shard, ix in enumerate(shards):
+        shard_segments.append(ix._segments())
+        segments.extend((shard, segment) for segment in shard_segments[-1])
+    doc_count_all = sum(segment.doc_count_all() for _, segment in segments)
+    deleted = sum(segment.deleted_count() for _, segment in segments)
+    segment_count = max(len(shard) for shard in shard_segments)
+    commits = [commit for commit in map(_last_commit, shards) if commit]
+    last_commit = max(commits) if commits else None
+
+    deleted_ratio = deleted / doc_count_all if doc_count_all else 0.0
+    return {
+        'generation': search.index_manager.generation(),
+        'shards': len(shards),
+        'segment_count': segment_count,
+        'doc_count': doc_count_all - deleted,
+        'deleted_count': deleted,
+        'deleted_ratio': round(deleted_ratio, 4),
+        'size_bytes': search.index_size(search.current_index_dir()),
+        'last_commit': last_commit.isoformat() if last_commit else None,
+        'merge_policy': settings.SEARCH_MERGE_POLICY,
+        'needs_optimize': needs_optimize(segment_count, deleted_ratio),
+        'segments': [
+            {'shard': shard, 'id': segment.segment_id(), 'docs': segment.doc_count_all(), 'deleted': segment.deleted_count()}
+            for shard, segment in segments
+        ],
+    }
+
+def needs_optimize(segment_count, deleted_ratio):
+    return (segment_count > settings.SEARCH_OPTIMIZE_MAX_SEGMENTS
+            or deleted_ratio > settings.SEARCH_OPTIMIZE_MAX_DELETED)
+
+def optimize_index(force=False, timeout=60):
+    """
+    Merge the index (each shard) into a single segment, dropping deleted documents, if it
+    is fragmented past the SEARCH_OPTIMIZE_* thresholds (or `force`). Waits
+    up to `timeout` seconds for other writers to finish.
+
+    Returns (optimized, stats before, stats after).
+    """
+    before = index_stats()
+    if not force and not before['needs_optimize']:
+        return False, before, before
+
+    for ix in search.index_manager.shards():
+        writer = ix.writer(timeout=timeout)
+        writer.commit(optimize=True)
+    return True, before, index_stats()
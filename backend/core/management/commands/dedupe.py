@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core import dedupe
+from core.search import bulk_index_ids, delete_documents
+
+class Command(BaseCommand):
+    help = 'Report clusters of near-duplicate files, or re-cluster them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recluster', action='store_true',
+                            help='Cluster again from the stored signatures (after changing DEDUPE_THRESHOLD) '
+                                 'and update the index to match')
+        parser.add_argument('--limit', type=int, default=50, help='Clusters to list, largest first (0 for all)')
+
+    def handle(self, *args, **options):
+        if options['recluster']:
+            now_duplicate, now_canonical = dedupe.recluster()
+            delete_documents(now_duplicate)
+            bulk_index_ids(now_canonical, dedupe=False)
+            bands, rows = dedupe.band_layout()
+            self.stdout.write(
+                f'Re-clustered at threshold {settings.DEDUPE_THRESHOLD} ({bands} bands of {rows} rows): '
+                f'{len(now_duplicate)} files became duplicates, {len(now_canonical)} canonical again'
+            )
+
+        clusters = sorted(dedupe.clusters().items(), key=lambda item: (-len(item[1]), item[0].id))
+        shown = clusters[:options['limit']] if options['limit'] else clusters
+        for canonical, duplicates in shown:
+            self.stdout.write(f'{canonical.path} ({len(duplicates)} duplicates)')
+            for duplicate in duplicates:
+                self.stdout.write(f'  {duplicate.path}')
+        if len(shown) < len(clusters):
+            self.stdout.write(f'... and {len(clusters) - len(shown)} more clusters')
+
+        duplicate_count = sum(len(duplicates) for _, duplicates in clusters)
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(clusters)} clusters, {duplicate_count} duplicate files left out of the index'
+        ))
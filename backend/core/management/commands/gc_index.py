@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from core.reconcile import gc_index
+
+class Command(BaseCommand):
+    help = 'Purge database rows for deleted files and index documents without a row'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be purged')
+
+    def handle(self, *args, **options):
+        report = gc_index(dry_run=options['dry_run'])
+        if options['verbosity'] > 1:
+            for path in report['missing_files']:
+                self.stdout.write(f'Missing: {path}')
+
+        verb = 'Found' if options['dry_run'] else 'Purged'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {len(report['missing_files'])} rows for missing files, "
+            f"{len(report['orphaned_documents'])} orphaned index documents, "
+            f"{len(report['orphaned_text'])} orphaned text store entries"
+        ))
@@ -1,17 +1,23 @@
 import os
 from django.core.management.base import BaseCommand
-from core.ingest import ingest_directory
+from core.ingest import ingest_directory, sync_directory
 
 class Command(BaseCommand):
     help = 'Ingest files from a directory into the database'
 
     def add_arguments(self, parser):
         parser.add_argument('directory', type=str, help='Path to the directory to ingest')
+        parser.add_argument('--incremental', action='store_true', help='Only ingest new or changed files')
+        parser.add_argument('--hash', action='store_true', help='With --incremental, compare content hashes of files whose stat changed')
+        parser.add_argument('--purge', action='store_true', help='With --incremental, remove deleted files from the database and index')
 
     def handle(self, *args, **options):
         directory = options['directory']
 
         try:
+            if options['incremental']:
+                self.handle_incremental(directory, options)
+                return
             count, errors = ingest_directory(directory, stdout=self.stdout)
             self.stdout.write(self.style.SUCCESS(f'Successfully processed {count} files'))
             if errors:
@@ -19,3 +25,18 @@ class Command(BaseCommand):
         except FileNotFoundError as e:
             self.stdout.write(self.style.ERROR(str(e)))
 
+    def handle_incremental(self, directory, options):
+        report = sync_directory(
+            directory,
+            stdout=self.stdout,
+            hash_content=options['hash'],
+            purge=options['purge'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {report['created']}, updated {report['updated']}, "
+            f"unchanged {report['unchanged']}, moved {len(report['moved'])}, deleted {len(report['deleted'])}"
+        ))
+        if report['deleted'] and not options['purge']:
+            self.stdout.write(self.style.WARNING('Run with --purge to remove deleted files'))
+        if report['errors']:
+            self.stdout.write(self.style.WARNING(f"Encountered {len(report['errors'])} errors"))
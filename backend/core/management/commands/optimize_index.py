@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from core.maintenance import optimize_index
+from core.tasks import enqueue, optimize_index_task
+
+class Command(BaseCommand):
+    help = 'Merge the search index into one segment if it is fragmented'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Optimize even if the index is below the thresholds')
+        parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for the index lock')
+        parser.add_argument('--background', action='store_true', help='Queue the optimize on the Celery worker and return')
+
+    def handle(self, *args, **options):
+        if options['background']:
+            enqueue(optimize_index_task, options['force'])
+            self.stdout.write(self.style.SUCCESS('Queued optimize'))
+            return
+
+        optimized, before, after = optimize_index(force=options['force'], timeout=options['timeout'])
+        self.stdout.write(
+            f"Before: {before['segment_count']} segments, {before['doc_count']} docs, "
+            f"{before['deleted_ratio']:.1%} deleted, {before['size_bytes'] / 1024 / 1024:.1f} MB"
+        )
+        if not optimized:
+            self.stdout.write(self.style.SUCCESS('Index is healthy, nothing to do (use --force to optimize anyway)'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"After: {after['segment_count']} segments, {after['doc_count']} docs, "
+            f"{after['size_bytes'] / 1024 / 1024:.1f} MB"
+        ))
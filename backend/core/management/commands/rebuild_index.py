@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core.rebuild import rebuild_index, rollback_index
+
+def _mb(size):
+    return f'{size / (1024 * 1024):.1f} MB'
+
+class Command(BaseCommand):
+    help = 'Rebuild the search index with the current schema and report the size change'
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('--store-content', dest='store_content', action='store_true', default=None,
+                           help='Store full content in the index')
+        group.add_argument('--no-store-content', dest='store_content', action='store_false',
+                           help='Index content without storing it, snippets come from the text store')
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('--passages', dest='passages', action='store_true', default=None,
+                           help='Index files as overlapping passages (default: SEARCH_PASSAGES)')
+        group.add_argument('--no-passages', dest='passages', action='store_false',
+                           help='Index every file as one document')
+        parser.add_argument('--reextract', action='store_true', help='Extract every file again instead of reusing indexed text')
+        parser.add_argument('--shards', type=int, help='Number of shards (default: keep the current count)')
+        parser.add_argument('--rollback', action='store_true',
+                            help='Switch back to the previous index generation instead of rebuilding')
+
+    def handle(self, *args, **options):
+        if options['rollback']:
+            previous = rollback_index()
+            if previous is None:
+                raise CommandError('No previous index generation to roll back to')
+            self.stdout.write(self.style.SUCCESS(f'Rolled back to index generation {previous}'))
+            return
+        if options['shards'] is not None and options['shards'] < 1:
+            raise CommandError('Need at least one shard')
+
+        sizes = rebuild_index(
+            store_content=options['store_content'],
+            reextract=options['reextract'],
+            shards=options['shards'],
+            passages=options['passages'],
+            stdout=self.stdout,
+        )
+
+        def mode(stored):
+            return 'content stored' if stored else 'content not stored'
+
+        old_total = sizes['old_index'] + (0 if sizes['old_stores_content'] else sizes['text_store'])
+        new_total = sizes['new_index'] + (0 if sizes['new_stores_content'] else sizes['text_store'])
+        self.stdout.write(f"Old index:  {_mb(sizes['old_index'])} ({mode(sizes['old_stores_content'])})")
+        self.stdout.write(f"New index:  {_mb(sizes['new_index'])} ({mode(sizes['new_stores_content'])})")
+        self.stdout.write(f"Text store: {_mb(sizes['text_store'])}")
+        self.stdout.write(f"Documents:  {'passages' if sizes['passages'] else 'one per file'}")
+        if old_total:
+            self.stdout.write(f'Total: {_mb(old_total)} -> {_mb(new_total)} ({new_total / old_total:.0%})')
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt index with {sizes['documents']} documents in {sizes['shards']} shard(s), "
+            f"now live as {sizes['generation']}"
+        ))
+        if options['shards'] is not None and options['shards'] != settings.SEARCH_SHARDS:
+            self.stdout.write(self.style.WARNING(
+                f"SEARCH_SHARDS is {settings.SEARCH_SHARDS}, set it to {options['shards']} so a recreated index matches"
+            ))
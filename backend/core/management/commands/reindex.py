@@ -0,0 +1,53 @@
+import time
+from django.core.management.base import BaseCommand
+from core.models import File, Job
+from core.extraction import ExtractionPool
+from core.search import BulkIndexer
+
+class Command(BaseCommand):
+    help = 'Rebuild the search index for all files using the bulk indexer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Documents per commit')
+        parser.add_argument('--commit-interval', type=float, help='Seconds between commits')
+        parser.add_argument('--procs', type=int, help='Writer processes (>1 uses the multiprocessing writer)')
+        parser.add_argument('--workers', type=int, help='Extraction worker processes')
+        parser.add_argument('--timeout', type=float, help='Seconds before a single file extraction is abandoned')
+        parser.add_argument('--background', action='store_true', help='Queue the reindex on the Celery worker and return')
+        parser.add_argument('--only-unindexed', action='store_true', help='Skip files that already have indexed_at set')
+
+    def handle(self, *args, **options):
+        if options['background']:
+            from core.tasks import enqueue, reindex_task
+            job = Job.objects.create(kind=Job.KIND_REINDEX)
+            enqueue(reindex_task, job.id)
+            self.stdout.write(self.style.SUCCESS(f'Queued reindex job {job.id}'))
+            return
+
+        files = File.objects.order_by('id')
+        if options['only_unindexed']:
+            files = files.filter(indexed_at__isnull=True)
+
+        total = files.count()
+        self.stdout.write(f'Reindexing {total} files')
+        start = time.perf_counter()
+
+        with BulkIndexer(
+            batch_size=options['batch_size'],
+            commit_interval=options['commit_interval'],
+            procs=options['procs'],
+        ) as indexer, ExtractionPool(workers=options['workers'], timeout=options['timeout']) as pool:
+            # Documents are written as soon as each extraction finishes
+            for file_obj, content, error in pool.extract_files(files.iterator(chunk_size=2000)):
+                if error:
+                    self.stdout.write(self.style.WARNING(error))
+                indexer.add(file_obj, content=content)
+                if indexer.count % 1000 == 0:
+                    self.stdout.write(f'  {indexer.count}/{total}')
+
+        elapsed = time.perf_counter() - start
+        rate = indexer.count / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {indexer.count} files in {elapsed:.1f}s '
+            f'({rate:.0f} docs/s, {indexer.commits} commits)'
+        ))
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core import search
+from core.rebuild import rebuild_index
+
+class Command(BaseCommand):
+    help = 'Rebuild the search index with a different number of shards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('shards', type=int, help='Number of shards (1 for an unsharded index)')
+        parser.add_argument('--reextract', action='store_true', help='Extract every file again instead of reusing indexed text')
+
+    def handle(self, *args, **options):
+        shards = options['shards']
+        if shards < 1:
+            raise CommandError('Need at least one shard')
+
+        current = search.index_manager.shard_count()
+        self.stdout.write(f'Resharding {current} -> {shards} shard(s)')
+        result = rebuild_index(reextract=options['reextract'], shards=shards, stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f"Index now has {result['shards']} shard(s) with {result['documents']} documents, "
+            f"now live as {result['generation']}"
+        ))
+        if shards != settings.SEARCH_SHARDS:
+            self.stdout.write(self.style.WARNING(
+                f'SEARCH_SHARDS is {settings.SEARCH_SHARDS}, set it to {shards} so a recreated index matches'
+            ))
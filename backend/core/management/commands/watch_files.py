@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core import watcher
+
+class Command(BaseCommand):
+    help = 'Watch directories and keep the database and index up to date as files change'
+
+    def add_arguments(self, parser):
+        parser.add_argument('roots', nargs='*', help='Directories to watch (default: WATCH_ROOTS)')
+        parser.add_argument('--debounce', type=float, help='Seconds without changes before a batch is applied')
+        parser.add_argument('--max-delay', type=float, help='Apply a batch at most this many seconds after its first change')
+        parser.add_argument('--poll', action='store_true', help='Rescan periodically instead of using inotify')
+        parser.add_argument('--interval', type=float, help='Seconds between rescans when polling')
+        parser.add_argument('--no-initial-scan', action='store_true', help="Don't sync the directories before watching")
+
+    def handle(self, *args, **options):
+        roots = options['roots'] or settings.WATCH_ROOTS
+        if not roots:
+            raise CommandError('No directories given and WATCH_ROOTS is empty')
+
+        if watcher.Observer is None and not options['poll']:
+            self.stdout.write(self.style.WARNING('watchdog is not installed, falling back to polling'))
+
+        try:
+            watcher.watch(
+                roots,
+                stdout=self.stdout,
+                debounce=options['debounce'],
+                max_delay=options['max_delay'],
+                poll=options['poll'],
+                poll_interval=options['interval'],
+                initial_scan=not options['no_initial_scan'],
+            )
+        except FileNotFoundError as e:
+            raise CommandError(str(e))
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped')
@@ -0,0 +1,180 @@
+"""
+In-process metrics: counters and histograms, rendered in the Prometheus text
+format at /api/metrics/, plus per-request stage profiles.
+
+Values are kept per process like the query cache stats, so with several
+server or Celery workers each one reports its own.
+"""
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers a cached search up to a slow PDF extraction
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = {}
+_registry_lock = threading.Lock()
+# Stage -> [seconds, calls] for the request being profiled, if any
+_profile = contextvars.ContextVar('pkse_profile', default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = [*key, *extra]
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(key)} {value}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # Label key -> [count per bucket, sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels):
+        entry = self._values.get(_label_key(labels))
+        return entry[2] if entry else 0
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total, n) for key, (counts, total, n) in self._values.items()}
+        for key, (counts, total, n) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket{_format_labels(key, [("le", bound)])} {cumulative}'
+            yield f'{self.name}_bucket{_format_labels(key, [("le", "+Inf")])} {n}'
+            yield f'{self.name}_sum{_format_labels(key)} {total}'
+            yield f'{self.name}_count{_format_labels(key)} {n}'
+
+
+def _register(cls, name, *args):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, *args)
+        return metric
+
+def counter(name, help_text):
+    return _register(Counter, name, help_text)
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, help_text, buckets)
+
+def render():
+    """
+    Every registered metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for name, metric in sorted(_registry.items()):
+        lines.append(f'# HELP {name} {metric.help}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+stage_seconds = histogram('pkse_stage_seconds', 'Time spent in each instrumented stage.')
+stage_errors = counter('pkse_stage_errors_total', 'Instrumented stages that raised.')
+
+
+@contextmanager
+def timed(stage):
+    """
+    Time a block as `stage`: observed in pkse_stage_seconds and added to the
+    profile of the current request when it is being profiled.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=stage)
+        profile = _profile.get()
+        if profile is not None:
+            entry = profile.setdefault(stage, [0.0, 0])
+            entry[0] += elapsed
+            entry[1] += 1
+
+def timer(stage):
+    """
+    Decorator form of timed().
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+@contextmanager
+def profiling():
+    """
+    Collect the stages timed inside the block (in this context and contexts
+    copied from it). Yields the stage -> [seconds, calls] dict.
+    """
+    profile = {}
+    token = _profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _profile.reset(token)
+
+def server_timing(profile):
+    """
+    A Server-Timing header value for a profile, durations in milliseconds.
+    """
+    return ', '.join(
+        f'{stage};dur={seconds * 1000:.2f};desc="{calls}x"' for stage, (seconds, calls) in profile.items()
+    )
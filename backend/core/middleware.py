@@ -0,0 +1,56 @@
+import logging
+import time
+from contextlib import nullcontext
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Send this header with value 1 to get a Server-Timing stage breakdown back
+PROFILE_HEADER = 'X-PKSE-Profile'
+
+http_requests = metrics.counter('pkse_http_requests_total', 'HTTP requests by view, method and status.')
+http_seconds = metrics.histogram('pkse_http_request_seconds', 'HTTP request latency by view.')
+
+
+def _profile_context(request):
+    if settings.REQUEST_PROFILING and request.headers.get(PROFILE_HEADER) == '1':
+        return metrics.profiling()
+    return nullcontext()
+
+def _finish(request, response, elapsed, profile):
+    match = getattr(request, 'resolver_match', None)
+    view = match.url_name if match and match.url_name else 'other'
+    http_seconds.observe(elapsed, view=view)
+    http_requests.inc(view=view, method=request.method, status=response.status_code)
+    if profile is not None:
+        profile['total'] = [elapsed, 1]
+        response['Server-Timing'] = metrics.server_timing(profile)
+    if elapsed >= settings.SLOW_REQUEST_SECONDS:
+        logger.warning('Slow request', extra={
+            'view': view, 'path': request.path, 'status': response.status_code, 'seconds': round(elapsed, 3),
+        })
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """
+    Request counts and latency per view, plus the opt-in per-request profile.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            start = time.perf_counter()
+            with _profile_context(request) as profile:
+                response = await get_response(request)
+            _finish(request, response, time.perf_counter() - start, profile)
+            return response
+    else:
+        def middleware(request):
+            start = time.perf_counter()
+            with _profile_context(request) as profile:
+                response = get_response(request)
+            _finish(request, response, time.perf_counter() - start, profile)
+            return response
+    return middleware
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:26
+
+from django.db import migrations, models
+
+
+def remove_duplicate_paths(apps, schema_editor):
+    # Older ingests could create several rows per path, keep the newest one
+    File = apps.get_model('core', 'File')
+    duplicates = (
+        File.objects.values('path')
+        .annotate(count=models.Count('id'), keep=models.Max('id'))
+        .filter(count__gt=1)
+    )
+    for row in duplicates:
+        File.objects.filter(path=row['path']).exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_paths, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='file',
+            name='path',
+            field=models.CharField(max_length=1024, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['-created_at', '-id'], name='file_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['file_type', '-created_at'], name='file_type_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['size'], name='file_size_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:13
+
+import core.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=core.models.release_duplicates, related_name='duplicates', to='core.file'),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='minhash',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='MinHashBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField()),
+                ('bucket', models.BigIntegerField()),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='minhash_bands', to='core.file')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['band', 'bucket'], name='minhash_band_idx')],
+            },
+        ),
+    ]
@@ -1,12 +1,116 @@
 from django.db import models
 
+def release_duplicates(collector, field, sub_objs, using):
+    """
+    on_delete for File.duplicate_of: like SET_NULL, then the near-duplicates
+    of a deleted file get indexed and one of them becomes the canonical copy.
+    """
+    from .signals import index_later
+    models.SET_NULL(collector, field, sub_objs, using)
+    index_later(list(sub_objs))
+
 class File(models.Model):
-    path = models.CharField(max_length=1024)
+    path = models.CharField(max_length=1024, unique=True)
     name = models.CharField(max_length=255)
     file_type = models.CharField(max_length=50)  # e.g. 'pdf'
     size = models.BigIntegerField()
+    # Stat fingerprint and content hash used by incremental ingest
+    mtime_ns = models.BigIntegerField(null=True, blank=True)
+    inode = models.BigIntegerField(null=True, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, default='')
     indexed_at = models.DateTimeField(null=True, blank=True)
+    # MinHash signature of the extracted text, and the file this one is a
+    # near-duplicate of (duplicates aren't indexed, see core.dedupe)
+    minhash = models.BinaryField(null=True, blank=True)
+    duplicate_of = models.ForeignKey(
+        'self', null=True, blank=True, on_delete=release_duplicates, related_name='duplicates',
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the file list, newest first
+            models.Index(fields=['-created_at', '-id'], name='file_created_idx'),
+            models.Index(fields=['file_type', '-created_at'], name='file_type_created_idx'),
+            models.Index(fields=['size'], name='file_size_idx'),
+            # Upload dedupe looks files up by content
+            models.Index(fields=['content_hash'], name='file_hash_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+class MinHashBand(models.Model):
+    """
+    One LSH band of a canonical File's MinHash signature. Files sharing a
+    (band, bucket) are candidate near-duplicates.
+    """
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='minhash_bands')
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['band', 'bucket'], name='minhash_band_idx'),
+        ]
+
+class Job(models.Model):
+    """
+    A background task the client can poll, e.g. a directory ingest.
+    """
+    KIND_INGEST = 'ingest'
+    KIND_REINDEX = 'reindex'
+    KIND_CHOICES = [
+        (KIND_INGEST, 'Ingest directory'),
+        (KIND_REINDEX, 'Reindex'),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCESS = 'success'
+    STATUS_FAILURE = 'failure'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCESS, 'Success'),
+        (STATUS_FAILURE, 'Failure'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    params = models.JSONField(default=dict, blank=True)
+    total = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk} ({self.status})'
+
+
+class Upload(models.Model):
+    """
+    A resumable chunked upload. Chunks are appended to a partial file on the
+    same filesystem as MEDIA_ROOT until `offset` reaches `size`, then it is
+    moved into place and becomes (or links to) a File.
+    """
+    STATUS_ACTIVE = 'active'
+    STATUS_COMPLETE = 'complete'
+    STATUS_CHOICES = [
+        (STATUS_ACTIVE, 'Active'),
+        (STATUS_COMPLETE, 'Complete'),
+    ]
+
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_ACTIVE)
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    file = models.ForeignKey(File, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
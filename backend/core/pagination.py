@@ -0,0 +1,11 @@
+from rest_framework.pagination import CursorPagination
+
+class FileCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the file list. Each page is an index range scan on
+    (created_at, id), so deep pages cost the same as the first one.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
@@ -0,0 +1,64 @@
+import hashlib
+import json
+import os
+import threading
+from django.conf import settings
+from django.core.cache import caches
+from . import metrics
+from .search import index_manager, search_files
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+lookups = metrics.counter('pkse_search_cache_lookups_total', 'Search result cache lookups by result.')
+
+def normalize_query(query_string):
+    # Only collapse whitespace: the parser treats AND/OR/NOT case-sensitively
+    return ' '.join(query_string.split())
+
+def cache_key(query_string, generation, **options):
+    raw = json.dumps([generation, normalize_query(query_string), options], sort_keys=True)
+    return 'search:' + hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+    lookups.inc(result=name)
+
+def cached_search(query_string, **options):
+    """
+    search_files() through the SEARCH_CACHE_ALIAS cache, keyed on the query and
+    the paging/highlight/facet options. The key includes the
+    index generation, so entries stop matching as soon as a commit lands and
+    age out of the cache on their own. Commit generations restart in a
+    rebuilt index, so its directory is part of the key too.
+    """
+    cache = caches[settings.SEARCH_CACHE_ALIAS]
+    generation = [os.path.basename(index_manager.index_dir()), index_manager.generation()]
+    key = cache_key(query_string, generation, **options)
+
+    results = cache.get(key)
+    if results is not None:
+        _count('hits')
+        return results
+
+    _count('misses')
+    results = search_files(normalize_query(query_string), **options)
+    cache.set(key, results, settings.SEARCH_CACHE_TIMEOUT)
+    return results
+
+def stats():
+    """
+    Hit/miss counters for this process.
+    """
+    with _lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else 0.0,
+    }
+
+def reset_stats():
+    with _lock:
+        _stats['hits'] = _stats['misses'] = 0
@@ -0,0 +1,270 @@
+"""
+Blue/green index rebuilds. Each rebuild writes a new generation of the index
+in SEARCH_INDEX_DIR/gen-<number> while the live one keeps serving searches and taking
+writes, then switches to it by replacing the SEARCH_INDEX_DIR/CURRENT pointer file.
+Processes pick up the switch on their next search or write (see
+search.current_index_dir). An index from before generations lives in
+SEARCH_INDEX_DIR itself and is called '.'.
+"""
+import os
+import shutil
+import time
+from django.conf import settings
+from whoosh.index import exists_in
+from . import search, textstore
+from .models import File
+from .shards import ShardWriterPool
+from .utils import directory_size
+
+GENERATION_PREFIX = 'gen-'
+
+
+def generations():
+    """
+    Names of the index generations on disk, oldest first.
+    """
+    root = search.index_root()
+    if not os.path.isdir(root):
+        return []
+    entries = os.listdir(root)
+    names = sorted((name for name in entries if name.startswith(GENERATION_PREFIX)), key=_number)
+    legacy = exists_in(root) or any(name.startswith(search.SHARD_PREFIX) for name in entries)
+    return ['.'] + names if legacy else names
+
+def _number(name):
+    return int(name[len(GENERATION_PREFIX):])
+
+def current_generation():
+    return os.path.relpath(search.current_index_dir(), search.index_root())
+
+def _generation_dir(name):
+    return os.path.normpath(os.path.join(search.index_root(), name))
+
+def _next_generation():
+    # Numbered by the clock so a name is never reused after a rollback deleted
+    # it: the query cache keys results on it
+    numbers = [_number(name) for name in generations() if name != '.']
+    return f'{GENERATION_PREFIX}{max(int(time.time()), max(numbers, default=0) + 1)}'
+
+def _fsync_dir(path):
+    # Makes the rename durable; not possible (or needed) on Windows
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def switch_to(name):
+    """
+    Make generation `name` the live index. The pointer is written to a
+    temporary file and renamed over CURRENT, so readers see the old or the
+    new generation, never a partial one.
+    """
+    pointer = os.path.join(search.index_root(), search.CURRENT_FILE)
+    tmp = pointer + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(name + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, pointer)
+    _fsync_dir(search.index_root())
+    search.reset_index()
+
+def _remove_generation(name):
+    path = _generation_dir(name)
+    if name != '.':
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    # The legacy index shares SEARCH_INDEX_DIR with the pointer and the generations
+    for entry in os.listdir(path):
+        if entry.startswith(GENERATION_PREFIX) or entry.startswith(search.CURRENT_FILE):
+            continue
+        full = os.path.join(path, entry)
+        if os.path.isdir(full):
+            shutil.rmtree(full, ignore_errors=True)
+        else:
+            os.remove(full)
+
+def prune_generations(keep=None):
+    """
+    Delete generations older than the live one, except the `keep` most
+    recent (default SEARCH_KEEP_GENERATIONS), which rollback_index() can go
+    back to. Returns the names deleted.
+    """
+    keep = settings.SEARCH_KEEP_GENERATIONS if keep is None else keep
+    names = generations()
+    current = current_generation()
+    if current not in names:
+        return []
+    older = names[:names.index(current)]
+    removed = older[:max(len(older) - keep, 0)]
+    for name in removed:
+        _remove_generation(name)
+    return removed
+
+def rollback_index():
+    """
+    Switch back to the newest generation older than the live one, and delete
+    the one switched away from. Returns the name of the now live generation,
+    or None if there's nothing to go back to.
+    """
+    names = generations()
+    current = current_generation()
+    if current not in names or names.index(current) == 0:
+        return None
+    previous = names[names.index(current) - 1]
+    switch_to(previous)
+    _remove_generation(current)
+    return previous
+
+
+def _changes(before, searchers):
+    """
+    File ids written or deleted in the index since the snapshot `before`,
+    and a snapshot of the index now: {segment key: (file ids, deleted docnums)}.
+
+    Any write lands in a new segment and a delete marks a document deleted in
+    an existing one. Merges replace segments, so every file in a merged
+    segment counts as changed.
+    """
+    after, changed = {}, set()
+    readers = {(shard, reader.segment().segment_id()): reader for shard, reader in search.segment_readers(searchers)}
+    for key, reader in readers.items():
+        field = search.file_field(reader.schema)
+        deleted = frozenset(reader.segment().deleted_docs()) if reader.has_deletions() else frozenset()
+        if key in before:
+            ids, was_deleted = before[key]
+            # Deleted documents keep their stored fields
+            changed.update(reader.stored_fields(docnum)[field] for docnum in deleted - was_deleted)
+        else:
+            ids = frozenset(term.decode('utf-8') for term in reader.lexicon(field))
+            changed |= ids
+        after[key] = (ids, deleted)
+    for key in before.keys() - after.keys():
+        changed |= before[key][0]
+    return changed, after
+
+def _catch_up(snapshot, old_shards, new_shards):
+    """
+    Bring the new generation up to date with what was written to the live
+    one since `snapshot`. Returns the new snapshot and the number of files
+    rewritten or removed.
+    """
+    searchers = [ix.searcher() for ix in old_shards]
+    try:
+        changed, snapshot = _changes(snapshot, searchers)
+        if not changed:
+            return snapshot, 0
+        ids = [int(file_id) for file_id in changed]
+        kept = set()
+        with search.BulkIndexer(ix=new_shards, dedupe=False) as writer:
+            for file_obj in File.objects.filter(id__in=ids, duplicate_of__isnull=True).iterator():
+                kept.add(str(file_obj.id))
+                searcher = searchers[search.shard_of(file_obj.id, len(searchers))]
+                writer.add(file_obj, content=search.indexed_content(searcher, str(file_obj.id)))
+        search.delete_documents(sorted(changed - kept, key=int), shards=new_shards)
+    finally:
+        for searcher in searchers:
+            searcher.close()
+    return snapshot, len(changed)
+
+def rebuild_index(store_content=None, reextract=False, shards=None, passages=None, stdout=None,
+                  catch_up_rounds=3, lock_timeout=None):
+    """
+    Build a new index generation with the current schema and switch to it.
+    The live index keeps serving searches and writes meanwhile.
+
+    Every File row that isn't a near-duplicate (see core.dedupe) is written
+    with the current fields. Content is carried over from the existing index
+    (or text store) unless `reextract` is set or it isn't there, in which
+    case the file is extracted again.
+
+    Writes to the live index during the build are then replayed onto the new
+    generation, up to `catch_up_rounds` times while writes continue, and a
+    last time with the live index's write locks held (waiting up to
+    `lock_timeout` seconds, default SEARCH_INDEX_LOCK_TIMEOUT, for running
+    writers), so nothing lands in between the last catch-up and the switch.
+    Live writers wait for those locks and then write to the new generation.
+    Older generations beyond SEARCH_KEEP_GENERATIONS are deleted afterwards.
+
+    `shards` changes the number of shards (default: keep the current count).
+    A sharded index is written by one process per shard. `passages` switches
+    between whole-file and passage documents (default: SEARCH_PASSAGES).
+    Returns the new generation's name and document count, and sizes in bytes
+    of the old index, the new index and the text store.
+    """
+    if lock_timeout is None:
+        lock_timeout = settings.SEARCH_INDEX_LOCK_TIMEOUT
+    old_dir = search.current_index_dir()
+    old_shards = search.open_shards(old_dir)
+    old_size = search.index_size(old_dir)
+    old_stored = search.stores_content(old_shards[0].schema)
+    shards = shards or len(old_shards)
+
+    name = _next_generation()
+    new_dir = _generation_dir(name)
+    new_shards = search.open_shards(new_dir, search.make_schema(store_content, passages), shards)
+    new_stored = search.stores_content(new_shards[0].schema)
+    new_passages = search.is_passage_index(new_shards[0].schema)
+
+    if len(new_shards) > 1:
+        writer = ShardWriterPool(search.shard_dirs(new_dir))
+    else:
+        # Duplicates are skipped below, their rows already say what they copy
+        writer = search.BulkIndexer(ix=new_shards, dedupe=False)
+
+    try:
+        searchers = [ix.searcher() for ix in old_shards]
+        try:
+            # Taken before any row is read, so later writes show up as changes
+            _, snapshot = _changes({}, searchers)
+            with writer:
+                files = File.objects.filter(duplicate_of__isnull=True).order_by('id')
+                for file_obj in files.iterator(chunk_size=2000):
+                    content = None
+                    if not reextract:
+                        searcher = searchers[search.shard_of(file_obj.id, len(searchers))]
+                        content = search.indexed_content(searcher, str(file_obj.id))
+                    writer.add(file_obj, content=content)
+        finally:
+            for searcher in searchers:
+                searcher.close()
+        if stdout:
+            stdout.write(f'Wrote {writer.count} documents to {len(new_shards)} shard(s) in {name}')
+
+        for _ in range(catch_up_rounds):
+            snapshot, changed = _catch_up(snapshot, old_shards, new_shards)
+            if not changed:
+                break
+            if stdout:
+                stdout.write(f'Caught up with {changed} files changed during the rebuild')
+
+        # Holding the live shards' write locks (through writers that are
+        # never committed) stops writes there until the switch
+        locks = []
+        try:
+            for ix in old_shards:
+                locks.append(ix.writer(timeout=lock_timeout))
+            _catch_up(snapshot, old_shards, new_shards)
+            switch_to(name)
+        finally:
+            for lock in locks:
+                lock.cancel()
+    except Exception:
+        if current_generation() != name:
+            shutil.rmtree(new_dir, ignore_errors=True)
+        raise
+
+    prune_generations()
+    return {
+        'generation': name,
+        'documents': writer.count,
+        'shards': len(new_shards),
+        'old_index': old_size,
+        'old_stores_content': old_stored,
+        'new_index': search.index_size(new_dir),
+        'new_stores_content': new_stored,
+        'passages': new_passages,
+        'text_store': directory_size(textstore.store_dir()),
+    }
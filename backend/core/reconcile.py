@@ -0,0 +1,70 @@
+import os
+from . import search, textstore
+from .ingest import purge_files
+from .models import File
+
+def orphaned_documents(file_ids=None):
+    """
+    Ids of live index documents that have no File row.
+    """
+    if file_ids is None:
+        file_ids = set(File.objects.values_list('id', flat=True))
+    orphans = []
+    # The id lexicon still has terms of deleted documents until their
+    # segment is merged, so check each candidate is live
+    for searcher in search.index_manager.searchers():
+        field = search.file_field(searcher.schema)
+        for term in searcher.lexicon(field):
+            doc_id = term.decode('utf-8')
+            if (not doc_id.isdigit() or int(doc_id) not in file_ids) and searcher.document_number(**{field: doc_id}) is not None:
+                orphans.append(doc_id)
+    return orphans
+
+def missing_files():
+    """
+    (id, path) of File rows whose file is no longer on disk.
+    """
+    return [
+        (file_id, path)
+        for file_id, path in File.objects.values_list('id', 'path').iterator(chunk_size=2000)
+        if not os.path.lexists(path)
+    ]
+
+def orphaned_text(file_ids):
+    """
+    Text store entries that have no File row.
+    """
+    orphans = []
+    if not os.path.isdir(textstore.store_dir()):
+        return orphans
+    for bucket in os.scandir(textstore.store_dir()):
+        if not bucket.is_dir():
+            continue
+        for entry in os.scandir(bucket.path):
+            doc_id, ext = os.path.splitext(entry.name)
+            if ext == '.z' and (not doc_id.isdigit() or int(doc_id) not in file_ids):
+                orphans.append(doc_id)
+    return orphans
+
+def gc_index(dry_run=False):
+    """
+    Find and purge what has drifted apart between the database, the disk and
+    the index: rows for files that are gone, index documents and text store
+    entries without a row. Everything is removed in bulk, one index commit
+    for all of it. Returns what was found.
+    """
+    missing = missing_files()
+    # Documents of missing rows aren't orphans, purge_files drops them with the row
+    file_ids = set(File.objects.values_list('id', flat=True))
+    report = {
+        'missing_files': [path for _, path in missing],
+        'orphaned_documents': orphaned_documents(file_ids),
+        'orphaned_text': orphaned_text(file_ids),
+    }
+    if dry_run:
+        return report
+
+    purge_files([file_id for file_id, _ in missing])
+    search.delete_documents(report['orphaned_documents'])
+    textstore.delete(report['orphaned_text'])
+    return report
@@ -1,46 +1,867 @@
+import logging
+import math
 import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
 from django.conf import settings
-from whoosh.index import create_in, open_dir, exists_in
-from whoosh.fields import Schema, TEXT, ID, STORED
-from whoosh.qparser import QueryParser
-from .utils import extract_text_from_file  # <--- Import this
+from django.utils import timezone
+from whoosh import sorting
+from whoosh.index import create_in, open_dir, exists_in, LockError
+from whoosh.fields import Schema, TEXT, ID, STORED, NUMERIC, DATETIME
+from whoosh.qparser import MultifieldParser
+from whoosh.reading import SegmentReader
+from whoosh.writing import MERGE_SMALL, NO_MERGE
+from whoosh.query import NumericRange, DateRange
+from . import extraction_cache, metrics, textstore
+from .utils import join_passages, split_passages
 
-# ... (Schema and get_index remain the same) ...
-SCHEMA = Schema(
-    id=ID(stored=True, unique=True),
-    path=STORED(),
-    title=TEXT(stored=True),
-    content=TEXT(stored=True)
-)
+def make_schema(store_content=None, passages=None):
+    """
+    The index schema. With store_content False, content is indexed but not
+    stored, and snippets come from the compressed text store instead.
+
+    file_type, size and modified are sortable (column) fields so facet
+    counts don't need to load stored fields.
+
+    With passages, every file is indexed as overlapping passages of its text
+    (see write_document), each a document with its File id as `parent`, its
+    PDF page and its offset in the text. Passages always store their content:
+    they are short, and highlighting them is what makes snippets cheap.
+    """
+    if store_content is None:
+        store_content = settings.SEARCH_STORE_CONTENT
+    if passages is None:
+        passages = settings.SEARCH_PASSAGES
+    fields = dict(
+        id=ID(stored=True, unique=True),
+        path=STORED(),
+        title=TEXT(stored=True),
+        content=TEXT(stored=store_content or passages),
+        file_type=ID(stored=True, sortable=True),
+        size=NUMERIC(bits=64, stored=True, sortable=True),
+        modified=DATETIME(sortable=True),
+    )
+    if passages:
+        fields.update(parent=ID(stored=True, sortable=True), page=STORED(), start=STORED())
+    return Schema(**fields)
+
+SCHEMA = make_schema()
+
+def index_root():
+    """
+    SEARCH_INDEX_DIR, the directory holding the index and its generations.
+    """
+    return str(settings.SEARCH_INDEX_DIR)
+
+SEARCH_FIELDS = ["title", "content"]
 
-INDEX_DIR = os.path.join(settings.BASE_DIR, 'search_index')
+logger = logging.getLogger(__name__)
+documents_indexed = metrics.counter('pkse_documents_indexed_total', 'Documents written to the search index.')
+
+def _open_index(index_dir, schema=None):
+    if not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+        return create_in(index_dir, schema or SCHEMA)
+    if not exists_in(index_dir):
+        return create_in(index_dir, schema or SCHEMA)
+    return open_dir(index_dir)
+
+def stores_content(schema):
+    return schema['content'].stored
+
+def is_passage_index(schema):
+    return 'parent' in schema
+
+def file_field(schema):
+    """
+    The field holding the File id of a document: `parent` for passages.
+    """
+    return 'parent' if is_passage_index(schema) else 'id'
+
+SHARD_PREFIX = 'shard-'
+
+def shard_of(file_id, shard_count):
+    """
+    Shard a document lives in. File ids are sequential, so taking them
+    modulo the shard count spreads documents evenly.
+    """
+    return int(file_id) % shard_count
+
+def shard_dirs(index_dir, shard_count=None):
+    """
+    Directories of an index's shards. An unsharded index is just index_dir,
+    a sharded one has a shard-NNN subdirectory per shard. An index that
+    doesn't exist yet gets `shard_count` shards (default SEARCH_SHARDS).
+    """
+    if os.path.isdir(index_dir):
+        names = sorted(name for name in os.listdir(index_dir) if name.startswith(SHARD_PREFIX))
+        if names:
+            return [os.path.join(index_dir, name) for name in names]
+        if exists_in(index_dir):
+            return [index_dir]
+    shard_count = shard_count or settings.SEARCH_SHARDS
+    if shard_count == 1:
+        return [index_dir]
+    return [os.path.join(index_dir, f'{SHARD_PREFIX}{i:03d}') for i in range(shard_count)]
+
+def open_shards(index_dir, schema=None, shard_count=None):
+    return [_open_index(path, schema) for path in shard_dirs(index_dir, shard_count)]
+
+def segment_readers(searchers):
+    """
+    (shard, reader) for every segment of open searchers, one per shard. An
+    empty index (or shard) has a reader but no segment.
+    """
+    for shard, searcher in enumerate(searchers):
+        for reader, _ in searcher.reader().leaf_readers():
+            if reader.segment() is not None:
+                yield shard, reader
+
+def index_size(index_dir):
+    """
+    Bytes on disk of the index in index_dir, not counting other generations
+    kept under it.
+    """
+    total = 0
+    for path in shard_dirs(index_dir):
+        if os.path.isdir(path):
+            total += sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    return total
+
+# SEARCH_INDEX_DIR/CURRENT names the live generation (see core.rebuild), e.g.
+# gen-1792300000, numbered from the clock when it was built. Without it
+# the index lives in SEARCH_INDEX_DIR itself
+CURRENT_FILE = 'CURRENT'
+_current = (None, None)
+
+def current_index_dir():
+    """
+    Directory of the live index generation. The pointer file is only read
+    again when it has been replaced, so this costs a stat per call.
+    """
+    global _current
+    root = index_root()
+    pointer = os.path.join(root, CURRENT_FILE)
+    try:
+        stats = os.stat(pointer)
+    except FileNotFoundError:
+        return root
+    key = (pointer, stats.st_ino, stats.st_mtime_ns)
+    cached_key, index_dir = _current
+    if cached_key != key:
+        with open(pointer) as f:
+            index_dir = os.path.normpath(os.path.join(root, f.read().strip()))
+        _current = (key, index_dir)
+    return index_dir
+
+
+class IndexManager:
+    """
+    Keeps the index open for the life of the process instead of opening it on
+    every request.
+
+    The index is one or more shards (see shard_dirs). Whoosh searchers read
+    through shared file handles, so each thread gets its own searcher per
+    shard (and query parser). A thread's searchers are kept across requests
+    and only refreshed when a newer generation of their shard has been
+    committed. When a rebuild switches to a new index generation, each
+    thread moves over on its next call; searches already running finish on
+    the old one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = None
+        self._index_dir = None
+        # Bumped by reset() so threads drop searchers on the old index
+        self._epoch = 0
+
+    def shards(self):
+        index_dir = current_index_dir()
+        shards = self._shards
+        if shards is None or self._index_dir != index_dir:
+            with self._lock:
+                if self._shards is None or self._index_dir != index_dir:
+                    self._shards = open_shards(index_dir)
+                    self._index_dir = index_dir
+                    self._epoch += 1
+                shards = self._shards
+        return shards
+
+    def index_dir(self):
+        self.shards()
+        return self._index_dir
+
+    def index(self):
+        """
+        The index, or its first shard when sharded.
+        """
+        return self.shards()[0]
+
+    def shard_count(self):
+        return len(self.shards())
+
+    def shard_index(self, file_id):
+        """
+        The shard a File's document is written to.
+        """
+        shards = self.shards()
+        return shards[shard_of(file_id, len(shards))]
+
+    def writer(self, file_id, **kwargs):
+        """
+        A writer on the shard for a File in the live generation, waiting up to
+        SEARCH_INDEX_LOCK_TIMEOUT for its lock. If a rebuild switched
+        generations while the lock was being taken, it is dropped and the new
+        generation's shard is opened instead.
+        """
+        kwargs.setdefault('timeout', settings.SEARCH_INDEX_LOCK_TIMEOUT)
+        while True:
+            shards = self.shards()
+            writer = shards[shard_of(file_id, len(shards))].writer(**kwargs)
+            if self.shards() is shards:
+                return writer
+            writer.cancel()
+
+    def _thread_state(self):
+        shards = self.shards()
+        local = self._local
+        if getattr(local, 'epoch', None) != self._epoch:
+            for searcher in getattr(local, 'searchers', None) or []:
+                searcher.close()
+            local.epoch = self._epoch
+            local.searchers = [ix.searcher() for ix in shards]
+            local.parser = MultifieldParser(SEARCH_FIELDS, shards[0].schema)
+        return local
+
+    def searchers(self):
+        """
+        This thread's searcher for each shard, refreshed if the shard has
+        changed. Don't close them.
+        """
+        local = self._thread_state()
+        for i, searcher in enumerate(local.searchers):
+            if not searcher.up_to_date():
+                local.searchers[i] = searcher.refresh()
+        return local.searchers
+
+    def searcher(self):
+        """
+        This thread's searcher on the first shard (the whole index unless sharded).
+        """
+        return self.searchers()[0]
+
+    def parser(self):
+        return self._thread_state().parser
+
+    def generation(self):
+        """
+        Generation of the index this thread's (refreshed) searchers read, a
+        list of per-shard generations when sharded.
+        """
+        generations = [searcher.reader().generation() for searcher in self.searchers()]
+        return generations[0] if len(generations) == 1 else generations
+
+    def reset(self):
+        """
+        Forget the open index, e.g. after its directory was deleted or replaced.
+        """
+        with self._lock:
+            self._shards = None
+            self._index_dir = None
+            self._epoch += 1
+
+
+index_manager = IndexManager()
 
 def get_index():
-    if not os.path.exists(INDEX_DIR):
-        os.mkdir(INDEX_DIR)
-        return create_in(INDEX_DIR, SCHEMA)
-    if not exists_in(INDEX_DIR):
-        return create_in(INDEX_DIR, SCHEMA)
-    return open_dir(INDEX_DIR)
+    return index_manager.index()
 
-def index_file(file_obj):
+def reset_index():
+    index_manager.reset()
+
+KB = 1024
+MB = 1024 * KB
+SIZE_BUCKETS = [
+    ('< 10 KB', None, 10 * KB - 1),
+    ('10 KB - 1 MB', 10 * KB, MB - 1),
+    ('1 MB - 10 MB', MB, 10 * MB - 1),
+    ('> 10 MB', 10 * MB, None),
+]
+
+def _facets(schema):
+    """
+    Facets for the fields this index has. Dates are bucketed relative to now.
+    """
+    facets = {}
+    if 'file_type' in schema:
+        facets['file_type'] = sorting.FieldFacet('file_type', maptype=sorting.Count)
+    if 'size' in schema:
+        facets['size'] = sorting.QueryFacet({
+            label: NumericRange('size', start, end) for label, start, end in SIZE_BUCKETS
+        }, maptype=sorting.Count)
+    if 'modified' in schema:
+        now = datetime.now(dt_timezone.utc).replace(tzinfo=None)
+        week, month, year = now - timedelta(days=7), now - timedelta(days=30), now - timedelta(days=365)
+        facets['modified'] = sorting.QueryFacet({
+            'past week': DateRange('modified', week, None),
+            'past month': DateRange('modified', month, week, endexcl=True),
+            'past year': DateRange('modified', year, month, endexcl=True),
+            'older': DateRange('modified', None, year, endexcl=True),
+        }, maptype=sorting.Count)
+    return facets
+
+_fanout_pool = None
+_fanout_lock = threading.Lock()
+
+def _fan_out(func, searchers):
+    """
+    Call func(searcher) for each shard's searcher on the fan-out thread pool
+    and return the results in shard order. With one shard it just runs here.
+
+    Each searcher belongs to the calling thread, which waits for all of them,
+    so no searcher is ever used by two threads at once.
+    """
+    global _fanout_pool
+    if len(searchers) == 1:
+        return [func(searchers[0])]
+    if _fanout_pool is None:
+        with _fanout_lock:
+            if _fanout_pool is None:
+                _fanout_pool = ThreadPoolExecutor(
+                    max_workers=settings.SEARCH_FANOUT_THREADS, thread_name_prefix='pkse-search')
+    return list(_fanout_pool.map(func, searchers))
+
+def search_files(query_string, page=1, page_size=20, highlight=True, facets=True):
+    """
+    Run a query against title and content and return one page of results.
+
+    Returns a dict with the result list (with a highlighted content snippet
+    unless `highlight` is off), the total hit count, paging info and, with
+    `facets`, hit counts per file type, size bucket and modification date.
+
+    On a sharded index the query runs on every shard in parallel, each
+    shard's top `page * page_size` hits are merged by score and the facet
+    counts are summed.
+    """
+    with metrics.timed('searcher_open'):
+        searchers = index_manager.searchers()
+    with metrics.timed('query_parse'):
+        query = index_manager.parser().parse(query_string)
+    passages = is_passage_index(searchers[0].schema)
+    facet_map = _facets(searchers[0].schema) if facets else {}
+    limit = max(page, 1) * page_size
+
+    def search_shard(searcher):
+        """
+        (results, hit count, facet counts) of one shard. Hits, totals and
+        facets count files: in a passage index only each file's best
+        passage is kept, and one matching passage per file is counted.
+        """
+        if not passages:
+            results = searcher.search(query, limit=limit, groupedby=facet_map or None)
+            return results, len(results), {name: results.groups(name) for name in facet_map}
+        results = searcher.search(query, limit=limit, collapse='parent', collapse_limit=1)
+        file_docs = _file_docs(searcher, results.docs())
+        return results, len(file_docs), _count_facets(searcher, file_docs, facet_map)
+
+    with metrics.timed('search'):
+        shard_results = _fan_out(search_shard, searchers)
+
+    # Same paging rules as Whoosh's search_page
+    total = sum(count for _, count, _ in shard_results)
+    pages = math.ceil(total / page_size)
+    page = min(pages, page)
+    offset = max(page - 1, 0) * page_size
+
+    # Ties keep shard and rank order, so one shard orders exactly like Whoosh
+    ranked = sorted(
+        ((hit.score, shard, rank, hit)
+         for shard, (results, _, _) in enumerate(shard_results)
+         for rank, hit in enumerate(results)),
+        key=lambda entry: (-entry[0], entry[1], entry[2]),
+    )
+
+    results_data = []
+    stored = stores_content(searchers[0].schema)
+    for score, _, _, r in ranked[offset:offset + page_size]:
+        item = {
+            "id": r.get("parent") if passages else r.get("id"),
+            "title": r.get("title"),
+            "path": r.get("path"),
+            "file_type": r.get("file_type"),
+            "size": r.get("size"),
+            "score": score,
+        }
+        if passages:
+            # Page of the best matching passage, None outside PDFs
+            item["page"] = r.get("page")
+        # Highlight matches in content, only for the hits we return
+        if highlight:
+            with metrics.timed('highlight'):
+                if stored:
+                    item["snippet"] = r.highlights("content")
+                else:
+                    item["snippet"] = r.highlights("content", text=_snippet_text(r))
+        results_data.append(item)
+
+    data = {
+        "results": results_data,
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "pages": pages,
+    }
+    if facet_map:
+        data["facets"] = {}
+        with metrics.timed('facets'):
+            for name in facet_map:
+                counts = Counter()
+                for _, _, facet_counts in shard_results:
+                    counts.update(facet_counts[name])
+                data["facets"][name] = dict(counts)
+    return data
+
+def _file_docs(searcher, docnums):
     """
-    Index a File model instance with actual content extraction.
+    One document number per file among matching passages.
     """
-    ix = get_index()
-    writer = ix.writer()
-    
-    # Extract real content
-    content = extract_text_from_file(file_obj.path)
-    
+    parents = searcher.reader().column_reader('parent')
+    first = {}
+    for docnum in docnums:
+        first.setdefault(parents[docnum], docnum)
+    return list(first.values())
+
+def _count_facets(searcher, docnums, facet_map):
+    """
+    Facet counts over the given documents, read straight from the sortable
+    columns: one lookup per document rather than categorizing every match.
+    """
+    reader = searcher.reader()
+    columns = {}
+
+    def value(fieldname, docnum):
+        if fieldname not in columns:
+            columns[fieldname] = reader.column_reader(fieldname)
+        return columns[fieldname][docnum]
+
+    counts = {}
+    for name, facet in facet_map.items():
+        counter = counts[name] = Counter()
+        for docnum in docnums:
+            if isinstance(facet, sorting.QueryFacet):
+                key = next((label for label, query in facet.querydict.items()
+                            if _in_range(query, value(query.fieldname, docnum))), facet.other)
+            else:
+                key = value(facet.fieldname, docnum)
+            counter[key] += 1
+    return counts
+
+def _in_range(query, value):
+    # NumericRange/DateRange bounds (DateRange keeps its datetimes aside)
+    start, end = (query.startdate, query.enddate) if isinstance(query, DateRange) else (query.start, query.end)
+    if start is not None and (value < start or (query.startexcl and value == start)):
+        return False
+    if end is not None and (value > end or (query.endexcl and value == end)):
+        return False
+    return True
+
+def _snippet_text(hit):
+    """
+    Text to highlight for a hit when the index doesn't store content: the
+    text store, or re-extraction (which then fills the store).
+    """
+    text = textstore.get(hit["id"])
+    if text is None:
+        text = extraction_cache.extract(hit["path"]) or hit["title"]
+        textstore.put(hit["id"], text)
+    return text
+
+def TIERED_MERGE(writer, segments):
+    """
+    Merge policy: segments are grouped into tiers by size (powers of
+    SEARCH_MERGE_FACTOR) and a tier is merged into one segment once it holds
+    SEARCH_MERGE_FACTOR segments. Every commit adding a tiny segment then
+    costs little, and the segment count stays logarithmic in the doc count.
+    """
+    factor = settings.SEARCH_MERGE_FACTOR
+    tiers = {}
+    for segment in segments:
+        tier = int(math.log(max(segment.doc_count_all(), 1), factor))
+        tiers.setdefault(tier, []).append(segment)
+
+    remaining = []
+    for tier in tiers.values():
+        if len(tier) < factor:
+            remaining.extend(tier)
+            continue
+        for segment in tier:
+            reader = SegmentReader(writer.storage, writer.schema, segment)
+            writer.add_reader(reader)
+            reader.close()
+    return remaining
+
+MERGE_POLICIES = {
+    'small': MERGE_SMALL,
+    'tiered': TIERED_MERGE,
+    'none': NO_MERGE,
+}
+
+def commit(writer):
+    """
+    Commit a writer using the configured SEARCH_MERGE_POLICY.
+    """
+    with metrics.timed('index_commit'):
+        writer.commit(mergetype=MERGE_POLICIES[settings.SEARCH_MERGE_POLICY])
+
+def write_document(writer, fields):
+    """
+    Add or replace a document, keeping the text store in step when the
+    index doesn't store content. In a passage index the file's passages
+    replace all of its previous ones.
+    """
+    if is_passage_index(writer.schema):
+        _write_passages(writer, fields)
+        return
+    if not stores_content(writer.schema):
+        textstore.put(fields['id'], fields['content'])
+    # Indexes built before a field was added to SCHEMA just skip it
+    names = writer.schema.names()
+    writer.update_document(**{k: v for k, v in fields.items() if k in names and v is not None})
+
+def _write_passages(writer, fields):
+    names = writer.schema.names()
+    common = {k: v for k, v in fields.items() if k in names and k not in ('id', 'content') and v is not None}
+    parent = fields['id']
+    writer.delete_by_term('parent', parent)
+    passages = split_passages(fields['content'], settings.SEARCH_PASSAGE_CHARS, settings.SEARCH_PASSAGE_OVERLAP)
+    for number, (page, start, text) in enumerate(passages):
+        extra = {'page': page} if page is not None else {}
+        writer.add_document(id=f'{parent}:{number}', parent=parent, start=start, content=text, **extra, **common)
+
+def build_document(file_obj, content=None):
+    """
+    Build the index fields for a File. Extracts the content unless it is given.
+    """
+    if content is None:
+        content = extraction_cache.extract(file_obj.path, extraction_cache.trusted_hash(file_obj))
+
     # If no content extracted, fallback to name
     if not content.strip():
         content = file_obj.name
 
-    writer.update_document(
-        id=str(file_obj.id),
-        path=file_obj.path,
-        title=file_obj.name,
-        content=content
-    )
-    writer.commit()
\ No newline at end of file
+    if file_obj.mtime_ns is not None:
+        modified = datetime.fromtimestamp(file_obj.mtime_ns / 1e9, dt_timezone.utc)
+    else:
+        modified = file_obj.created_at
+
+    return {
+        'id': str(file_obj.id),
+        'path': file_obj.path,
+        'title': file_obj.name,
+        'content': content,
+        'file_type': file_obj.file_type,
+        'size': file_obj.size,
+        # Whoosh wants naive UTC datetimes
+        'modified': modified.astimezone(dt_timezone.utc).replace(tzinfo=None) if modified else None,
+    }
+
+def mark_indexed(file_ids):
+    from .models import File
+    # Queryset update so we don't fire post_save and index again
+    File.objects.filter(id__in=file_ids).update(indexed_at=timezone.now())
+
+def _deduplicator():
+    from . import dedupe
+    return dedupe.Deduplicator() if dedupe.enabled() else None
+
+def _reindex_released(file_ids):
+    # Duplicates of a file that changed, now to be indexed in their own right
+    if file_ids:
+        from .tasks import enqueue, index_files_task
+        enqueue(index_files_task, file_ids)
+
+def _delete_document(writer, file_id):
+    writer.delete_by_term(file_field(writer.schema), str(file_id))
+    textstore.delete([file_id])
+
+def index_file(file_obj):
+    """
+    Index a File model instance with actual content extraction. A
+    near-duplicate of an indexed file is left out of the index.
+    """
+    with metrics.timed('index_file'):
+        document = build_document(file_obj)
+        deduplicator = _deduplicator()
+        duplicate = deduplicator is not None and deduplicator.check(file_obj, document['content']) is not None
+        # Waits up to SEARCH_INDEX_LOCK_TIMEOUT for the shard's write lock
+        with metrics.timed('index_writer_open'):
+            writer = index_manager.writer(file_obj.id)
+        if duplicate:
+            _delete_document(writer, file_obj.id)
+        else:
+            write_document(writer, document)
+        commit(writer)
+        mark_indexed([file_obj.id])
+    if deduplicator is not None:
+        _reindex_released(deduplicator.flush())
+    if not duplicate:
+        documents_indexed.inc()
+
+def indexed_content(searcher, doc_id):
+    """
+    Text already extracted for a document, from the index or the text store.
+    """
+    if is_passage_index(searcher.schema):
+        passages = [(fields.get('page'), fields['start'], fields['content'])
+                    for fields in searcher.documents(parent=doc_id)]
+        return join_passages(passages) if passages else None
+    if stores_content(searcher.schema):
+        fields = searcher.document(id=doc_id)
+        return fields.get('content') if fields else None
+    return textstore.get(doc_id)
+
+def reindex_moved(file_objs, **kwargs):
+    """
+    Rewrite the documents of renamed or moved Files. The content is carried
+    over from the existing documents, so files are only extracted again if
+    they weren't indexed yet. Returns the number written.
+    """
+    with BulkIndexer(**kwargs) as indexer:
+        searchers = [ix.searcher() for ix in indexer.shards]
+        try:
+            for file_obj in file_objs:
+                searcher = searchers[shard_of(file_obj.id, len(searchers))]
+                indexer.add(file_obj, content=indexed_content(searcher, str(file_obj.id)))
+        finally:
+            for searcher in searchers:
+                searcher.close()
+    return indexer.count
+
+def delete_documents(file_ids, shards=None):
+    """
+    Remove the documents for the given File ids, one commit per shard, from
+    `shards` (default: the live index).
+    """
+    file_ids = list(file_ids)
+    if not file_ids:
+        return
+    live = shards is None
+    if live:
+        shards = index_manager.shards()
+    by_shard = {}
+    for file_id in file_ids:
+        # Ids that aren't File ids (see reconcile.orphaned_documents) could be in any shard
+        targets = [shard_of(file_id, len(shards))] if str(file_id).isdigit() else range(len(shards))
+        for shard in targets:
+            by_shard.setdefault(shard, []).append(file_id)
+    for shard, ids in by_shard.items():
+        writer = shards[shard].writer(timeout=settings.SEARCH_INDEX_LOCK_TIMEOUT)
+        if live and index_manager.shards() is not shards:
+            # A rebuild switched generations, start over on the new one
+            writer.cancel()
+            return delete_documents(file_ids)
+        field = file_field(writer.schema)
+        for file_id in ids:
+            writer.delete_by_term(field, str(file_id))
+        commit(writer)
+    if live:
+        textstore.delete(file_ids)
+
+
+class BulkIndexer:
+    """
+    Writes many documents through one long-lived writer per shard instead of
+    a commit per document. Commits every `batch_size` documents or
+    `commit_interval` seconds, whichever comes first. Use it as a context
+    manager so the tail gets committed:
+
+        with BulkIndexer() as indexer:
+            for file_obj in File.objects.iterator():
+                indexer.add(file_obj)
+
+    `ix` is an index or a list of shards, the live index by default.
+    `procs` > 1 uses Whoosh's multiprocessing writer for the segment building.
+    Near-duplicates of indexed files are left out (see core.dedupe) unless
+    `dedupe` is False; exact copies aren't even extracted.
+    """
+
+    def __init__(self, ix=None, batch_size=None, commit_interval=None, procs=None, limitmb=None, dedupe=True):
+        # The live index follows generation switches between batches
+        self.live = ix is None
+        if ix is None:
+            ix = index_manager.shards()
+        self.shards = ix if isinstance(ix, list) else [ix]
+        self.batch_size = batch_size or settings.SEARCH_INDEX_BATCH_SIZE
+        self.commit_interval = commit_interval or settings.SEARCH_INDEX_COMMIT_INTERVAL
+        self.procs = procs or settings.SEARCH_INDEX_PROCS
+        self.limitmb = limitmb or settings.SEARCH_INDEX_LIMITMB
+        self.writers = {}
+        self.pending = []
+        self.batch_started = None
+        self.count = 0
+        self.commits = 0
+        self.duplicates = 0
+        self.deduplicator = _deduplicator() if dedupe else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.cancel()
+        return False
+
+    def _writer(self, file_id):
+        if self.live and not self.writers:
+            self.shards = index_manager.shards()
+        shard = shard_of(file_id, len(self.shards))
+        writer = self.writers.get(shard)
+        if writer is None:
+            ix = self.shards[shard]
+            if self.writers:
+                # Don't wait for a lock while holding others (two bulk
+                # indexers could each wait on the other's), commit and wait
+                # with nothing held instead
+                try:
+                    writer = self._open_writer(ix, timeout=0)
+                except LockError:
+                    self.commit()
+                    return self._writer(file_id)
+            else:
+                writer = self._open_writer(ix, timeout=settings.SEARCH_INDEX_LOCK_TIMEOUT)
+            if self.live and not self.writers and index_manager.shards() is not self.shards:
+                # Switched generations while we took the lock
+                writer.cancel()
+                return self._writer(file_id)
+            self.writers[shard] = writer
+            if self.batch_started is None:
+                self.batch_started = time.monotonic()
+        return writer
+
+    def _open_writer(self, ix, timeout):
+        if self.procs > 1:
+            return ix.writer(procs=self.procs, limitmb=self.limitmb, timeout=timeout)
+        return ix.writer(limitmb=self.limitmb, timeout=timeout)
+
+    def add(self, file_obj, content=None):
+        if content is None and self.add_if_copy(file_obj):
+            return
+        document = build_document(file_obj, content)
+        if self.deduplicator is not None and self.deduplicator.check(file_obj, document['content']) is not None:
+            self.add_duplicate(file_obj.id)
+            return
+        self.add_document(file_obj.id, **document)
+
+    def add_if_copy(self, file_obj):
+        """
+        Handle an exact copy of a file already checked, known by its content
+        hash, without extracting it. Returns whether it was one.
+        """
+        if self.deduplicator is None or self.deduplicator.exact(file_obj) is None:
+            return False
+        self.add_duplicate(file_obj.id)
+        return True
+
+    def add_duplicate(self, file_id):
+        """
+        Count a near-duplicate as handled, removing any document it had.
+        """
+        _delete_document(self._writer(file_id), file_id)
+        self.duplicates += 1
+        self._added(file_id)
+
+    def add_document(self, file_id, **fields):
+        write_document(self._writer(file_id), fields)
+        self._added(file_id)
+
+    def _added(self, file_id):
+        self.pending.append(file_id)
+        self.count += 1
+        if (len(self.pending) >= self.batch_size
+                or time.monotonic() - self.batch_started >= self.commit_interval):
+            self.commit()
+
+    def commit(self):
+        if not self.writers:
+            return
+        for writer in self.writers.values():
+            commit(writer)
+        self.writers = {}
+        self.batch_started = None
+        self.commits += 1
+        documents_indexed.inc(len(self.pending))
+        mark_indexed(self.pending)
+        self.pending = []
+        if self.deduplicator is not None:
+            _reindex_released(self.deduplicator.flush())
+
+    def cancel(self):
+        for writer in self.writers.values():
+            writer.cancel()
+        self.writers = {}
+        self.batch_started = None
+        self.pending = []
+        if self.deduplicator is not None:
+            self.deduplicator = _deduplicator()
+
+
+def bulk_index(file_objs, workers=None, progress=None, **kwargs):
+    """
+    Index an iterable of File instances in batches. Returns the number indexed.
+    `progress` is called with the running count after each document.
+
+    With more than one extraction worker, text is extracted in an
+    ExtractionPool and documents are written as each file finishes.
+    """
+    from .extraction import ExtractionPool
+
+    workers = workers or settings.EXTRACTION_WORKERS
+    with BulkIndexer(**kwargs) as indexer:
+        if workers > 1:
+            def to_extract():
+                for file_obj in file_objs:
+                    if not indexer.add_if_copy(file_obj):
+                        yield file_obj
+                    elif progress:
+                        progress(indexer.count)
+
+            with ExtractionPool(workers=workers) as pool:
+                for file_obj, content, error in pool.extract_files(to_extract()):
+                    if error:
+                        logger.warning('Extraction failed', extra={'path': file_obj.path, 'error': error})
+                    indexer.add(file_obj, content=content)
+                    if progress:
+                        progress(indexer.count)
+        else:
+            for file_obj in file_objs:
+                indexer.add(file_obj)
+                if progress:
+                    progress(indexer.count)
+    return indexer.count
+
+# Keep id__in lists under SQLite's bound-parameter limit
+ID_CHUNK_SIZE = 500
+
+def bulk_index_ids(file_ids, **kwargs):
+    """
+    bulk_index() for a list of File ids, loading the rows a chunk at a time.
+    """
+    from .models import File
+
+    file_ids = list(file_ids)
+
+    def files():
+        for i in range(0, len(file_ids), ID_CHUNK_SIZE):
+            yield from File.objects.filter(id__in=file_ids[i:i + ID_CHUNK_SIZE]).order_by('id')
+
+    if not file_ids:
+        return 0
+    return bulk_index(files(), **kwargs)
+
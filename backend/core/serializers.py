@@ -1,8 +1,22 @@
 from rest_framework import serializers
-from .models import File
+from .models import File, Job, Upload
 
 class FileSerializer(serializers.ModelSerializer):
     class Meta:
         model = File
-        fields = ['id', 'name', 'path', 'file_type', 'size', 'created_at', 'indexed_at']
-        read_only_fields = ['path', 'size', 'file_type', 'created_at', 'indexed_at']
\ No newline at end of file
+        fields = ['id', 'name', 'path', 'file_type', 'size', 'created_at', 'indexed_at', 'duplicate_of']
+        read_only_fields = ['path', 'size', 'file_type', 'created_at', 'indexed_at', 'duplicate_of']
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'status', 'params', 'total', 'processed', 'result', 'error', 'created_at', 'updated_at']
+        read_only_fields = fields
+
+class UploadSerializer(serializers.ModelSerializer):
+    file = FileSerializer(read_only=True)
+
+    class Meta:
+        model = Upload
+        fields = ['id', 'name', 'size', 'offset', 'status', 'content_hash', 'file', 'created_at', 'updated_at']
+        read_only_fields = ['offset', 'status', 'content_hash', 'file', 'created_at', 'updated_at']
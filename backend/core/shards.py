@@ -0,0 +1,115 @@
+import multiprocessing
+from django.conf import settings
+from whoosh.index import open_dir
+from . import search
+
+def _writer_main(index_dir, conn, batch_size, limitmb):
+    """
+    Shard writer process: write each document sent over the pipe to one
+    shard, committing every `batch_size` documents. A None means finish up;
+    the process then sends back its document count (or an error string).
+    """
+    try:
+        ix = open_dir(index_dir)
+        writer = None
+        pending = count = 0
+        while True:
+            fields = conn.recv()
+            if fields is None:
+                break
+            if writer is None:
+                writer = ix.writer(limitmb=limitmb)
+            search.write_document(writer, fields)
+            pending += 1
+            count += 1
+            if pending >= batch_size:
+                search.commit(writer)
+                writer = None
+                pending = 0
+        if writer is not None:
+            search.commit(writer)
+        conn.send(count)
+    except Exception as e:
+        conn.send(f'{index_dir}: {e}')
+
+
+class ShardWriterPool:
+    """
+    One writer process per shard, so a sharded index is built in parallel:
+    each shard has its own lock and segment files, and Whoosh's pure-Python
+    segment building runs on as many cores as there are shards.
+
+        with ShardWriterPool(search.shard_dirs(new_dir)) as pool:
+            for file_obj in files:
+                pool.add(file_obj)
+
+    Documents are built here (extraction included) and sent to the process
+    of their shard. The shard indexes must already exist.
+    """
+
+    def __init__(self, index_dirs, batch_size=None, limitmb=None):
+        self.index_dirs = list(index_dirs)
+        self.batch_size = batch_size or settings.SEARCH_INDEX_BATCH_SIZE
+        self.limitmb = limitmb or settings.SEARCH_INDEX_LIMITMB
+        self.file_ids = []
+        self.count = 0
+        self._ctx = multiprocessing.get_context('fork')
+        self._workers = []
+
+    def __enter__(self):
+        for index_dir in self.index_dirs:
+            conn, child_conn = self._ctx.Pipe()
+            process = self._ctx.Process(
+                target=_writer_main, args=(index_dir, child_conn, self.batch_size, self.limitmb), daemon=True)
+            process.start()
+            child_conn.close()
+            self._workers.append((process, conn))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.kill()
+        return False
+
+    def add(self, file_obj, content=None):
+        self.add_document(file_obj.id, **search.build_document(file_obj, content))
+
+    def add_document(self, file_id, **fields):
+        _, conn = self._workers[search.shard_of(file_id, len(self._workers))]
+        conn.send(fields)
+        self.file_ids.append(file_id)
+
+    def close(self):
+        """
+        Let every shard commit its tail and wait for them. Raises if a shard failed.
+        """
+        for _, conn in self._workers:
+            conn.send(None)
+        errors = []
+        for process, conn in self._workers:
+            try:
+                result = conn.recv()
+            except EOFError:
+                result = f'writer process exited with {process.exitcode}'
+            if isinstance(result, str):
+                errors.append(result)
+            else:
+                self.count += result
+            process.join()
+            conn.close()
+        self._workers = []
+        if errors:
+            raise RuntimeError('Shard writers failed: ' + '; '.join(errors))
+
+        for i in range(0, len(self.file_ids), search.ID_CHUNK_SIZE):
+            search.mark_indexed(self.file_ids[i:i + search.ID_CHUNK_SIZE])
+        return self.count
+
+    def kill(self):
+        for process, conn in self._workers:
+            process.kill()
+            process.join()
+            conn.close()
+        self._workers = []
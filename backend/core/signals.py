@@ -1,9 +1,68 @@
-from django.db.models.signals import post_save
+import threading
+from contextlib import contextmanager
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from .models import File
-from .search import index_file
+from .search import bulk_index, delete_documents
+
+_state = threading.local()
+
+@contextmanager
+def deferred_indexing(**kwargs):
+    """
+    Collect File saves and deletes made inside the block and apply them to the
+    index in one bulk pass on exit instead of one commit per change. Keyword
+    arguments go to BulkIndexer.
+
+    Nothing is indexed if the block raises: its changes may have been rolled
+    back. Reconcile (core.reconcile) picks up any that were committed.
+    """
+    if getattr(_state, 'pending', None) is not None:
+        # Already deferring further up the stack, the outer block indexes
+        yield
+        return
+
+    _state.pending = pending = {}
+    _state.deleted = deleted = set()
+    try:
+        yield
+    finally:
+        _state.pending = _state.deleted = None
+    delete_documents(deleted)
+    bulk_index([f for pk, f in pending.items() if pk not in deleted], **kwargs)
 
 @receiver(post_save, sender=File)
 def update_index(sender, instance, created, **kwargs):
-    # Synchronous indexing for now
-    index_file(instance)
\ No newline at end of file
+    pending = getattr(_state, 'pending', None)
+    if pending is not None:
+        pending[instance.pk] = instance
+        return
+    # Index on the Celery worker once the row is committed
+    from .tasks import enqueue, index_files_task
+    file_id = instance.pk
+    transaction.on_commit(lambda: enqueue(index_files_task, [file_id]))
+
+@receiver(post_delete, sender=File)
+def remove_from_index(sender, instance, **kwargs):
+    deleted = getattr(_state, 'deleted', None)
+    if deleted is not None:
+        deleted.add(instance.pk)
+        return
+    from .tasks import enqueue, delete_documents_task
+    file_id = instance.pk
+    transaction.on_commit(lambda: enqueue(delete_documents_task, [file_id]))
+
+def index_later(files):
+    """
+    Index Files once the current transaction commits, or with the rest when
+    indexing is deferred.
+    """
+    pending = getattr(_state, 'pending', None)
+    if pending is not None:
+        pending.update((f.pk, f) for f in files)
+        return
+    from .tasks import enqueue, index_files_task
+    file_ids = [f.pk for f in files]
+    if file_ids:
+        transaction.on_commit(lambda: enqueue(index_files_task, file_ids))
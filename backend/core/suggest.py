@@ -0,0 +1,202 @@
+"""
+Prefix completion for the search box, from the index's title and content
+lexicons. Nothing is looked up in stored fields or run through the query
+parser: suggestions come from a sorted in-memory term list.
+"""
+import bisect
+import heapq
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from . import metrics, search, textstore
+
+FIELDS = ('title', 'content')
+# Terms this short aren't worth completing to
+MIN_TERM_LENGTH = 2
+
+
+def _segment_terms(reader, exact=False):
+    """
+    {field: Counter(term -> doc frequency)} for one segment, from its term
+    infos. These still count documents deleted since the segment was
+    written, see _deleted_terms. With `exact`, deleted documents are left
+    out by walking each term's postings instead, which is much slower.
+    """
+    exact = exact and reader.has_deletions()
+    terms = {}
+    for field in FIELDS:
+        counts = terms[field] = Counter()
+        if field not in reader.schema:
+            continue
+        for term, info in reader.iter_field(field):
+            if len(term) < MIN_TERM_LENGTH:
+                continue
+            count = sum(1 for _ in reader.postings(field, term).all_ids()) if exact else info.doc_frequency()
+            if count:
+                counts[term.decode('utf-8')] = count
+    return terms
+
+
+def _deleted_terms(reader, docnums):
+    """
+    {field: Counter(term -> doc count)} of the given deleted documents, by
+    analysing their stored text again. Much cheaper than walking every
+    term's postings, which took seconds on a large segment. Content that
+    isn't stored comes from the text store, which has the file's latest
+    text (or nothing once it's gone), so those counts are approximate: the
+    second value returned says whether any were.
+    """
+    schema = reader.schema
+    terms = {field: Counter() for field in FIELDS}
+    approximate = False
+    for docnum in docnums:
+        # Deleted documents keep their stored fields
+        fields = reader.stored_fields(docnum)
+        for field in FIELDS:
+            if field not in schema:
+                continue
+            text = fields.get(field)
+            if text is None and field == 'content' and not search.is_passage_index(schema):
+                text = textstore.get(fields['id'])
+                approximate = True
+            if text:
+                tokens = schema[field].process_text(text, mode='index')
+                terms[field].update({token for token in tokens if len(token) >= MIN_TERM_LENGTH})
+    return terms, approximate
+
+
+class TermIndex:
+    """
+    Doc frequencies of title and content terms over all segments of all
+    shards, plus the sorted list of those terms for prefix lookups.
+
+    Kept per segment: after a commit only the segments that are new (a
+    flushed batch, or the result of a merge) are read, the counts of
+    segments that went away are subtracted, and documents deleted since
+    the last refresh are taken off their segment's counts. Segments whose
+    deletions could only be counted approximately are recounted every
+    SUGGEST_RECOUNT_INTERVAL seconds. In a passage index content
+    frequencies count passages rather than files.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (shard, segment id) -> [{field: Counter}, deleted docnums counted]
+        self._segments = {}
+        self._seen = {}
+        # Segments with approximate counts, and when they were last recounted
+        self._approximate = set()
+        self._recounted = time.monotonic()
+        self._counts = {field: Counter() for field in FIELDS}
+        self._terms = []
+
+    def refresh(self, searchers):
+        # Segment ids are random, so a rebuilt or replaced index never matches
+        current = {
+            (shard, reader.segment().segment_id()): reader
+            for shard, reader in search.segment_readers(searchers)
+        }
+        seen = {key: reader.segment().deleted_count() for key, reader in current.items()}
+        if seen == self._seen and not self._recount_due():
+            return
+        with self._lock:
+            if seen == self._seen and not self._recount_due():
+                return
+            added, dropped = set(), set()
+            for key in self._segments.keys() - current.keys():
+                self._approximate.discard(key)
+                for field, counts in self._segments.pop(key)[0].items():
+                    self._counts[field].subtract(counts)
+                    dropped.update(counts)
+            for key in current.keys() - self._segments.keys():
+                segment = self._segments[key] = [_segment_terms(current[key]), set()]
+                for field, counts in segment[0].items():
+                    self._counts[field].update(counts)
+                    added.update(counts)
+            for key, reader in current.items():
+                segment_counts, deleted = self._segments[key]
+                if seen[key] == len(deleted):
+                    continue
+                newly = set(reader.segment().deleted_docs()) - deleted
+                deleted |= newly
+                terms, approximate = _deleted_terms(reader, newly)
+                if approximate:
+                    self._approximate.add(key)
+                for field, counts in terms.items():
+                    segment_counts[field].subtract(counts)
+                    self._counts[field].subtract(counts)
+                    dropped.update(counts)
+
+            if self._recount_due():
+                for key in self._approximate:
+                    old = self._segments[key][0]
+                    new = self._segments[key][0] = _segment_terms(current[key], exact=True)
+                    for field in FIELDS:
+                        self._counts[field].subtract(old[field])
+                        self._counts[field].update(new[field])
+                        dropped.update(old[field])
+                        added.update(new[field])
+                self._approximate.clear()
+                self._recounted = time.monotonic()
+
+            for field in FIELDS:
+                counts = self._counts[field]
+                for term in dropped:
+                    if counts.get(term, 1) <= 0:
+                        del counts[term]
+            known = set(self._terms)
+            gone = {term for term in dropped if not any(term in counts for counts in self._counts.values())}
+            new = sorted(added - known - gone)
+            # Merge instead of re-sorting: a commit usually brings few new terms
+            self._terms = [term for term in heapq.merge(self._terms, new) if term not in gone]
+            self._seen = seen
+
+    def _recount_due(self):
+        return bool(self._approximate) and time.monotonic() - self._recounted >= settings.SUGGEST_RECOUNT_INTERVAL
+
+    def complete(self, prefix, limit):
+        """
+        Up to `limit` (term, title doc count, content doc count) for terms
+        starting with `prefix`, most frequent first with a title counting
+        SUGGEST_TITLE_WEIGHT times as much as content.
+        """
+        weight = settings.SUGGEST_TITLE_WEIGHT
+        matches = []
+        # The counts are updated in place by refresh()
+        with self._lock:
+            terms, title, content = self._terms, self._counts['title'], self._counts['content']
+            for i in range(bisect.bisect_left(terms, prefix), len(terms)):
+                term = terms[i]
+                if not term.startswith(prefix):
+                    break
+                in_title, in_content = title.get(term, 0), content.get(term, 0)
+                if in_title or in_content >= settings.SUGGEST_MIN_DOC_FREQ:
+                    matches.append((in_title * weight + in_content, term, in_title, in_content))
+                if len(matches) >= settings.SUGGEST_SCAN_LIMIT:
+                    break
+        top = heapq.nlargest(limit, matches, key=lambda match: match[0])
+        return [match[1:] for match in top]
+
+
+term_index = TermIndex()
+
+
+def suggest(query_string, limit=8):
+    """
+    Completions for the last word of `query_string`, each the whole query
+    with that word completed, plus how many documents have the term in
+    their title and content.
+    """
+    head, _, prefix = query_string.lower().rpartition(' ')
+    prefix = prefix.strip()
+    if len(prefix) < settings.SUGGEST_MIN_PREFIX:
+        return []
+    with metrics.timed('suggest'):
+        term_index.refresh(search.index_manager.searchers())
+        completions = term_index.complete(prefix, limit)
+    head = f'{head.strip()} ' if head.strip() else ''
+    return [
+        {'text': head + term, 'title_docs': in_title, 'content_docs': in_content}
+        for term, in_title, in_content in completions
+    ]
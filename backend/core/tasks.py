@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from celery import shared_task
+from django.conf import settings
+from django.db import close_old_connections
+from .models import File, Job
+
+logger = logging.getLogger(__name__)
+
+# Seconds to remember that the broker was unreachable before probing again
+BROKER_RETRY_INTERVAL = 30
+# Seconds to trust a successful probe, so a burst of saves doesn't probe each time
+BROKER_CHECK_INTERVAL = 5
+# Write job progress at most this often
+PROGRESS_INTERVAL = 1.0
+
+_local_queue = None
+_local_queue_lock = threading.Lock()
+_broker_down_until = 0
+_broker_up_until = 0
+
+
+def _broker_available():
+    global _broker_down_until, _broker_up_until
+    now = time.monotonic()
+    if now < _broker_up_until:
+        return True
+    if now < _broker_down_until:
+        return False
+    from config.celery import app
+    try:
+        with app.connection_for_write() as conn:
+            conn.ensure_connection(max_retries=0, timeout=1)
+        _broker_up_until = time.monotonic() + BROKER_CHECK_INTERVAL
+        return True
+    except Exception as e:
+        logger.warning('Celery broker unreachable (%s), running tasks in-process', e)
+        _broker_down_until = time.monotonic() + BROKER_RETRY_INTERVAL
+        return False
+
+
+def _run_local(task, args):
+    try:
+        task.apply(args=args)
+    finally:
+        close_old_connections()
+
+
+def enqueue(task, *args):
+    """
+    Send a task to the Celery worker.
+
+    With CELERY_TASK_ALWAYS_EAGER the task runs inline (tests, scripts). If the
+    broker can't be reached and TASKS_LOCAL_FALLBACK is on, it runs on a single
+    in-process background thread instead, so local runs work without Redis.
+    """
+    if settings.CELERY_TASK_ALWAYS_EAGER:
+        return task.apply(args=args)
+    if settings.TASKS_LOCAL_FALLBACK and not _broker_available():
+        global _local_queue
+        with _local_queue_lock:
+            if _local_queue is None:
+                # One thread, so fallback index writes never contend for the lock
+                _local_queue = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pkse-tasks')
+        return _local_queue.submit(_run_local, task, args)
+    return task.apply_async(args=args)
+
+
+class JobProgress:
+    """
+    Progress callback that writes to the Job row at most every PROGRESS_INTERVAL seconds.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.last_write = 0
+
+    def __call__(self, processed, total=None):
+        self.job.processed = processed
+        if total is not None:
+            self.job.total = total
+        now = time.monotonic()
+        if now - self.last_write >= PROGRESS_INTERVAL:
+            self.last_write = now
+            Job.objects.filter(pk=self.job.pk).update(processed=self.job.processed, total=self.job.total)
+
+
+def _run_job(job_id, func):
+    job = Job.objects.get(pk=job_id)
+    job.status = Job.STATUS_RUNNING
+    job.save(update_fields=['status', 'updated_at'])
+    try:
+        job.result = func(job, JobProgress(job))
+        job.status = Job.STATUS_SUCCESS
+    except Exception as e:
+        logger.exception('Job %s failed', job_id)
+        job.status = Job.STATUS_FAILURE
+        job.error = str(e)
+    job.save()
+    return job.status
+
+
+@shared_task(ignore_result=True)
+def index_files_task(file_ids):
+    from .search import bulk_index_ids
+    # A single save isn't worth starting an extraction pool for
+    workers = 1 if len(file_ids) == 1 else None
+    bulk_index_ids(file_ids, workers=workers)
+
+
+@shared_task(ignore_result=True)
+def delete_documents_task(file_ids):
+    from .search import delete_documents
+    delete_documents(file_ids)
+
+
+@shared_task(ignore_result=True)
+def optimize_index_task(force=False):
+    from .maintenance import optimize_index
+    optimized, before, after = optimize_index(force=force)
+    if optimized:
+        logger.info('Optimized index: %s segments -> %s', before['segment_count'], after['segment_count'])
+
+
+@shared_task(ignore_result=True)
+def reindex_task(job_id):
+    from .search import bulk_index
+
+    def run(job, progress):
+        files = File.objects.order_by('id')
+        job.total = files.count()
+        count = bulk_index(files.iterator(chunk_size=2000), progress=progress)
+        return {'count': count}
+
+    return _run_job(job_id, run)
+
+
+@shared_task(ignore_result=True)
+def ingest_directory_task(job_id):
+    from .ingest import ingest_directory, sync_directory
+
+    def run(job, progress):
+        params = job.params
+        if params.get('incremental'):
+            report = sync_directory(
+                params['path'],
+                hash_content=params.get('hash', False),
+                purge=params.get('purge', False),
+                progress=progress,
+            )
+            return {'count': report['created'] + report['updated'], **report}
+        count, errors = ingest_directory(params['path'], progress=progress)
+        return {'count': count, 'errors': errors}
+
+    return _run_job(job_id, run)
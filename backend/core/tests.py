@@ -1,38 +1,77 @@
+import json
 import os
 import shutil
+import tempfile
+import threading
 import time
-from django.test import TestCase
+from io import BytesIO, StringIO
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.test import AsyncRequestFactory, TestCase, override_settings
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.conf import settings
-from .models import File
-from .search import get_index
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from .models import File, Job, Upload
+from .search import get_index, reset_index, index_manager, indexed_content, delete_documents, BulkIndexer
+from .ingest import ingest_directory, sync_directory
+from .extraction import ExtractionPool
+from .utils import PAGE_BREAK, extract_text_from_file, iter_text_chunks
+from . import dedupe, extraction_cache, extractors, query_cache, rebuild, search, uploads
+from .rebuild import rebuild_index
+from .watcher import ChangeBatcher, apply_changes
+from .reconcile import gc_index
+from .signals import deferred_indexing
+from .maintenance import optimize_index
+from . import async_views
 
 
-class FileUploadTests(TestCase):
+class IndexTestCase(TestCase):
+    """
+    Runs with the search index, media, text store and extraction cache in a
+    temporary directory, and a directory of five notes to ingest.
+    """
+
     def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.index_dir = os.path.join(self.tmp, 'search_index')
+        media_root = os.path.join(self.tmp, 'media')
+        paths = override_settings(
+            SEARCH_INDEX_DIR=self.index_dir,
+            MEDIA_ROOT=media_root,
+            UPLOAD_TEMP_DIR=os.path.join(media_root, '.uploads'),
+            TEXT_STORE_DIR=os.path.join(self.tmp, 'text_store'),
+            EXTRACTION_CACHE_DIR=os.path.join(self.tmp, 'extraction_cache'),
+        )
+        paths.enable()
+        self.addCleanup(paths.disable)
+        reset_index()
+        self.addCleanup(reset_index)
+        caches[settings.SEARCH_CACHE_ALIAS].clear()
         self.client = APIClient()
-        self.test_file_path = 'test_upload.txt'
+        self.data_dir = os.path.join(self.tmp, 'data')
+        os.makedirs(self.data_dir)
+        for i in range(5):
+            with open(os.path.join(self.data_dir, f'note{i}.txt'), 'w') as f:
+                f.write(f"bulk note number{i}")
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class FileUploadTests(IndexTestCase):
+    def setUp(self):
+        super().setUp()
+        self.test_file_path = os.path.join(self.tmp, 'test_upload.txt')
         with open(self.test_file_path, 'w') as f:
             f.write("This is a test content for search indexing.")
-            
-        # Clear index for testing
-        self.index_dir = os.path.join(settings.BASE_DIR, 'search_index')
-        if os.path.exists(self.index_dir):
-            shutil.rmtree(self.index_dir)
-
-    def tearDown(self):
-        if os.path.exists(self.test_file_path):
-            os.remove(self.test_file_path)
-        # Clean up media
-        if os.path.exists(settings.MEDIA_ROOT):
-            shutil.rmtree(settings.MEDIA_ROOT)
 
     def test_upload_file(self):
-        with open(self.test_file_path, 'rb') as f:
+        with open(self.test_file_path, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
             response = self.client.post('/api/upload/', {'file': f}, format='multipart')
         
-        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
         self.assertEqual(File.objects.count(), 1)
         
         file_obj = File.objects.first()
@@ -49,43 +88,778 @@ class FileUploadTests(TestCase):
                     found = True
             self.assertTrue(found, "Content not found in search index")
 
+    def test_chunked_upload_resumes_and_dedupes(self):
+        data = b"chunked upload content " * 100
+        response = self.client.post('/api/uploads/', {'name': '../chunked.txt', 'size': len(data)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        url = f"/api/uploads/{response.data['id']}/"
+
+        response = self.client.patch(url, data[:1000], content_type='application/octet-stream', HTTP_UPLOAD_OFFSET='0')
+        self.assertEqual(response.data['offset'], 1000)
+        # A retried chunk from the wrong offset tells the client where to resume
+        response = self.client.patch(url, data[:1000], content_type='application/octet-stream', HTTP_UPLOAD_OFFSET='0')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response['Upload-Offset'], '1000')
 
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, data[1000:], content_type='application/octet-stream', HTTP_UPLOAD_OFFSET='1000')
+        self.assertEqual(response.data['status'], Upload.STATUS_COMPLETE)
+        first = File.objects.get(pk=response.data['file']['id'])
+        self.assertEqual(first.path, os.path.join(settings.MEDIA_ROOT, 'chunked.txt'))
+        with open(first.path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertIsNotNone(File.objects.get(pk=first.pk).indexed_at)
 
-class FileTests(TestCase):
+        # Same bytes under another name: hard link, not extracted, and kept out
+        # of the index as a duplicate of the first
+        with open(self.test_file_path, 'wb') as f:
+            f.write(data)
+        with open(self.test_file_path, 'rb') as f, self.captureOnCommitCallbacks(execute=True), \
+                mock.patch('core.extraction_cache.extract', side_effect=AssertionError('re-extracted')):
+            response = self.client.post('/api/upload/', {'file': f}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        second = File.objects.get(pk=response.data['id'])
+        self.assertEqual(os.stat(second.path).st_ino, os.stat(first.path).st_ino)
+        self.assertEqual(second.content_hash, first.content_hash)
+        self.assertEqual(second.duplicate_of_id, first.pk)
+        self.assertEqual(get_index().doc_count(), 1)
+
+        # And again under the same name: nothing new
+        with open(self.test_file_path, 'rb') as f:
+            response = self.client.post('/api/upload/', {'file': f}, format='multipart')
+        self.assertEqual((response.status_code, response.data['id']), (status.HTTP_200_OK, second.pk))
+        self.assertEqual(os.listdir(settings.UPLOAD_TEMP_DIR), [])
+
+    def test_stale_chunk_does_not_touch_the_partial_file(self):
+        upload = uploads.start_upload('stale.txt', 10)
+        stale = Upload.objects.get(pk=upload.pk)
+        uploads.append_chunk(upload, BytesIO(b'12345'), 0, 5)
+        # A second request for the same offset, read before the first one wrote
+        with self.assertRaises(uploads.OffsetMismatch):
+            uploads.append_chunk(stale, BytesIO(b'abcde'), 0, 5)
+        with open(uploads.part_path(upload.pk), 'rb') as f:
+            self.assertEqual(f.read(), b'12345')
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class FileTests(IndexTestCase):
     def setUp(self):
-        self.client = APIClient()
-        self.test_file_path = 'test_upload.txt'
+        super().setUp()
+        self.test_file_path = os.path.join(self.tmp, 'test_upload.txt')
         with open(self.test_file_path, 'w') as f:
             f.write("This is a test content for search indexing.")
-            
-        # Clear index for testing
-        self.index_dir = os.path.join(settings.BASE_DIR, 'search_index')
-        if os.path.exists(self.index_dir):
-            shutil.rmtree(self.index_dir)
-
-    def tearDown(self):
-        if os.path.exists(self.test_file_path):
-            os.remove(self.test_file_path)
-        if os.path.exists(settings.MEDIA_ROOT):
-            shutil.rmtree(settings.MEDIA_ROOT)
 
     def test_upload_and_search(self):
         # 1. Upload
-        with open(self.test_file_path, 'rb') as f:
+        with open(self.test_file_path, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
             response = self.client.post('/api/upload/', {'file': f}, format='multipart')
-        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
 
         # 2. List
         response = self.client.get('/api/files/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
         # 3. Search
         # Re-open index to ensure changes are committed
-        # (In real app, commit happens in signal, but we might need a small delay or force refresh in tests if using async, but here it is sync)
+        # (Indexing runs as a Celery task, eager in tests so it is done by now)
         
         response = self.client.get('/api/search/?q=content')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertTrue(len(response.data) > 0)
-        self.assertEqual(response.data[0]['title'], 'test_upload.txt')
-        print(f"Search Snippet: {response.data[0]['snippet']}")
\ No newline at end of file
+        self.assertTrue(len(response.data['results']) > 0)
+        self.assertEqual(response.data['results'][0]['title'], 'test_upload.txt')
+        self.assertIn('content', response.data['results'][0]['snippet'])
+
+    def test_search_profile_and_metrics(self):
+        with open(self.test_file_path, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/upload/', {'file': f}, format='multipart')
+
+        response = self.client.get('/api/search/?q=content', HTTP_X_PKSE_PROFILE='1')
+        stages = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual(stages[:3], ['searcher_open', 'query_parse', 'search'])
+        self.assertIn('highlight', stages)
+        self.assertNotIn('Server-Timing', self.client.get('/api/search/?q=other'))
+
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn('# TYPE pkse_stage_seconds histogram', body)
+        self.assertIn('pkse_stage_seconds_count{stage="extract"}', body)
+        self.assertIn('pkse_http_requests_total{method="GET",status="200",view="file-search"}', body)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class BulkIndexTests(IndexTestCase):
+    def test_bulk_indexer_commits_in_batches(self):
+        File.objects.bulk_create([
+            File(path=os.path.join(self.data_dir, f'note{i}.txt'), name=f'note{i}.txt', file_type='txt', size=1)
+            for i in range(5)
+        ])
+        with BulkIndexer(batch_size=2) as indexer:
+            for file_obj in File.objects.all():
+                indexer.add(file_obj)
+
+        self.assertEqual(indexer.count, 5)
+        self.assertEqual(indexer.commits, 3)
+        self.assertEqual(get_index().doc_count(), 5)
+        self.assertFalse(File.objects.filter(indexed_at__isnull=True).exists())
+
+    def test_ingest_indexes_in_one_pass(self):
+        count, errors = ingest_directory(self.data_dir)
+        self.assertEqual(count, 5)
+        self.assertEqual(errors, [])
+
+        ix = get_index()
+        self.assertEqual(ix.doc_count(), 5)
+        self.assertEqual(len(ix._segments()), 1)
+
+    def test_writers_wait_for_the_shard_lock(self):
+        ingest_directory(self.data_dir)
+        note = File.objects.get(name='note1.txt')
+        # Another worker's writer, done shortly
+        held = index_manager.shard_index(note.id).writer()
+        timer = threading.Timer(0.3, held.cancel)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        delete_documents([note.id])
+        self.assertEqual(get_index().doc_count(), 4)
+
+    def test_failed_deferred_block_is_not_indexed(self):
+        ingest_directory(self.data_dir)
+        with self.assertRaises(RuntimeError):
+            with deferred_indexing():
+                File.objects.filter(name='note1.txt').get().delete()
+                raise RuntimeError('rolled back')
+        self.assertEqual(get_index().doc_count(), 5)
+
+    def test_ingest_endpoint_returns_job(self):
+        response = self.client.post('/api/ingest/', {'path': self.data_dir}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        response = self.client.get(f"/api/jobs/{response.data['id']}/")
+        self.assertEqual(response.data['status'], Job.STATUS_SUCCESS)
+        self.assertEqual(response.data['processed'], 5)
+        self.assertEqual(response.data['result']['count'], 5)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class IncrementalIngestTests(IndexTestCase):
+    def test_sync_only_touches_changed_files(self):
+        report = sync_directory(self.data_dir)
+        self.assertEqual(report['created'], 5)
+
+        report = sync_directory(self.data_dir)
+        self.assertEqual((report['created'], report['updated'], report['unchanged']), (0, 0, 5))
+
+        with open(os.path.join(self.data_dir, 'note0.txt'), 'a') as f:
+            f.write(" edited")
+        os.remove(os.path.join(self.data_dir, 'note1.txt'))
+
+        report = sync_directory(self.data_dir, purge=True)
+        self.assertEqual((report['updated'], report['unchanged']), (1, 3))
+        self.assertEqual(report['deleted'], [os.path.join(os.path.abspath(self.data_dir), 'note1.txt')])
+        self.assertEqual(File.objects.count(), 4)
+        self.assertEqual(get_index().doc_count(), 4)
+
+    @override_settings(INGEST_CHUNK_SIZE=2)
+    def test_reingest_updates_rows_across_chunks(self):
+        ingest_directory(self.data_dir)
+        ids = dict(File.objects.values_list('path', 'id'))
+        with open(os.path.join(self.data_dir, 'note3.txt'), 'w') as f:
+            f.write('rewritten number3')
+
+        # Backends that can't return ids from an upsert look them up by path
+        features = type(connection.features)
+        with mock.patch.object(features, 'can_return_rows_from_bulk_insert', False), \
+                mock.patch('core.ingest.bulk_index_ids') as index_ids:
+            count, errors = ingest_directory(self.data_dir)
+        self.assertEqual((count, errors), (5, []))
+        self.assertEqual(sorted(index_ids.call_args.args[0]), sorted(ids.values()))
+        self.assertEqual(dict(File.objects.values_list('path', 'id')), ids)
+        self.assertEqual(File.objects.get(name='note3.txt').size, len('rewritten number3'))
+
+    def test_sync_skips_touched_files_with_same_hash(self):
+        sync_directory(self.data_dir, hash_content=True)
+        path = os.path.join(self.data_dir, 'note2.txt')
+        os.utime(path, ns=(0, 0))
+
+        report = sync_directory(self.data_dir, hash_content=True)
+        self.assertEqual((report['updated'], report['unchanged']), (0, 5))
+        self.assertEqual(File.objects.get(name='note2.txt').mtime_ns, 0)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class SearchTests(IndexTestCase):
+    def test_searcher_is_reused_until_a_commit(self):
+        os.remove(os.path.join(self.data_dir, 'note4.txt'))
+        ingest_directory(self.data_dir)
+        searcher = index_manager.searcher()
+        self.assertEqual(searcher.doc_count(), 4)
+        self.assertIs(index_manager.searcher(), searcher)
+
+        with open(os.path.join(self.data_dir, 'note4.txt'), 'w') as f:
+            f.write("bulk note number4")
+        ingest_directory(self.data_dir)
+        refreshed = index_manager.searcher()
+        self.assertIsNot(refreshed, searcher)
+        self.assertEqual(refreshed.doc_count(), 5)
+        self.assertIs(index_manager.searcher(), refreshed)
+
+    def test_search_results_are_cached_per_generation(self):
+        query_cache.reset_stats()
+        ingest_directory(self.data_dir)
+
+        first = self.client.get('/api/search/?q=bulk')
+        second = self.client.get('/api/search/?q=bulk ')
+        self.assertEqual(first.data['results'], second.data['results'])
+        self.assertEqual(query_cache.stats()['hits'], 1)
+
+        with open(os.path.join(self.data_dir, 'extra.txt'), 'w') as f:
+            f.write("another bulk note")
+        ingest_directory(self.data_dir)
+
+        third = self.client.get('/api/search/?q=bulk')
+        self.assertEqual(third.data['total'], 6)
+        stats = self.client.get('/api/search/cache/').data
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    def test_search_pages_and_facets(self):
+        with open(os.path.join(self.data_dir, 'readme.md'), 'w') as f:
+            f.write("bulk " * 5000)
+        ingest_directory(self.data_dir)
+
+        response = self.client.get('/api/search/?q=bulk&page=2&page_size=4&highlights=0')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['total'], response.data['pages']), (6, 2))
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertNotIn('snippet', response.data['results'][0])
+        self.assertEqual(response.data['facets']['file_type'], {'txt': 5, 'md': 1})
+        self.assertEqual(response.data['facets']['size'], {'< 10 KB': 5, '10 KB - 1 MB': 1})
+        self.assertEqual(response.data['facets']['modified'], {'past week': 6})
+        self.assertIn('query_time_ms', response.data)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class FileListTests(IndexTestCase):
+    def test_file_list_is_cursor_paginated_and_filtered(self):
+        with open(os.path.join(self.data_dir, 'readme.md'), 'w') as f:
+            f.write("bulk " * 5000)
+        ingest_directory(self.data_dir)
+
+        names = []
+        url = '/api/files/?page_size=4'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            names += [f['name'] for f in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(len(names), 6)
+        self.assertEqual(len(set(names)), 6)
+
+        response = self.client.get('/api/files/?file_type=md')
+        self.assertEqual([f['name'] for f in response.data['results']], ['readme.md'])
+        response = self.client.get('/api/files/?file_type=txt&max_size=100')
+        self.assertEqual(len(response.data['results']), 5)
+        response = self.client.get('/api/files/?created_before=2000-01-01')
+        self.assertEqual(response.data['results'], [])
+        response = self.client.get('/api/files/?min_size=big')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class WatcherTests(IndexTestCase):
+    def test_watcher_batches_are_coalesced_and_applied(self):
+        ingest_directory(self.data_dir)
+        path = lambda name: os.path.join(self.data_dir, name)
+
+        batcher = ChangeBatcher(debounce=0, max_delay=0)
+        with open(path('new.txt'), 'w') as f:
+            f.write("freshly watched")
+        for _ in range(3):
+            batcher.add('upsert', path('new.txt'))
+        os.rename(path('note0.txt'), path('renamed.txt'))
+        batcher.add('moved', path('note0.txt'), path('tmp.txt'))
+        batcher.add('moved', path('tmp.txt'), path('renamed.txt'))
+        os.remove(path('note1.txt'))
+        batcher.add('upsert', path('note1.txt'))
+        batcher.add('deleted', path('note1.txt'))
+
+        upserts, deletes, moves = batcher.drain()
+        self.assertEqual(upserts, {path('new.txt')})
+        self.assertEqual(deletes, {path('note1.txt')})
+        self.assertEqual(moves, {path('note0.txt'): path('renamed.txt')})
+        self.assertFalse(batcher)
+
+        apply_changes(upserts, deletes, moves)
+        self.assertEqual(
+            sorted(File.objects.values_list('name', flat=True)),
+            ['new.txt', 'note2.txt', 'note3.txt', 'note4.txt', 'renamed.txt'],
+        )
+        self.assertEqual(get_index().doc_count(), 5)
+        titles = [hit['title'] for hit in query_cache.cached_search('freshly OR number0')['results']]
+        self.assertCountEqual(titles, ['new.txt', 'renamed.txt'])
+
+    def test_saves_through_renames_are_indexed(self):
+        ingest_directory(self.data_dir)
+        path = lambda name: os.path.join(self.data_dir, name)
+        note2 = File.objects.get(name='note2.txt').id
+        batcher = ChangeBatcher(debounce=0, max_delay=0)
+
+        # Atomic save: hidden files send no upserts, only the rename
+        with open(path('.note2.txt.tmp'), 'w') as f:
+            f.write('saved atomically')
+        os.replace(path('.note2.txt.tmp'), path('note2.txt'))
+        batcher.add('moved', path('.note2.txt.tmp'), path('note2.txt'))
+        # Edited, then renamed within the batch
+        with open(path('note3.txt'), 'a') as f:
+            f.write(' edited')
+        batcher.add('upsert', path('note3.txt'))
+        os.rename(path('note3.txt'), path('edited3.txt'))
+        batcher.add('moved', path('note3.txt'), path('edited3.txt'))
+
+        apply_changes(*batcher.drain())
+        self.assertEqual(
+            sorted(File.objects.values_list('name', flat=True)),
+            ['edited3.txt', 'note0.txt', 'note1.txt', 'note2.txt', 'note4.txt'],
+        )
+        self.assertEqual(File.objects.get(name='note2.txt').id, note2)
+        self.assertEqual(get_index().doc_count(), 5)
+        self.assertEqual(query_cache.cached_search('atomically')['results'][0]['title'], 'note2.txt')
+        self.assertEqual(query_cache.cached_search('edited')['results'][0]['title'], 'edited3.txt')
+
+    def test_renames_keep_the_row_and_skip_extraction(self):
+        sync_directory(self.data_dir)
+        file_id = File.objects.get(name='note3.txt').id
+        os.rename(os.path.join(self.data_dir, 'note3.txt'), os.path.join(self.data_dir, 'moved3.txt'))
+
+        with mock.patch('core.extraction_cache.extract', side_effect=AssertionError('re-extracted')):
+            report = sync_directory(self.data_dir, purge=True)
+        self.assertEqual(len(report['moved']), 1)
+        self.assertEqual((report['created'], report['deleted']), (0, []))
+        self.assertEqual(File.objects.get(id=file_id).name, 'moved3.txt')
+        self.assertEqual(get_index().doc_count(), 5)
+        self.assertEqual(query_cache.cached_search('number3')['results'][0]['title'], 'moved3.txt')
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class ReconcileTests(IndexTestCase):
+    def test_deletes_and_gc_keep_index_in_step(self):
+        ingest_directory(self.data_dir)
+        with self.captureOnCommitCallbacks(execute=True):
+            File.objects.get(name='note0.txt').delete()
+        self.assertEqual(get_index().doc_count(), 4)
+
+        # Drift: a file gone from disk and a document without a row
+        os.remove(os.path.join(self.data_dir, 'note1.txt'))
+        File.objects.filter(name='note2.txt').update(id=1000)
+        report = gc_index(dry_run=True)
+        self.assertEqual(len(report['missing_files']), 1)
+        self.assertEqual(len(report['orphaned_documents']), 1)
+
+        gc_index()
+        self.assertEqual(File.objects.count(), 3)
+        self.assertEqual(get_index().doc_count(), 2)
+        self.assertEqual(gc_index(dry_run=True)['orphaned_documents'], [])
+
+    def test_gc_removes_documents_with_non_numeric_ids(self):
+        ingest_directory(self.data_dir)
+        rebuild_index(shards=2)
+        writer = index_manager.shards()[1].writer()
+        writer.add_document(**{search.file_field(writer.schema): 'stray', 'title': 'stray'})
+        writer.commit()
+        self.assertEqual(gc_index()['orphaned_documents'], ['stray'])
+        self.assertEqual(sum(ix.doc_count() for ix in index_manager.shards()), 5)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class MaintenanceTests(IndexTestCase):
+    def test_tiered_merges_and_optimize(self):
+        File.objects.bulk_create([
+            File(path=os.path.join(self.data_dir, f'note{i}.txt'), name=f'note{i}.txt', file_type='txt', size=1)
+            for i in range(5)
+        ])
+        with self.settings(SEARCH_MERGE_FACTOR=3, SEARCH_OPTIMIZE_MAX_SEGMENTS=1):
+            # A commit per document: the fourth commit finds three one-doc
+            # segments and merges them with its own, the fifth adds one more
+            with BulkIndexer(batch_size=1) as indexer:
+                for file_obj in File.objects.order_by('id'):
+                    indexer.add(file_obj)
+            self.assertEqual([s.doc_count_all() for s in get_index()._segments()], [4, 1])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                File.objects.get(name='note0.txt').delete()
+            response = self.client.get('/api/index/stats/')
+            self.assertEqual(response.data['doc_count'], 4)
+            self.assertEqual(response.data['deleted_count'], 1)
+            self.assertTrue(response.data['needs_optimize'])
+            self.assertIsNotNone(response.data['last_commit'])
+
+            optimized, before, after = optimize_index()
+        self.assertTrue(optimized)
+        self.assertEqual((after['segment_count'], after['doc_count'], after['deleted_count']), (1, 4, 0))
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class ShardTests(IndexTestCase):
+    def test_sharded_index_fans_out_and_reshards(self):
+        with open(os.path.join(self.data_dir, 'readme.md'), 'w') as f:
+            f.write("bulk " * 5000)
+        ingest_directory(self.data_dir)
+        unsharded = self.client.get('/api/search/?q=bulk&page_size=4&highlights=0').data
+
+        result = rebuild_index(shards=3)
+        self.assertEqual((result['shards'], result['documents']), (3, 6))
+        self.assertEqual(index_manager.shard_count(), 3)
+        self.assertEqual([ix.doc_count() for ix in index_manager.shards()], [2, 2, 2])
+
+        sharded = self.client.get('/api/search/?q=bulk&page_size=4&highlights=0').data
+        self.assertEqual((sharded['total'], sharded['pages']), (6, 2))
+        self.assertEqual(sharded['facets'], unsharded['facets'])
+        scores = [hit['score'] for hit in sharded['results']]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+        # Writes and deletes go to the document's shard
+        with self.captureOnCommitCallbacks(execute=True):
+            File.objects.get(name='note1.txt').delete()
+        response = self.client.get('/api/search/?q=number2')
+        self.assertEqual(response.data['results'][0]['title'], 'note2.txt')
+        self.assertIn('<b class="match term0">number2</b>', response.data['results'][0]['snippet'])
+        self.assertEqual(self.client.get('/api/index/stats/').data['doc_count'], 5)
+
+        self.assertEqual(rebuild_index(shards=1)['shards'], 1)
+        self.assertEqual(get_index().doc_count(), 5)
+
+        call_command('rebuild_index', '--shards', '2', '--no-store-content', stdout=StringIO())
+        self.assertEqual(index_manager.shard_count(), 2)
+        self.assertFalse(search.stores_content(index_manager.shards()[0].schema))
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class AsyncViewTests(IndexTestCase):
+    @override_settings(ASYNC_BLOCKING_WORKERS=0)
+    async def test_async_views_match_sync_ones(self):
+        await sync_to_async(ingest_directory)(self.data_dir)
+        factory = AsyncRequestFactory()
+
+        response = await async_views.search(factory.get('/api/search/?q=number3&facets=0'))
+        data = json.loads(response.content)
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(data['results'][0]['title'], 'note3.txt')
+        self.assertEqual((await async_views.search(factory.get('/api/search/'))).status_code, 400)
+
+        response = await async_views.file_list(factory.get('/api/files/?page_size=2&min_size=1'))
+        data = json.loads(response.content)
+        self.assertEqual(len(data['results']), 2)
+        self.assertIsNotNone(data['next'])
+        self.assertEqual((await async_views.file_list(factory.get('/api/files/?min_size=x'))).status_code, 400)
+
+        job = await Job.objects.acreate(kind=Job.KIND_INGEST, status=Job.STATUS_SUCCESS)
+        response = await async_views.job_detail(factory.get(f'/api/jobs/{job.pk}/?wait=5'), job.pk)
+        self.assertEqual(json.loads(response.content)['status'], Job.STATUS_SUCCESS)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class PassageIndexTests(IndexTestCase):
+    @override_settings(SEARCH_PASSAGE_CHARS=200, SEARCH_PASSAGE_OVERLAP=40, EXTRACTION_CACHE_MAX_BYTES=0)
+    def test_passage_index_groups_hits_by_file(self):
+        paper_text = PAGE_BREAK.join(['bulk intro ' * 30, 'bulk methods ' * 30 + 'needle ' + 'bulk ' * 30, ''])
+        with open(os.path.join(self.data_dir, 'paper.pdf'), 'wb') as f:
+            f.write(b'%PDF-1.4')
+
+        def extract(path, *args):
+            return paper_text if path.endswith('.pdf') else extract_text_from_file(path, *args)
+
+        with mock.patch('core.extraction_cache.extract_text_from_file', side_effect=extract):
+            ingest_directory(self.data_dir)
+        # Passages are cut from the text already in the index
+        result = rebuild_index(passages=True)
+        self.assertTrue(result['passages'])
+        self.assertGreater(get_index().doc_count(), 6)
+        paper = File.objects.get(name='paper.pdf')
+
+        response = self.client.get('/api/search/?q=needle')
+        self.assertEqual(response.data['total'], 1)
+        hit = response.data['results'][0]
+        self.assertEqual((hit['id'], hit['page']), (str(paper.id), 2))
+        self.assertIn('<b class="match term0">needle</b>', hit['snippet'])
+
+        response = self.client.get('/api/search/?q=bulk&highlights=0')
+        self.assertEqual(response.data['total'], 6)
+        self.assertEqual(len({hit['id'] for hit in response.data['results']}), 6)
+        self.assertEqual(response.data['facets']['file_type'], {'txt': 5, 'pdf': 1})
+
+        with get_index().searcher() as searcher:
+            text = indexed_content(searcher, str(paper.id))
+        self.assertEqual([page.split() for page in text.split(PAGE_BREAK)],
+                         [page.split() for page in paper_text.split(PAGE_BREAK)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            paper.delete()
+        self.assertEqual(get_index().doc_count(), 5)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class SuggestTests(IndexTestCase):
+    def test_suggest_on_an_empty_index(self):
+        response = self.client.get('/api/suggest/?q=bulk')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['suggestions'], [])
+
+    def test_suggest_completes_from_index_terms(self):
+        ingest_directory(self.data_dir)
+        response = self.client.get('/api/suggest/?q=Bulk no')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['suggestions'][0], {'text': 'bulk note', 'title_docs': 0, 'content_docs': 5})
+        # Terms only in one document's content aren't suggested
+        self.assertEqual(self.client.get('/api/suggest/?q=numb').data['suggestions'], [])
+
+        # Picked up from the new segment on the next request, re-indexed notes
+        # no longer counted twice
+        with open(os.path.join(self.data_dir, 'number3.md'), 'w') as f:
+            f.write("number3 again")
+        ingest_directory(self.data_dir)
+        suggestions = self.client.get('/api/suggest/?q=numb').data['suggestions']
+        self.assertEqual([s['text'] for s in suggestions], ['number3.md', 'number3'])
+        self.assertEqual(self.client.get('/api/suggest/').status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(SUGGEST_RECOUNT_INTERVAL=0)
+    def test_counts_without_stored_content_are_recounted(self):
+        ingest_directory(self.data_dir)
+        rebuild_index(store_content=False)
+        self.assertEqual(self.client.get('/api/suggest/?q=bul').data['suggestions'][0]['content_docs'], 5)
+        # The deleted document's text went with it from the text store
+        delete_documents([File.objects.get(name='note0.txt').id])
+        self.assertEqual(self.client.get('/api/suggest/?q=bul').data['suggestions'][0]['content_docs'], 4)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class DedupeTests(IndexTestCase):
+    def test_near_duplicates_are_indexed_once(self):
+        import random
+        rng = random.Random(3)
+        words = [f'word{i}' for i in range(500)]
+        report = [rng.choice(words) for _ in range(400)]
+        with open(os.path.join(self.data_dir, 'report.txt'), 'w') as f:
+            f.write(' '.join(report))
+        # One word changed: near-duplicate
+        with open(os.path.join(self.data_dir, 'report copy.txt'), 'w') as f:
+            f.write(' '.join(report[:200] + ['edited'] + report[201:]))
+        with open(os.path.join(self.data_dir, 'other.txt'), 'w') as f:
+            f.write(' '.join(rng.choice(words) for _ in range(400)))
+
+        ingest_directory(self.data_dir)
+        original, copy = File.objects.get(name='report.txt'), File.objects.get(name='report copy.txt')
+        canonical, duplicate = sorted([original, copy], key=lambda f: f.duplicate_of_id or 0)
+        self.assertEqual(duplicate.duplicate_of_id, canonical.pk)
+        self.assertIsNone(File.objects.get(name='other.txt').duplicate_of_id)
+        self.assertGreater(dedupe.similarity(canonical.minhash, duplicate.minhash), 0.9)
+        self.assertEqual(get_index().doc_count(), 7)
+
+        hits = self.client.get(f'/api/search/?q={report[0]}').data['results']
+        hit = next(hit for hit in hits if hit['id'] == str(canonical.pk))
+        self.assertEqual(hit['duplicates'], [{'id': str(duplicate.pk), 'path': duplicate.path}])
+        self.assertNotIn(str(duplicate.pk), [hit['id'] for hit in hits])
+
+        stdout = StringIO()
+        call_command('dedupe', stdout=stdout)
+        self.assertIn('1 clusters, 1 duplicate files', stdout.getvalue())
+
+        # Deleting the canonical file indexes its duplicate in its place
+        with self.captureOnCommitCallbacks(execute=True):
+            canonical.delete()
+        self.assertIsNone(File.objects.get(pk=duplicate.pk).duplicate_of_id)
+        hits = self.client.get(f'/api/search/?q={report[0]}').data['results']
+        self.assertIn(str(duplicate.pk), [hit['id'] for hit in hits])
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class RebuildTests(IndexTestCase):
+    def test_rebuild_without_stored_content(self):
+        ingest_directory(self.data_dir)
+        with tempfile.TemporaryDirectory() as store_dir, override_settings(TEXT_STORE_DIR=store_dir):
+            sizes = rebuild_index(store_content=False)
+            self.assertEqual(sizes['documents'], 5)
+            self.assertFalse(sizes['new_stores_content'])
+
+            with get_index().searcher() as searcher:
+                self.assertNotIn('content', searcher.document(id=str(File.objects.first().id)))
+
+            response = self.client.get('/api/search/?q=number3')
+            self.assertEqual(response.data['total'], 1)
+            self.assertIn('<b class="match term0">number3</b>', response.data['results'][0]['snippet'])
+
+    def test_live_writes_wait_for_the_switch(self):
+        ingest_directory(self.data_dir)
+        rewritten, gone = File.objects.get(name='note2.txt'), File.objects.get(name='note1.txt')
+        document = search.build_document(rewritten, 'bulk rewritten during the switch')
+        errors = []
+
+        def live_writes():
+            try:
+                writer = index_manager.writer(rewritten.id)
+                search.write_document(writer, document)
+                search.commit(writer)
+                delete_documents([gone.id])
+            except Exception as e:
+                errors.append(e)
+
+        real_catch_up = rebuild._catch_up
+        writes = threading.Thread(target=live_writes)
+
+        def catch_up(*args):
+            # Only called with the live index's locks held (no earlier rounds)
+            writes.start()
+            time.sleep(0.3)
+            self.assertTrue(writes.is_alive())
+            return real_catch_up(*args)
+
+        with mock.patch('core.rebuild._catch_up', side_effect=catch_up):
+            result = rebuild_index(catch_up_rounds=0)
+        writes.join(10)
+        self.assertEqual(errors, [])
+        self.assertEqual(index_manager.index_dir(), os.path.join(self.index_dir, result['generation']))
+        self.assertEqual(self.client.get('/api/search/?q=rewritten').data['total'], 1)
+        self.assertEqual(self.client.get('/api/search/?q=number1').data['total'], 0)
+
+    def test_rebuild_catches_up_and_switches_generations(self):
+        with tempfile.TemporaryDirectory() as store_dir, override_settings(TEXT_STORE_DIR=store_dir):
+            ingest_directory(self.data_dir)
+            self.assertEqual(self.client.get('/api/search/?q=bulk').data['total'], 5)
+            writes = []
+
+            def write_during_build(searcher, doc_id):
+                # The live index keeps changing while the new generation is built
+                if not writes:
+                    writes.append(doc_id)
+                    os.remove(os.path.join(self.data_dir, 'note1.txt'))
+                    with self.captureOnCommitCallbacks(execute=True):
+                        File.objects.get(name='note1.txt').delete()
+                    with open(os.path.join(self.data_dir, 'late.txt'), 'w') as f:
+                        f.write("bulk late arrival")
+                    ingest_directory(self.data_dir)
+                return indexed_content(searcher, doc_id)
+
+            with mock.patch('core.search.indexed_content', side_effect=write_during_build):
+                first = rebuild_index(store_content=False)
+            with open(os.path.join(self.index_dir, 'CURRENT')) as f:
+                self.assertEqual(f.read().strip(), first['generation'])
+            self.assertEqual(index_manager.index_dir(), os.path.join(self.index_dir, first['generation']))
+            self.assertEqual(self.client.get('/api/search/?q=bulk').data['total'], 5)
+            self.assertEqual(self.client.get('/api/search/?q=arrival').data['total'], 1)
+            self.assertEqual(self.client.get('/api/search/?q=number1').data['total'], 0)
+
+            # The pre-generation index is kept for one rebuild, then pruned
+            self.assertEqual(rebuild.generations(), ['.', first['generation']])
+            second = rebuild_index()
+            self.assertEqual(rebuild.generations(), [first['generation'], second['generation']])
+            self.assertEqual(rebuild.rollback_index(), first['generation'])
+            self.assertEqual(rebuild.generations(), [first['generation']])
+            with get_index().searcher() as searcher:
+                self.assertNotIn('content', searcher.document(title='late.txt'))
+            self.assertEqual(self.client.get('/api/search/?q=arrival').data['total'], 1)
+
+
+def _fake_extract(path):
+    if path == 'hang':
+        time.sleep(30)
+    if path == 'crash':
+        os._exit(1)
+    return f"text of {path}"
+
+
+class ExtractionPoolTests(TestCase):
+    def test_bad_files_do_not_stall_the_batch(self):
+        items = [(p, p) for p in ['a', 'hang', 'b', 'crash', 'c']]
+        with mock.patch('core.extraction_cache.extract_text_from_file', _fake_extract):
+            with ExtractionPool(workers=2, timeout=1) as pool:
+                results = {key: (text, error) for key, text, error in pool.imap(items)}
+
+        self.assertEqual(set(results), {'a', 'b', 'c', 'hang', 'crash'})
+        self.assertEqual(results['b'], ('text of b', None))
+        self.assertIn('timed out', results['hang'][1])
+        self.assertIn('crashed', results['crash'][1])
+
+
+    def test_workers_only_start_for_expensive_files(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        paths = []
+        for i in range(3):
+            paths.append(os.path.join(tmp, f'note{i}.txt'))
+            with open(paths[-1], 'w') as f:
+                f.write(f'note {i}')
+        with ExtractionPool(workers=2) as pool:
+            results = {key: text for key, text, _ in pool.imap((p, p) for p in paths)}
+            self.assertEqual(pool._pool, [])
+        self.assertEqual(results[paths[1]], 'note 1')
+
+
+class StreamingExtractionTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.test_file_path = os.path.join(tmp, 'test_large.txt')
+        with open(self.test_file_path, 'w', encoding='utf-8') as f:
+            f.write("é" * 100_000)
+
+    def test_text_is_streamed_in_chunks(self):
+        chunks = list(iter_text_chunks(self.test_file_path, max_bytes=0))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual("".join(text for _, text in chunks), "é" * 100_000)
+
+    def test_extraction_respects_byte_cap(self):
+        text = extract_text_from_file(self.test_file_path, max_bytes=1001)
+        self.assertEqual(text, "é" * 500)
+
+    def test_extractor_is_chosen_by_content(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        files = {
+            'notes.dat': b'plain notes, misnamed',
+            'scan.txt': b'%PDF-1.4 not really a pdf',
+            'image.txt': b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 64,
+            'blob.md': b'header\x00\x01\x02' * 100,
+        }
+        for name, data in files.items():
+            with open(os.path.join(tmp, name), 'wb') as f:
+                f.write(data)
+        path = lambda name: os.path.join(tmp, name)
+
+        self.assertEqual(extractors.for_path(path('notes.dat')).name, 'text')
+        self.assertEqual(extractors.for_path(path('scan.txt')).name, 'pdf')
+        self.assertEqual(extractors.sniff(path('image.txt')), 'image/png')
+        self.assertIsNone(extractors.for_path(path('blob.md')))
+        self.assertEqual(extract_text_from_file(path('notes.dat')), 'plain notes, misnamed')
+        self.assertEqual(extract_text_from_file(path('blob.md')), '')
+
+
+
+class ExtractionCacheTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.pdf_path = os.path.join(self.tmp, 'doc.pdf')
+        with open(self.pdf_path, 'wb') as f:
+            f.write(b'%PDF-1.4 not really a pdf')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_cached_text_is_reused_until_the_version_changes(self):
+        with override_settings(EXTRACTION_CACHE_DIR=os.path.join(self.tmp, 'cache')), \
+                mock.patch('core.extraction_cache.extract_text_from_file', return_value='pdf text') as extract:
+            self.assertEqual(extraction_cache.extract(self.pdf_path), 'pdf text')
+            self.assertEqual(extraction_cache.extract(self.pdf_path), 'pdf text')
+            self.assertEqual(extract.call_count, 1)
+
+            with mock.patch('core.extraction_cache.EXTRACTOR_VERSION', extraction_cache.EXTRACTOR_VERSION + 1):
+                extraction_cache.extract(self.pdf_path)
+            self.assertEqual(extract.call_count, 2)
+
+            # Eviction drops the least recently used entry first
+            old, new = extraction_cache.cache_key('a' * 32), extraction_cache.cache_key('b' * 32)
+            extraction_cache.put(old, 'x' * 1000)
+            extraction_cache.put(new, 'y' * 1000)
+            os.utime(extraction_cache._path(old), ns=(0, 0))
+            extraction_cache.evict(os.path.getsize(extraction_cache._path(new)))
+            self.assertIsNone(extraction_cache.get(old))
+            self.assertEqual(extraction_cache.get(new), 'y' * 1000)
@@ -0,0 +1,41 @@
+import hashlib
+import os
+import threading
+import zlib
+from django.conf import settings
+
+# Compressed extracted text per index document, used for snippets when the
+# index doesn't store content (SEARCH_STORE_CONTENT = False). Kept in
+# TEXT_STORE_DIR
+COMPRESS_LEVEL = 6
+
+def store_dir():
+    return str(settings.TEXT_STORE_DIR)
+
+def _path(doc_id):
+    doc_id = str(doc_id)
+    bucket = hashlib.blake2b(doc_id.encode('utf-8'), digest_size=1).hexdigest()
+    return os.path.join(store_dir(), bucket, f'{doc_id}.z')
+
+def put(doc_id, text):
+    path = _path(doc_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Unique per writer: threads of one process may write the same document
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(zlib.compress(text.encode('utf-8'), COMPRESS_LEVEL))
+    os.replace(tmp_path, path)
+
+def get(doc_id):
+    try:
+        with open(_path(doc_id), 'rb') as f:
+            return zlib.decompress(f.read()).decode('utf-8')
+    except (FileNotFoundError, zlib.error):
+        return None
+
+def delete(doc_ids):
+    for doc_id in doc_ids:
+        try:
+            os.remove(_path(doc_id))
+        except FileNotFoundError:
+            pass
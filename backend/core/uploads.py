@@ -0,0 +1,260 @@
+import hashlib
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection, transaction
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from .models import File, Upload
+from .utils import HASH_CHUNK_SIZE
+
+
+class OffsetMismatch(ValueError):
+    """
+    A chunk was sent for an offset other than where the upload stands.
+    """
+
+    def __init__(self, offset):
+        super().__init__(f'Upload is at offset {offset}')
+        self.offset = offset
+
+
+def _new_hasher():
+    # Same hash as utils.hash_file, so it matches content_hash from ingest
+    return hashlib.blake2b(digest_size=16)
+
+def clean_name(name):
+    """
+    File name part of a client supplied name, so uploads stay in MEDIA_ROOT.
+    """
+    name = os.path.basename((name or '').replace('\\', '/')).strip()
+    if not name or name in ('.', '..'):
+        raise ValueError('Invalid file name')
+    return name
+
+def part_path(upload_id):
+    return os.path.join(settings.UPLOAD_TEMP_DIR, f'{upload_id}.part')
+
+def _free_path(path):
+    # notes.txt -> notes (1).txt, notes (2).txt, ...
+    stem, ext = os.path.splitext(path)
+    n = 1
+    while os.path.lexists(path) or File.objects.filter(path=path).exists():
+        path = f'{stem} ({n}){ext}'
+        n += 1
+    return path
+
+def _in_media(path):
+    media_root = os.path.join(os.path.abspath(settings.MEDIA_ROOT), '')
+    return os.path.abspath(path).startswith(media_root)
+
+def store_file(tmp_path, name, content_hash):
+    """
+    Move a fully received upload from `tmp_path` into MEDIA_ROOT and record
+    it. Returns (file, created).
+
+    Content is deduplicated by hash: re-uploading a file under the same name
+    returns the existing File, and the same bytes under a new name become a
+    hard link to the upload that already has them, so they are stored once.
+    The two rows then share an inode, which sync_directory knows not to
+    take as a rename.
+    Indexing is queued like for any new File; a copy of indexed content is
+    recognised there by its hash and not extracted again (see core.dedupe).
+    """
+    os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+    path = os.path.join(settings.MEDIA_ROOT, clean_name(name))
+
+    existing = File.objects.filter(path=path).first()
+    if existing is not None and existing.content_hash == content_hash and os.path.exists(path):
+        os.remove(tmp_path)
+        return existing, False
+    if existing is not None or os.path.lexists(path):
+        path = _free_path(path)
+
+    duplicate = File.objects.filter(content_hash=content_hash).order_by('id').first()
+    linked = False
+    if duplicate is not None and _in_media(duplicate.path):
+        try:
+            os.link(duplicate.path, path)
+            os.remove(tmp_path)
+            linked = True
+        except OSError:
+            pass
+    if not linked:
+        os.replace(tmp_path, path)
+
+    stats = os.stat(path)
+    file_obj = File(
+        path=path,
+        name=os.path.basename(path),
+        file_type=os.path.splitext(path)[1].lstrip('.').lower(),
+        size=stats.st_size,
+        mtime_ns=stats.st_mtime_ns,
+        inode=stats.st_ino,
+        content_hash=content_hash,
+    )
+    # post_save queues extraction and indexing
+    file_obj.save()
+    return file_obj, True
+
+
+# Upload id -> (offset, hasher) for chunked uploads in progress in this process
+_hashers = {}
+_hashers_lock = threading.Lock()
+# Striped by upload id, so concurrent chunks of one upload take turns
+_chunk_locks = [threading.Lock() for _ in range(64)]
+
+@contextmanager
+def _locked_upload(upload_id):
+    # The thread lock covers this process, the row lock other processes on
+    # databases that have one. Yields the row as it stands under the lock.
+    with _chunk_locks[upload_id % len(_chunk_locks)]:
+        if connection.features.has_select_for_update:
+            with transaction.atomic():
+                yield Upload.objects.select_for_update().get(pk=upload_id)
+        else:
+            yield Upload.objects.get(pk=upload_id)
+
+def _resume_hasher(upload):
+    with _hashers_lock:
+        entry = _hashers.pop(upload.pk, None)
+    if entry is not None and entry[0] == upload.offset:
+        return entry[1]
+    # Resumed in another process or after a restart: hash what is on disk so far
+    hasher = _new_hasher()
+    remaining = upload.offset
+    with open(part_path(upload.pk), 'rb') as f:
+        while remaining:
+            chunk = f.read(min(HASH_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            remaining -= len(chunk)
+    return hasher
+
+def start_upload(name, size):
+    """
+    Register a chunked upload of `size` bytes and create its partial file.
+    """
+    if size < 0:
+        raise ValueError('Invalid size')
+    upload = Upload.objects.create(name=clean_name(name), size=size)
+    os.makedirs(settings.UPLOAD_TEMP_DIR, exist_ok=True)
+    open(part_path(upload.pk), 'wb').close()
+    if size == 0:
+        _finish(upload, _new_hasher())
+    return upload
+
+def append_chunk(upload, stream, offset, length):
+    """
+    Append `length` bytes read from `stream` at `offset`, hashing them as they
+    are written. If the client goes away mid-chunk, whatever arrived is kept
+    and the upload can resume from there. Completes the upload once all bytes
+    are in. Returns the upload.
+
+    Chunks of one upload are written one at a time; a chunk that arrives
+    while another is being written waits for it, then finds the offset moved.
+    """
+    with _locked_upload(upload.pk) as current:
+        upload.offset, upload.status = current.offset, current.status
+        if upload.status != Upload.STATUS_ACTIVE:
+            raise ValueError('Upload is already complete')
+        if offset != upload.offset:
+            raise OffsetMismatch(upload.offset)
+        if length < 0 or offset + length > upload.size:
+            raise ValueError('Chunk runs past the end of the upload')
+
+        hasher = _resume_hasher(upload)
+        remaining = length
+        with open(part_path(upload.pk), 'r+b') as f:
+            f.seek(offset)
+            f.truncate()
+            while remaining:
+                chunk = stream.read(min(settings.UPLOAD_READ_SIZE, remaining))
+                if not chunk:
+                    break
+                f.write(chunk)
+                hasher.update(chunk)
+                remaining -= len(chunk)
+        new_offset = offset + length - remaining
+
+        # Only move the offset on if no other request did in the meantime
+        # (another process, on a database without row locks)
+        if not Upload.objects.filter(pk=upload.pk, offset=offset).update(offset=new_offset):
+            upload.refresh_from_db()
+            raise OffsetMismatch(upload.offset)
+        upload.offset = new_offset
+
+    if new_offset == upload.size:
+        _finish(upload, hasher)
+    else:
+        with _hashers_lock:
+            _hashers[upload.pk] = (new_offset, hasher)
+    return upload
+
+def _finish(upload, hasher):
+    upload.content_hash = hasher.hexdigest()
+    upload.file, _ = store_file(part_path(upload.pk), upload.name, upload.content_hash)
+    upload.status = Upload.STATUS_COMPLETE
+    upload.save()
+
+def abort_upload(upload):
+    with _hashers_lock:
+        _hashers.pop(upload.pk, None)
+    try:
+        os.remove(part_path(upload.pk))
+    except FileNotFoundError:
+        pass
+    upload.delete()
+
+
+class StreamedUpload(UploadedFile):
+    """
+    A multipart file already written to its partial file by StreamingUploadHandler.
+    """
+
+    def __init__(self, path, name, content_type, size, charset, content_hash):
+        super().__init__(None, name, content_type, size, charset)
+        self.path = path
+        self.content_hash = content_hash
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class StreamingUploadHandler(FileUploadHandler):
+    """
+    Streams multipart file data straight into UPLOAD_TEMP_DIR (on the same
+    filesystem as MEDIA_ROOT), hashing it on the way, instead of Django's
+    temporary file that would then be copied into place.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        os.makedirs(settings.UPLOAD_TEMP_DIR, exist_ok=True)
+        self.path = os.path.join(settings.UPLOAD_TEMP_DIR, f'{uuid.uuid4().hex}.part')
+        self.file = open(self.path, 'wb')
+        self.hasher = _new_hasher()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file.write(raw_data)
+        self.hasher.update(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        self.file.close()
+        return StreamedUpload(
+            self.path, self.file_name, self.content_type, file_size, self.charset, self.hasher.hexdigest())
+
+    def upload_interrupted(self):
+        if getattr(self, 'file', None) is not None:
+            self.file.close()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
@@ -1,12 +1,30 @@
+from django.conf import settings
 from django.urls import path
-from .views import FileUploadView, FileListView, SearchFileView, OpenFileView, IngestView, PickDirectoryView
+from . import async_views
+from .views import (
+    FileUploadView, UploadCreateView, UploadDetailView, FileListView, FileDetailView, SearchFileView,
+    SuggestView, SearchCacheStatsView, IndexStatsView, MetricsView, OpenFileView, IngestView, JobDetailView, PickDirectoryView,
+)
+
+if settings.ASYNC_API:
+    search_view, file_list_view, job_detail_view = async_views.search, async_views.file_list, async_views.job_detail
+else:
+    search_view, file_list_view, job_detail_view = SearchFileView.as_view(), FileListView.as_view(), JobDetailView.as_view()
 
 urlpatterns = [
     
     path('upload/', FileUploadView.as_view(), name='file-upload'),
-    path('files/', FileListView.as_view(), name='file-list'),
-    path('search/', SearchFileView.as_view(), name='file-search'),
+    path('uploads/', UploadCreateView.as_view(), name='upload-create'),
+    path('uploads/<int:pk>/', UploadDetailView.as_view(), name='upload-detail'),
+    path('files/', file_list_view, name='file-list'),
+    path('files/<int:pk>/', FileDetailView.as_view(), name='file-detail'),
+    path('search/', search_view, name='file-search'),
+    path('suggest/', SuggestView.as_view(), name='suggest'),
+    path('search/cache/', SearchCacheStatsView.as_view(), name='search-cache-stats'),
+    path('index/stats/', IndexStatsView.as_view(), name='index-stats'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('open/', OpenFileView.as_view(), name='file-open'),
     path('ingest/', IngestView.as_view(), name='file-ingest'),
+    path('jobs/<int:pk>/', job_detail_view, name='job-detail'),
     path('pick-directory/', PickDirectoryView.as_view(), name='pick-directory'),
 ]
\ No newline at end of file
@@ -1,36 +1,171 @@
 import os
-from pypdf import PdfReader
+import codecs
+import hashlib
+import logging
+import re
+from django.conf import settings
+from . import extractors, metrics
 
-def extract_text_from_file(file_path):
+HASH_CHUNK_SIZE = 1024 * 1024
+TEXT_CHUNK_SIZE = 64 * 1024
+# Bump when extraction output changes, so cached text is extracted again
+EXTRACTOR_VERSION = 3
+# Ends each PDF page in extracted text (like pdftotext), so passages know their page
+PAGE_BREAK = '\f'
+_WORD_START = re.compile(r'(?<=\s)\S')
+_NON_SPACE = re.compile(r'\S')
+
+logger = logging.getLogger(__name__)
+extraction_errors = metrics.counter('pkse_extraction_errors_total', 'Files whose text could not be extracted.')
+
+def hash_file(file_path):
+    """
+    Fast content hash (BLAKE2b, 128 bit) read in 1 MB chunks.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def directory_size(path):
+    """
+    Total size in bytes of the files under a directory.
+    """
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for filename in files:
+            try:
+                total += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return total
+
+def extract_text_from_file(file_path, max_bytes=None, page_chars=None):
+    """
+    Extract text from a file with the extractor for its sniffed type.
+    """
+    with metrics.timed('extract'):
+        return "".join(text for _, text in iter_text_chunks(file_path, max_bytes, page_chars))
+
+def iter_text_chunks(file_path, max_bytes=None, page_chars=None):
     """
-    Extract text from a file based on its extension.
+    Stream the text of a file as (page, text) chunks. PDFs yield one chunk per
+    page (page numbers start at 1), text files yield fixed-size chunks with
+    page None. Files without an extractor (binary, unreadable) yield nothing.
+
+    At most `max_bytes` of UTF-8 text are produced per file and each PDF page
+    is cut to `page_chars` characters, so memory stays bounded however large
+    the input is. Both default to the EXTRACTION_* settings; pass 0 to disable.
     """
-    _, ext = os.path.splitext(file_path)
-    ext = ext.lower()
+    if max_bytes is None:
+        max_bytes = settings.EXTRACTION_MAX_BYTES
+    if page_chars is None:
+        page_chars = settings.EXTRACTION_PAGE_CHARS
+
+    try:
+        extractor = extractors.for_mime(extractors.sniff(file_path))
+    except OSError as e:
+        extraction_errors.inc(file_type='unreadable')
+        logger.warning('Error reading file', extra={'path': file_path, 'error': str(e)})
+        return
+    if extractor is None:
+        return
+    chunks = extractor.chunks(file_path, max_bytes, page_chars)
 
-    if ext == '.pdf':
-        return _extract_from_pdf(file_path)
-    elif ext in ['.txt', '.md', '.py', '.js', '.html', '.css', '.json']:
-        return _extract_from_text(file_path)
-    else:
-        return ""
+    remaining = max_bytes or None
+    try:
+        for page, text in chunks:
+            if remaining is not None:
+                data = text.encode('utf-8')
+                if len(data) >= remaining:
+                    # Cut on the byte budget without splitting a character
+                    yield page, data[:remaining].decode('utf-8', errors='ignore')
+                    return
+                remaining -= len(data)
+            yield page, text
+    finally:
+        chunks.close()
+
+def pdf_chunks(file_path, max_bytes=None, page_chars=None):
+    # Imported here, it is slow to import and most processes never read a PDF
+    from pypdf import PdfReader
 
-def _extract_from_pdf(file_path):
     try:
         reader = PdfReader(file_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+        for number, page in enumerate(reader.pages, start=1):
+            text = page.extract_text() or ""
+            if page_chars:
+                text = text[:page_chars]
+            yield number, text.replace(PAGE_BREAK, ' ') + PAGE_BREAK
     except Exception as e:
-        print(f"Error reading PDF {file_path}: {e}")
-        return ""
+        extraction_errors.inc(file_type='pdf')
+        logger.warning('Error reading PDF', extra={'path': file_path, 'error': str(e)})
 
-def _extract_from_text(file_path):
+def text_chunks(file_path, max_bytes=None, page_chars=None):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    remaining = max_bytes or None
     try:
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            return f.read()
+        with open(file_path, 'rb') as f:
+            while True:
+                size = TEXT_CHUNK_SIZE if remaining is None else min(TEXT_CHUNK_SIZE, remaining)
+                data = f.read(size)
+                if not data:
+                    break
+                if remaining is not None:
+                    remaining -= len(data)
+                yield None, decoder.decode(data)
+        yield None, decoder.decode(b'', final=True)
     except Exception as e:
-        print(f"Error reading text file {file_path}: {e}")
-        return ""
+        extraction_errors.inc(file_type='text')
+        logger.warning('Error reading text file', extra={'path': file_path, 'error': str(e)})
 
+def split_passages(text, size, overlap):
+    """
+    Split text into passages of about `size` characters, cut at whitespace,
+    each starting about `overlap` characters before the previous one ended.
+    Pages (separated by PAGE_BREAK) are split on their own, so a passage
+    never spans two pages.
+
+    Yields (page, start, passage) with the page number (None for text
+    without page breaks) and the passage's offset in `text`.
+    """
+    pages = text.split(PAGE_BREAK)
+    paged = len(pages) > 1
+    offset = 0
+    for number, page_text in enumerate(pages, start=1):
+        length = len(page_text)
+        match = _NON_SPACE.search(page_text)
+        start = match.start() if match else length
+        while start < length:
+            end = min(start + size, length)
+            if end < length:
+                cut = max(page_text.rfind(c, start + size // 2, end) for c in ' \n\t')
+                if cut > start:
+                    end = cut
+            yield (number if paged else None), offset + start, page_text[start:end]
+            if end >= length:
+                break
+            # Back up by the overlap to the start of a word, or carry on where
+            # this passage was cut if there is none in between
+            match = (_WORD_START.search(page_text, max(end - overlap, start + 1), end + 1)
+                     or _NON_SPACE.search(page_text, end))
+            start = match.start() if match else length
+        offset += length + len(PAGE_BREAK)
+
+def join_passages(passages):
+    """
+    Put text split by split_passages() back together from its (page, start,
+    passage) tuples. Whitespace between passages comes back as spaces and
+    page breaks, so offsets and pages are kept.
+    """
+    text = ''
+    last_page = None
+    for page, start, passage in sorted(passages, key=lambda p: p[1]):
+        if start > len(text):
+            breaks = page - (last_page or 1) if page else 0
+            text += PAGE_BREAK * breaks + ' ' * (start - len(text) - breaks)
+        text += passage[len(text) - start:]
+        last_page = page or last_page
+    # Extracted PDF text ends every page with a break, the last one too
+    return text + PAGE_BREAK if last_page else text
@@ -1,77 +1,222 @@
 import os
+import time
+from datetime import datetime, time as time_of_day
 from rest_framework.views import APIView
 from rest_framework import generics  # <--- Add this
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from django.conf import settings
 from django.core.files.storage import default_storage
-from .models import File
-from .serializers import FileSerializer
-from .search import get_index
-from .ingest import ingest_directory
-from whoosh.qparser import MultifieldParser
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import File, Job, Upload
+from .serializers import FileSerializer, JobSerializer, UploadSerializer
+from .pagination import FileCursorPagination
+from . import dedupe, metrics, query_cache, suggest
+from .maintenance import index_stats
+from .tasks import enqueue, ingest_directory_task
+from .uploads import (
+    OffsetMismatch, StreamingUploadHandler, abort_upload, append_chunk, start_upload, store_file,
+)
 import subprocess
-import tkinter as tk
-from tkinter import filedialog
 
 class FileUploadView(APIView):
     def post(self, request, *args, **kwargs):
+        # Stream the file into place while hashing it, no temp file copy
+        request.upload_handlers = [StreamingUploadHandler(request)]
         file_obj = request.FILES.get('file')
         if not file_obj:
             return Response({"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST)
+        for other in request.FILES.values():
+            if other is not file_obj:
+                other.discard()
 
-        # Save file to media directory
-        file_name = file_obj.name
-        save_path = os.path.join(settings.MEDIA_ROOT, file_name)
-        
-        # Ensure media directory exists
-        os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
-
-        # Save the file manually to ensure we get the absolute path
-        with open(save_path, 'wb+') as destination:
-            for chunk in file_obj.chunks():
-                destination.write(chunk)
-
-        # Create File model instance
-        # This will trigger the post_save signal to index the file
-        file_instance = File.objects.create(
-            name=file_name,
-            path=save_path,
-            size=file_obj.size,
-            file_type=os.path.splitext(file_name)[1].replace('.', '')
-        )
+        try:
+            # A new File triggers the post_save signal to queue indexing,
+            # unless the same content was indexed before
+            file_instance, created = store_file(file_obj.path, file_obj.name, file_obj.content_hash)
+        except ValueError as e:
+            file_obj.discard()
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         serializer = FileSerializer(file_instance)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        # Indexing happens in the background, poll the file for indexed_at
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
+
+class UploadCreateView(APIView):
+    """
+    Start a resumable upload: POST {"name": ..., "size": ...}, then PATCH the
+    bytes to /api/uploads/<id>/ in chunks.
+    """
+    def post(self, request, *args, **kwargs):
+        try:
+            upload = start_upload(request.data.get('name'), int(request.data.get('size')))
+        except (TypeError, ValueError) as e:
+            return Response({"error": str(e) or "name and size are required"}, status=status.HTTP_400_BAD_REQUEST)
+        return _upload_response(upload, status.HTTP_201_CREATED)
+
+class UploadDetailView(APIView):
+    """
+    GET the upload's offset to resume, PATCH a chunk (raw body, starting at
+    the Upload-Offset header), DELETE to abort.
+    """
+    def get(self, request, pk, *args, **kwargs):
+        upload = generics.get_object_or_404(Upload, pk=pk)
+        return _upload_response(upload, status.HTTP_200_OK)
+
+    def patch(self, request, pk, *args, **kwargs):
+        upload = generics.get_object_or_404(Upload, pk=pk)
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.headers.get('Content-Length') or 0)
+        except (KeyError, ValueError):
+            return Response({"error": "Upload-Offset and Content-Length headers are required"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # Read the raw request stream, request.data would buffer the body
+            upload = append_chunk(upload, request.stream, offset, length)
+        except OffsetMismatch as e:
+            response = Response({"error": str(e), "offset": e.offset}, status=status.HTTP_409_CONFLICT)
+            response['Upload-Offset'] = str(e.offset)
+            return response
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return _upload_response(upload, status.HTTP_200_OK)
+
+    def delete(self, request, pk, *args, **kwargs):
+        upload = generics.get_object_or_404(Upload, pk=pk)
+        if upload.status == Upload.STATUS_COMPLETE:
+            return Response({"error": "Upload is already complete"}, status=status.HTTP_400_BAD_REQUEST)
+        abort_upload(upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+def _upload_response(upload, status_code):
+    response = Response(UploadSerializer(upload).data, status=status_code)
+    response['Upload-Offset'] = str(upload.offset)
+    return response
 
 class FileListView(generics.ListAPIView):
-    queryset = File.objects.all().order_by('-created_at')
+    """
+    Files, newest first, cursor paginated. Filters: file_type (comma
+    separated), min_size, max_size, created_after, created_before.
+    """
+    queryset = File.objects.all()
     serializer_class = FileSerializer
+    pagination_class = FileCursorPagination
+
+    def get_queryset(self):
+        return filter_files(super().get_queryset(), self.request.query_params)
+
+def filter_files(queryset, params):
+    """
+    Apply the file list filters in `params` to a File queryset. Raises
+    ValidationError for malformed values.
+    """
+    if params.get('file_type'):
+        queryset = queryset.filter(file_type__in=params['file_type'].lower().split(','))
+
+    for param, lookup in (('min_size', 'size__gte'), ('max_size', 'size__lte')):
+        if params.get(param):
+            try:
+                queryset = queryset.filter(**{lookup: int(params[param])})
+            except ValueError:
+                raise ValidationError({param: 'Must be an integer'})
+
+    for param, lookup in (('created_after', 'created_at__gte'), ('created_before', 'created_at__lt')):
+        if params.get(param):
+            value = parse_datetime(params[param])
+            if value is None:
+                day = parse_date(params[param])
+                value = datetime.combine(day, time_of_day.min) if day else None
+            if value is None:
+                raise ValidationError({param: 'Must be an ISO date or datetime'})
+            if timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            queryset = queryset.filter(**{lookup: value})
+
+    return queryset
+
+class FileDetailView(generics.RetrieveAPIView):
+    queryset = File.objects.all()
+    serializer_class = FileSerializer
+
+def _flag(value, default=True):
+    if value is None:
+        return default
+    return value.lower() not in ('0', 'false', 'no', 'off')
+
+MAX_SEARCH_PAGE_SIZE = 100
+
+def search_options(params):
+    """
+    The query string and cached_search() options from request parameters.
+    Raises ValueError with a message for the client.
+    """
+    query_string = params.get('q', '')
+    if not query_string:
+        raise ValueError("Query parameter 'q' is required")
+
+    try:
+        page = max(1, int(params.get('page', 1)))
+        page_size = min(MAX_SEARCH_PAGE_SIZE, max(1, int(params.get('page_size', 20))))
+    except ValueError:
+        raise ValueError("'page' and 'page_size' must be integers")
+
+    return query_string, {
+        'page': page,
+        'page_size': page_size,
+        # highlights=0 skips snippets for a faster response
+        'highlight': _flag(params.get('highlights')),
+        'facets': _flag(params.get('facets')),
+    }
+
+def search_results(query_string, **options):
+    # Duplicates aren't in the index, so they're attached after the cache
+    return dedupe.with_duplicates(query_cache.cached_search(query_string, **options))
 
 class SearchFileView(APIView):
+    def get(self, request, *args, **kwargs):
+        try:
+            query_string, options = search_options(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        start = time.perf_counter()
+        results_data = search_results(query_string, **options)
+        results_data = {**results_data, "query_time_ms": round((time.perf_counter() - start) * 1000, 2)}
+        return Response(results_data, status=status.HTTP_200_OK)
+
+MAX_SUGGESTIONS = 20
+
+class SuggestView(APIView):
     def get(self, request, *args, **kwargs):
         query_string = request.query_params.get('q', '')
         if not query_string:
             return Response({"error": "Query parameter 'q' is required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(MAX_SUGGESTIONS, max(1, int(request.query_params.get('limit', 8))))
+        except ValueError:
+            return Response({"error": "'limit' must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {"query": query_string, "suggestions": suggest.suggest(query_string, limit)},
+            status=status.HTTP_200_OK,
+        )
 
-        ix = get_index()
-        results_data = []
-        
-        with ix.searcher() as searcher:
-            query = MultifieldParser(["title", "content"], ix.schema).parse(query_string)
-            results = searcher.search(query, limit=20)
-            
-            for r in results:
-                # Highlight matches in content
-                snippet = r.highlights("content")
-                results_data.append({
-                    "id": r.get("id"),
-                    "title": r.get("title"),
-                    "path": r.get("path"),
-                    "snippet": snippet
-                })
+class SearchCacheStatsView(APIView):
+    def get(self, request, *args, **kwargs):
+        return Response(query_cache.stats(), status=status.HTTP_200_OK)
 
-        return Response(results_data, status=status.HTTP_200_OK)
+class IndexStatsView(APIView):
+    def get(self, request, *args, **kwargs):
+        return Response(index_stats(), status=status.HTTP_200_OK)
+
+class MetricsView(APIView):
+    def get(self, request, *args, **kwargs):
+        # Prometheus text exposition format, for scraping
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 class OpenFileView(APIView):
     def post(self, request, *args, **kwargs):
@@ -94,22 +239,38 @@ class IngestView(APIView):
         path = request.data.get('path')
         if not path:
             return Response({"error": "Path is required"}, status=status.HTTP_400_BAD_REQUEST)
-        
-        try:
-            count, errors = ingest_directory(path)
-            return Response({
-                "status": "success",
-                "count": count,
-                "errors": errors
-            }, status=status.HTTP_200_OK)
-        except FileNotFoundError:
+
+        if not os.path.isdir(path):
             return Response({"error": "Directory not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        job = Job.objects.create(kind=Job.KIND_INGEST, params={
+            "path": path,
+            "incremental": bool(request.data.get('incremental')),
+            "hash": bool(request.data.get('hash')),
+            "purge": bool(request.data.get('purge')),
+        })
+        try:
+            enqueue(ingest_directory_task, job.id)
         except Exception as e:
+            job.status = Job.STATUS_FAILURE
+            job.error = str(e)
+            job.save()
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        job.refresh_from_db()
+        return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+class JobDetailView(generics.RetrieveAPIView):
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+
 class PickDirectoryView(APIView):
     def post(self, request, *args, **kwargs):
         try:
+            # Imported here: only this view needs it, and it slows every process's startup
+            import tkinter as tk
+            from tkinter import filedialog
+
             # Create a root window and hide it
             root = tk.Tk()
             root.withdraw()
@@ -0,0 +1,191 @@
+import os
+import queue
+import time
+from django.conf import settings
+from .ingest import ingest_paths, move_paths, remove_paths, sync_directory
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # Optional, watch_files falls back to polling
+    FileSystemEventHandler = object
+    Observer = None
+
+
+class ChangeBatcher:
+    """
+    Coalesces filesystem events into batches.
+
+    Only the last state of each path counts: a file created, modified five
+    times and deleted within one batch is just a delete. A batch is ready
+    once no event has arrived for `debounce` seconds, or `max_delay` seconds
+    after its first event, so a constant stream of writes still gets flushed.
+    """
+
+    def __init__(self, debounce=None, max_delay=None):
+        self.debounce = debounce if debounce is not None else settings.WATCH_DEBOUNCE
+        self.max_delay = max_delay if max_delay is not None else settings.WATCH_MAX_DELAY
+        self._reset()
+
+    def _reset(self):
+        self.upserts = set()
+        self.deletes = set()
+        self.moves = {}
+        self.first_event = None
+        self.last_event = None
+
+    def __bool__(self):
+        return bool(self.upserts or self.deletes or self.moves)
+
+    def add(self, kind, path, dest=None):
+        if kind == 'moved':
+            # Written to since the last batch: the row moves, and then the new
+            # path is ingested for its changed content
+            if path in self.upserts:
+                self.upserts.discard(path)
+                self.upserts.add(dest)
+            # Chained renames (a -> b -> c) collapse into a -> c
+            for src, target in self.moves.items():
+                if target == path:
+                    path = src
+                    break
+            self.moves[path] = dest
+            self.deletes.discard(dest)
+        elif kind == 'deleted':
+            self.upserts.discard(path)
+            self.deletes.add(path)
+        else:
+            self.deletes.discard(path)
+            self.upserts.add(path)
+
+        now = time.monotonic()
+        if self.first_event is None:
+            self.first_event = now
+        self.last_event = now
+
+    def timeout(self):
+        """
+        Seconds until the pending batch is ready, or None when there is none.
+        """
+        if not self:
+            return None
+        now = time.monotonic()
+        return max(0, min(self.last_event + self.debounce, self.first_event + self.max_delay) - now)
+
+    def drain(self):
+        batch = (self.upserts, self.deletes, self.moves)
+        self._reset()
+        return batch
+
+
+def apply_changes(upserts, deletes, moves, stdout=None):
+    """
+    Write a batch of changes to the database and the index.
+    """
+    errors = []
+    if moves:
+        moved, unmatched = move_paths(moves)
+        # Renamed from a path we have no row for, e.g. an editor's hidden
+        # temporary file saved over the real one
+        upserts = set(upserts) | set(unmatched)
+        if stdout:
+            stdout.write(f'Moved {len(moved)} files')
+    if deletes:
+        removed = remove_paths(deletes)
+        if stdout:
+            stdout.write(f'Removed {len(removed)} files')
+    if upserts:
+        written = ingest_paths(upserts, errors)
+        if stdout:
+            stdout.write(f'Indexed {len(written)} files')
+    for error in errors:
+        if stdout:
+            stdout.write(stdout.style.ERROR(error))
+
+
+class _QueueHandler(FileSystemEventHandler):
+    """
+    Forwards watchdog events to the batching loop. Runs on the observer thread.
+    """
+
+    def __init__(self, events):
+        self.events = events
+
+    def on_any_event(self, event):
+        src = os.fsdecode(event.src_path)
+        if event.event_type == 'moved':
+            self.events.put(('moved', src, os.fsdecode(event.dest_path)))
+        elif event.event_type == 'deleted':
+            self.events.put(('deleted', src, None))
+        elif event.event_type in ('created', 'modified', 'closed'):
+            # A directory's own modified event just means its listing changed
+            if event.is_directory and event.event_type != 'created':
+                return
+            if os.path.basename(src).startswith('.'):
+                return
+            self.events.put(('upsert', src, None))
+
+
+def watch(roots, stdout=None, debounce=None, max_delay=None, poll=False, poll_interval=None, initial_scan=True, stop=None):
+    """
+    Keep the database and index in step with `roots` until `stop` (a
+    threading.Event) is set or the process is interrupted.
+
+    Uses inotify (through watchdog) when available: after the initial scan,
+    the process sleeps until something changes. Otherwise, or with `poll`,
+    it re-syncs each root every `poll_interval` seconds.
+    """
+    roots = [os.path.abspath(root) for root in roots]
+    poll_interval = poll_interval or settings.WATCH_POLL_INTERVAL
+
+    if initial_scan:
+        for root in roots:
+            report = sync_directory(root, purge=True)
+            if stdout:
+                stdout.write(
+                    f"Initial scan of {root}: {report['created']} new, {report['updated']} changed, "
+                    f"{len(report['deleted'])} deleted"
+                )
+
+    if poll or Observer is None:
+        if stdout:
+            stdout.write(f'Polling every {poll_interval}s')
+        while True:
+            if stop is not None:
+                if stop.wait(poll_interval):
+                    return
+            else:
+                time.sleep(poll_interval)
+            for root in roots:
+                sync_directory(root, stdout=None, purge=True)
+        return
+
+    events = queue.Queue()
+    observer = Observer()
+    handler = _QueueHandler(events)
+    for root in roots:
+        observer.schedule(handler, root, recursive=True)
+    observer.start()
+    if stdout:
+        stdout.write(f"Watching {', '.join(roots)}")
+
+    batcher = ChangeBatcher(debounce, max_delay)
+    try:
+        while not (stop and stop.is_set()):
+            timeout = batcher.timeout()
+            if stop is not None and (timeout is None or timeout > 1):
+                # Wake up now and then to notice stop
+                timeout = 1
+            try:
+                kind, path, dest = events.get(timeout=timeout)
+                batcher.add(kind, path, dest)
+                continue
+            except queue.Empty:
+                pass
+            if batcher and batcher.timeout() == 0:
+                apply_changes(*batcher.drain(), stdout=stdout)
+    finally:
+        observer.stop()
+        observer.join()
+        if batcher:
+            apply_changes(*batcher.drain(), stdout=stdout)
@@ -14,17 +14,99 @@ export interface FileItem {
     snippet?: string; // For search results
 }
 
-export const fetchFiles = async () => {
-    const response = await api.get<FileItem[]>('/files/');
+export interface FilePage {
+    next: string | null;
+    previous: string | null;
+    results: FileItem[];
+}
+
+// Pass the `next` URL of the previous page to continue listing
+export const fetchFiles = async (cursorUrl?: string) => {
+    const response = await api.get<FilePage>(cursorUrl ?? '/files/');
     return response.data;
 };
 
-export const searchFiles = async (query: string) => {
-    const response = await api.get<FileItem[]>(`/search/?q=${encodeURIComponent(query)}`);
+export interface SearchHit {
+    id: string;
+    title: string;
+    path: string;
+    file_type: string;
+    size: number;
+    score: number;
+    snippet?: string;
+    page?: number | null; // PDF page of the best passage, passage indexes only
+    duplicates?: { id: string; path: string }[]; // near-duplicate files left out of the index
+}
+
+export interface SearchResponse {
+    results: SearchHit[];
+    total: number;
+    page: number;
+    page_size: number;
+    pages: number;
+    facets?: Record<string, Record<string, number>>;
+    query_time_ms: number;
+}
+
+export const searchFiles = async (query: string, page = 1, pageSize = 20) => {
+    const response = await api.get<SearchResponse>('/search/', {
+        params: { q: query, page, page_size: pageSize },
+    });
     return response.data;
 };
 
+export interface Suggestion {
+    text: string;
+    title_docs: number;
+    content_docs: number;
+}
+
+export const suggest = async (query: string, limit = 8) => {
+    const response = await api.get<{ query: string; suggestions: Suggestion[] }>('/suggest/', {
+        params: { q: query, limit },
+    });
+    return response.data.suggestions;
+};
+
+export interface Upload {
+    id: number;
+    name: string;
+    size: number;
+    offset: number;
+    status: 'active' | 'complete';
+    file: FileItem | null;
+}
+
+// Files above this size go through the resumable chunked upload API
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+const UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024;
+
+const uploadInChunks = async (file: File) => {
+    let { data: upload } = await api.post<Upload>('/uploads/', { name: file.name, size: file.size });
+    while (upload.status !== 'complete') {
+        const chunk = file.slice(upload.offset, upload.offset + UPLOAD_CHUNK_SIZE);
+        try {
+            ({ data: upload } = await api.patch<Upload>(`/uploads/${upload.id}/`, chunk, {
+                headers: {
+                    'Content-Type': 'application/octet-stream',
+                    'Upload-Offset': String(upload.offset),
+                },
+            }));
+        } catch (error) {
+            // Connection dropped or offset out of step: ask where to resume
+            ({ data: upload } = await api.get<Upload>(`/uploads/${upload.id}/`));
+            if (!axios.isAxiosError(error) || (error.response && error.response.status !== 409)) {
+                throw error;
+            }
+        }
+    }
+    return upload.file as FileItem;
+};
+
 export const uploadFile = async (file: File) => {
+    if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+        return uploadInChunks(file);
+    }
     const formData = new FormData();
     formData.append('file', file);
     const response = await api.post<FileItem>('/upload/', formData, {
@@ -40,17 +122,36 @@ export const openFile = async (path: string) => {
     return response.data;
 };
 
-export interface IngestResponse {
-    status: string;
-    count: number;
-    errors: string[];
+export interface Job {
+    id: number;
+    kind: string;
+    status: 'pending' | 'running' | 'success' | 'failure';
+    total: number;
+    processed: number;
+    result: { count: number; errors: string[] } | null;
+    error: string;
 }
 
 export const ingestFiles = async (path: string) => {
-    const response = await api.post<IngestResponse>('/ingest/', { path });
+    const response = await api.post<Job>('/ingest/', { path });
     return response.data;
 };
 
+export const fetchJob = async (id: number) => {
+    const response = await api.get<Job>(`/jobs/${id}/`);
+    return response.data;
+};
+
+// Poll a background job until it succeeds or fails
+export const waitForJob = async (id: number, intervalMs = 1000) => {
+    let job = await fetchJob(id);
+    while (job.status === 'pending' || job.status === 'running') {
+        await new Promise((resolve) => setTimeout(resolve, intervalMs));
+        job = await fetchJob(id);
+    }
+    return job;
+};
+
 export const pickDirectory = async () => {
     const response = await api.post<{ path: string | null }>('/pick-directory/');
     return response.data;
@@ -1,6 +1,6 @@
 import React, { useState } from 'react';
 import { X, FolderOpen, Loader2, AlertCircle, CheckCircle } from 'lucide-react';
-import { ingestFiles, uploadFile } from '../api';
+import { ingestFiles, uploadFile, waitForJob } from '../api';
 import { FilePicker } from './FilePicker';
 
 interface IngestProps {
@@ -66,7 +66,15 @@ export const Ingest: React.FC<IngestProps> = ({ isOpen, onClose }) => {
         setStatus(null);
 
         try {
-            const result = await ingestFiles(path);
+            const job = await waitForJob((await ingestFiles(path)).id);
+            if (job.status === 'failure' || !job.result) {
+                setStatus({
+                    type: 'error',
+                    message: job.error || "Failed to ingest files."
+                });
+                return;
+            }
+            const result = job.result;
             setStatus({
                 type: 'success',
                 message: `Successfully processed ${result.count} files.`
@@ -1,14 +1,33 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { Search as SearchIcon, FileText, Loader2, Plus } from 'lucide-react';
-import { searchFiles, openFile, type FileItem } from '../api';
+import { searchFiles, openFile, suggest, type SearchHit, type Suggestion } from '../api';
 import { Ingest } from './Ingest';
 
 export const Search: React.FC = () => {
     const [query, setQuery] = useState('');
-    const [results, setResults] = useState<FileItem[]>([]);
+    const [results, setResults] = useState<SearchHit[]>([]);
     const [loading, setLoading] = useState(false);
     const [hasSearched, setHasSearched] = useState(false);
     const [isIngestOpen, setIsIngestOpen] = useState(false);
+    const [suggestions, setSuggestions] = useState<Suggestion[]>([]);
+
+    // Complete the word being typed, once typing pauses
+    useEffect(() => {
+        if (query.trim().length < 2) {
+            setSuggestions([]);
+            return;
+        }
+        let cancelled = false;
+        const timer = setTimeout(() => {
+            suggest(query)
+                .then((items) => { if (!cancelled) setSuggestions(items); })
+                .catch(() => { if (!cancelled) setSuggestions([]); });
+        }, 150);
+        return () => {
+            cancelled = true;
+            clearTimeout(timer);
+        };
+    }, [query]);
 
     const handleSearch = async (e: React.FormEvent) => {
         e.preventDefault();
@@ -17,7 +36,7 @@ export const Search: React.FC = () => {
         setLoading(true);
         try {
             const data = await searchFiles(query);
-            setResults(data);
+            setResults(data.results);
             setHasSearched(true);
         } catch (error) {
             console.error("Search failed:", error);
@@ -65,7 +84,14 @@ export const Search: React.FC = () => {
                             placeholder="Search your documents..."
                             value={query}
                             onChange={(e) => setQuery(e.target.value)}
+                            list="search-suggestions"
+                            autoComplete="off"
                         />
+                        <datalist id="search-suggestions">
+                            {suggestions.map((item) => (
+                                <option key={item.text} value={item.text} />
+                            ))}
+                        </datalist>
                         <div className="absolute inset-y-0 right-0 pr-4 flex items-center">
                             {loading && <Loader2 className="h-5 w-5 text-blue-500 animate-spin" />}
                         </div>
@@ -91,10 +117,19 @@ export const Search: React.FC = () => {
                                 </div>
                                 <div className="flex-1 min-w-0">
                                     <h3 className="text-lg font-semibold text-gray-900 mb-1 truncate group-hover:text-blue-600">
-                                        {file.name}
+                                        {file.title}
                                     </h3>
                                     <p className="text-xs text-gray-500 font-mono mb-3 truncate bg-gray-50 px-2 py-1 rounded inline-block">
                                         {file.path}
+                                        {file.page != null && <span className="ml-2 text-blue-600">p. {file.page}</span>}
+                                        {file.duplicates && file.duplicates.length > 0 && (
+                                            <span
+                                                className="ml-2 text-gray-400"
+                                                title={file.duplicates.map((d) => d.path).join('\n')}
+                                            >
+                                                +{file.duplicates.length} {file.duplicates.length === 1 ? 'copy' : 'copies'}
+                                            </span>
+                                        )}
                                     </p>
                                     {file.snippet && (
                                         <div